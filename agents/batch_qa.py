@@ -0,0 +1,196 @@
+# agents/batch_qa.py
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from components.vector_store import embed_chunks, search_faiss_many, search_chat_many, get_leading_chunks
+from components.memory_store import arecord_turn
+from components.executor import run_cpu
+from components.metrics import observe
+from agents.graph_builder import asummarize_documents, query_llm, is_summary_request, FALLBACK_CONTEXT_CHARS
+
+logger = logging.getLogger(__name__)
+
+# LLM calls in flight at once per batch; the rest of the batch waits for a slot
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+# Items retrieved ahead of their LLM call, which bounds the context held in memory
+BATCH_MAX_PENDING = int(os.getenv("BATCH_MAX_PENDING", "256"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "10000"))
+# Same top_k as the graph's retrieve_docs and retrieve_chat
+DOC_TOP_K = 3
+CHAT_TOP_K = 5
+
+def parse_items(lines):
+    """
+    Items from JSONL lines of {"session_id", "question"[, "id"]}. Returns
+    (items, errors); a bad line becomes an error result instead of failing
+    the batch. id defaults to the line number.
+    """
+    items, errors = [], []
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+            question = data["question"]
+            if not isinstance(question, str) or not question.strip():
+                raise ValueError("question must be a non-empty string")
+        except (ValueError, KeyError, TypeError) as e:
+            errors.append({"id": number, "error": f"Invalid item on line {number}: {e}"})
+            continue
+        items.append({"id": data.get("id", number), "session_id": str(data.get("session_id") or "default"), "question": question})
+    return items, errors
+
+def _retrieve(session_id, vectors):
+    """Documents and chat context for several questions of one session, loading its index and chat log once."""
+    index_name = f"{session_id}.faiss"
+    docs = search_faiss_many(vectors, index_name, DOC_TOP_K)
+    if not all(docs):
+        # As retrieve_docs: fall back to the start of the documents
+        leading = get_leading_chunks(index_name, max_chars=FALLBACK_CONTEXT_CHARS)
+        docs = [found or leading for found in docs]
+    return docs, search_chat_many(session_id, vectors, CHAT_TOP_K)
+
+def _ms(start):
+    return (time.perf_counter() - start) * 1000
+
+async def arun_batch(items, concurrency=BATCH_LLM_CONCURRENCY, write_memory=False):
+    """
+    Answer items from parse_items as /ask would, yielding one result per item
+    as soon as it is done, so not in input order.
+
+    All questions are embedded in one pass. Items are grouped by session and
+    each group's documents and chat memory are searched in one go, so every
+    index is loaded once. At most `concurrency` LLM calls run at a time,
+    summarization calls for summary requests included.
+    Items are independent: chat context is the session's as of the start of
+    the batch. Nothing is written to chat memory unless write_memory, which
+    records each turn like /ask does, in input order within a session.
+    """
+    if not items:
+        return
+    start = time.perf_counter()
+    vectors = await run_cpu(embed_chunks, [item["question"].lower() for item in items])
+    embed_ms = _ms(start)
+    observe("batch_embed", embed_ms / 1000)
+
+    groups = {}
+    for item, vector in zip(items, vectors):
+        groups.setdefault(item["session_id"], []).append((item, vector))
+
+    llm_slots = asyncio.Semaphore(max(1, concurrency))
+    pending = asyncio.Semaphore(BATCH_MAX_PENDING)
+    summary_locks = {session_id: asyncio.Lock() for session_id in groups}
+    results = asyncio.Queue()
+    tasks = set()
+
+    async def answer(item, state, timings, turn_before, turn_done):
+        result = {"id": item["id"], "session_id": item["session_id"], "question": item["question"]}
+        try:
+            if is_summary_request(item["question"]):
+                # One at a time per session, so later ones reuse the cached summaries.
+                # Each of its LLM calls takes its own slot.
+                async with summary_locks[item["session_id"]]:
+                    summarize = time.perf_counter()
+                    state["docs"] = [await asummarize_documents(item["session_id"], llm_slots)]
+                    timings["summarize"] = _ms(summarize)
+            queued = time.perf_counter()
+            async with llm_slots:
+                timings["queue"] = _ms(queued)
+                llm = time.perf_counter()
+                answered = await query_llm(state)
+                timings["llm"] = _ms(llm)
+            if write_memory:
+                await turn_before.wait()
+                await arecord_turn(item["session_id"], item["question"], answered["response"])
+            result.update(response=answered["response"], cached=answered["cached"], tokens=answered["tokens"], error=None)
+        except Exception as e:
+            logger.exception("Batch item %s failed", item["id"])
+            result.update(response=None, error=str(e))
+        finally:
+            turn_done.set()
+            pending.release()
+        timings["total"] = _ms(start)
+        result["timings"] = timings
+        await results.put(result)
+
+    async def produce():
+        for session_id, group in groups.items():
+            turn = asyncio.Event()
+            turn.set()
+            # Slices no bigger than the pending bound, which this loop waits on
+            for offset in range(0, len(group), BATCH_MAX_PENDING):
+                part = group[offset:offset + BATCH_MAX_PENDING]
+                for _ in part:
+                    await pending.acquire()
+                retrieve = time.perf_counter()
+                try:
+                    docs, chats = await run_cpu(_retrieve, session_id, [vector for _, vector in part])
+                except Exception as e:
+                    logger.exception("Batch retrieval for session %s failed", session_id)
+                    docs = chats = None
+                    error = str(e)
+                retrieve_ms = _ms(retrieve)
+                observe("batch_retrieve", retrieve_ms / 1000)
+                for i, (item, vector) in enumerate(part):
+                    if docs is None:
+                        pending.release()
+                        await results.put({**item, "response": None, "error": error, "timings": {"total": _ms(start)}})
+                        continue
+                    state = {"input": item["question"], "session_id": session_id, "query_vector": vector,
+                             "docs": docs[i], "chat_context": chats[i]}
+                    # embed and retrieve are shared by the whole batch and slice respectively
+                    timings = {"embed": embed_ms, "retrieve": retrieve_ms}
+                    turn_before, turn = turn, asyncio.Event()
+                    task = asyncio.create_task(answer(item, state, timings, turn_before, turn))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+
+    producer = asyncio.create_task(produce())
+    try:
+        for _ in items:
+            yield await results.get()
+        await producer
+    finally:
+        # The consumer went away (e.g. the client disconnected): stop the rest of the batch
+        for task in [producer, *tasks]:
+            task.cancel()
+
+async def _main(args):
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    with source:
+        items, errors = parse_items(source)
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    start = time.perf_counter()
+    failed = len(errors)
+    try:
+        for error in errors:
+            out.write(json.dumps(error) + "\n")
+        async for result in arun_batch(items, args.concurrency, args.write_memory):
+            failed += result["error"] is not None
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    seconds = time.perf_counter() - start
+    logger.info("%d items, %d failed, in %.1fs (%.2f items/s)", len(items) + len(errors), failed, seconds, len(items) / max(seconds, 1e-9))
+    return 1 if failed else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Answer a JSONL file of {session_id, question} items in one batch; writes one JSON result per line.")
+    parser.add_argument("input", help="JSONL file, or - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="JSONL results, default stdout")
+    parser.add_argument("--concurrency", type=int, default=BATCH_LLM_CONCURRENCY, help="LLM calls in flight")
+    parser.add_argument("--write-memory", action="store_true", help="record each answer in the session's chat memory")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+                        stream=sys.stderr)
+    return asyncio.run(_main(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,78 +1,115 @@
 # agents/graph_builder.py
-from langgraph.graph import StateGraph
+from langgraph.graph import StateGraph, START, END
 from langchain_core.runnables import Runnable
-from typing import Dict, List, Optional, TypedDict
-from components.vector_store import query_faiss, get_all_chunks, query_chat_faiss
-from components.llm_ollama import query_ollama
-from components.memory_store import get_memory
+from typing import Annotated, Any, Dict, List, Optional, TypedDict
+from components.vector_store import (
+    embed_chunks, search_faiss, search_chat, get_all_chunks, get_leading_chunks, document_set_hash,
+)
+from components.llm_ollama import aquery_ollama, ERROR_MESSAGE, NO_RESPONSE_MESSAGE, MODEL_LOADED_MESSAGE
+from components.memory_store import aget_memory, aget_summary_cache, asave_summary_cache
+from components.executor import run_cpu
+from components import response_cache
+from components.metrics import GRAPH_NODE_SECONDS
+from components.context_packer import PROMPT_TOKEN_BUDGET, CHAT_CONTEXT_SHARE, count_tokens, pack, context_budget
+import os
 import re
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# When search finds nothing, at most this much document text goes into the prompt
+FALLBACK_CONTEXT_CHARS = int(os.getenv("FALLBACK_CONTEXT_CHARS", "6000"))
+
+def merge_timings(left, right):
+    return {**(left or {}), **(right or {})}
 
 class BotState(TypedDict, total=False):
     session_id: str
     input: str
     memory: dict
+    query_vector: Any
     chat_context: List[str]
     docs: List[str]
     response: str
+    cached: bool
     followup_required: bool
+    # prompt_estimate from our tokenizer; prompt and completion as measured by Ollama
+    tokens: Dict[str, Optional[int]]
+    # Parallel branches each report their own node times
+    timings: Annotated[Dict[str, float], merge_timings]
+
+def timed(name, node):
+    """Wrap a node so its wall time is recorded in state["timings"][name] (ms) and in /metrics."""
+    def record(update, start):
+        seconds = time.perf_counter() - start
+        GRAPH_NODE_SECONDS.labels(name).observe(seconds)
+        return {**(update or {}), "timings": {name: seconds * 1000}}
+
+    if asyncio.iscoroutinefunction(node):
+        async def run(state):
+            start = time.perf_counter()
+            return record(await node(state), start)
+    else:
+        def run(state):
+            start = time.perf_counter()
+            return record(node(state), start)
+    return run
 
-def load_memory(state: BotState) -> BotState:
-    sid = state.get("session_id", "default")
-    memory = get_memory(sid)
-    state["memory"] = memory
-    return state
+# Nodes return only the keys they set, so that branches running in parallel do not overwrite each other
 
-def retrieve_chunks(state: BotState) -> BotState:
-    session_id = state.get("session_id", "default")
-    question = state["input"].lower()
+async def load_memory(state: BotState) -> dict:
+    sid = state.get("session_id", "default")
+    # The nodes only use the scalar fields, so the conversation itself is not fetched
+    return {"memory": await aget_memory(sid, messages=False)}
 
-    # Retrieve relevant previous chat messages
-    relevant_chats = query_chat_faiss(session_id, question, top_k=5)
-    print(f"[FAISS] Retrieved {len(relevant_chats)} relevant chat messages for session {session_id}")
-    print("[FAISS] Relevant chat messages:", relevant_chats)
-    state["chat_context"] = relevant_chats
+async def embed_question(state: BotState) -> dict:
+    # One embedding serves chat search, document search and the response cache
+    vectors = await run_cpu(embed_chunks, [state["input"].lower()])
+    return {"query_vector": vectors[0]}
 
-    # If summarization-type command, use recursive summarization
-    if any(cmd in question for cmd in ["summarize", "summarise", "explain", "analyze", "extract"]):
-        from components.document_loader import recursive_summarize, summarize_chunks_with_llm
-        all_chunks = get_all_chunks(f"{session_id}.faiss")
-        summary = recursive_summarize(all_chunks, summarize_chunks_with_llm, max_chunks_per_pass=8)
-        state["docs"] = [summary]
-        return state
-    else:
-        chunks = query_faiss(question, index_name=f"{session_id}.faiss")
-        # Fallback to full doc text if no context found
-        if not chunks:
-            chunks = get_all_chunks(f"{session_id}.faiss")
-        state["docs"] = chunks
-        return state
-
-def build_medical_prompt(input_text, docs, chat_context=None):
-    doc_context = "\n".join(docs) if docs else "No context found."
-
-    # Filter duplicate or irrelevant messages
-    filtered_chat = []
-    seen = set()
-    input_clean = input_text.strip().lower()
+async def retrieve_chat(state: BotState) -> dict:
+    session_id = state.get("session_id", "default")
+    relevant_chats = await run_cpu(search_chat, session_id, state["query_vector"], top_k=5)
+    logger.debug("Retrieved %d relevant chat messages for session %s: %s", len(relevant_chats), session_id, relevant_chats)
+    return {"chat_context": relevant_chats}
 
-    for msg in (chat_context or []):
-        msg_clean = msg.strip().lower()
-        if msg_clean and msg_clean != input_clean and msg_clean not in seen:
-            filtered_chat.append(msg)
-            seen.add(msg_clean)
+def is_summary_request(question: str) -> bool:
+    """Summarization-type commands are answered from all of the documents, not from search results."""
+    question = question.lower()
+    return any(cmd in question for cmd in ["summarize", "summarise", "explain", "analyze", "extract"])
 
-    # Fallback: ensure at least 2 recent messages are included
-    if not filtered_chat and chat_context:
-        filtered_chat = chat_context[-2:]  # last 2 messages
+async def asummarize_documents(session_id: str, semaphore=None) -> str:
+    """
+    Recursive summary of all of a session's documents. Up to
+    SUMMARY_MAX_IN_FLIGHT LLM calls run at once, or as many as semaphore allows.
+    """
+    from components.document_loader import arecursive_summarize, asummarize_chunks_with_llm
+    all_chunks = await run_cpu(get_all_chunks, f"{session_id}.faiss")
+    # Summaries are reused until the session's documents change
+    docset_hash = await run_cpu(document_set_hash, f"{session_id}.faiss")
+    cache = await aget_summary_cache(session_id, docset_hash)
+    summary = await arecursive_summarize(all_chunks, asummarize_chunks_with_llm, max_chunks_per_pass=8, cache=cache,
+                                         semaphore=semaphore)
+    failed = (ERROR_MESSAGE, NO_RESPONSE_MESSAGE, MODEL_LOADED_MESSAGE)
+    await asave_summary_cache(session_id, docset_hash, {k: v for k, v in cache.items() if v not in failed})
+    return summary
+
+async def retrieve_docs(state: BotState) -> dict:
+    session_id = state.get("session_id", "default")
 
-    chat_history = "\n".join(filtered_chat) if filtered_chat else "None"
+    # If summarization-type command, use recursive summarization
+    if is_summary_request(state["input"]):
+        return {"docs": [await asummarize_documents(session_id)]}
 
-    # DEBUG LOGGING
-    print("[Prompt Debug] Final Chat Context for Prompt:")
-    for i, msg in enumerate(filtered_chat):
-        print(f"  {i+1}. {msg}")
+    chunks = await run_cpu(search_faiss, state["query_vector"], index_name=f"{session_id}.faiss")
+    # Fallback to the start of the documents if no context found, within the prompt's budget
+    if not chunks:
+        chunks = await run_cpu(get_leading_chunks, f"{session_id}.faiss", max_chars=FALLBACK_CONTEXT_CHARS)
+    return {"docs": chunks}
 
-    return f"""
+PROMPT_TEMPLATE = """
         You are a helpful and friendly medical assistant.
 
         Always respond in a warm, conversational tone.
@@ -98,24 +135,64 @@ def build_medical_prompt(input_text, docs, chat_context=None):
         Only respond based on the user input, previous chat, and document context. Do not make up medical information.
     """
 
-def query_llm(state: BotState) -> BotState:
-    prompt = build_medical_prompt(
+def build_medical_prompt(input_text, docs, chat_context=None, budget=PROMPT_TOKEN_BUDGET):
+    # Filter duplicate or irrelevant messages
+    filtered_chat = []
+    seen = set()
+    input_clean = input_text.strip().lower()
+
+    for msg in (chat_context or []):
+        msg_clean = msg.strip().lower()
+        if msg_clean and msg_clean != input_clean and msg_clean not in seen:
+            filtered_chat.append(msg)
+            seen.add(msg_clean)
+
+    # Fallback: ensure at least 2 recent messages are included
+    if not filtered_chat and chat_context:
+        filtered_chat = chat_context[-2:]  # last 2 messages
+
+    # Whatever the fixed part of the prompt leaves is shared by chat history and
+    # documents; both lists are best match first, so packing keeps the best ones
+    fixed = count_tokens(PROMPT_TEMPLATE.format(input_text=input_text, chat_history="", doc_context=""))
+    available = context_budget(fixed, budget)
+    filtered_chat, chat_tokens = pack(filtered_chat, int(available * CHAT_CONTEXT_SHARE))
+    docs, _ = pack(docs or [], available - chat_tokens)
+
+    doc_context = "\n".join(docs) if docs else "No context found."
+    chat_history = "\n".join(filtered_chat) if filtered_chat else "None"
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Chat context for prompt:\n%s", "\n".join(f"  {i+1}. {msg}" for i, msg in enumerate(filtered_chat)))
+
+    return PROMPT_TEMPLATE.format(input_text=input_text, chat_history=chat_history, doc_context=doc_context)
+
+def build_prompt(state: BotState) -> str:
+    return build_medical_prompt(
         state["input"],
         state.get("docs", []),
         state.get("chat_context", [])
     )
-    print("[LLM Input Debug] Chat context keys in state:", state.get("chat_context"))
-    state["response"] = query_ollama(prompt)
-    return state
 
-def decide_followup(state: BotState) -> BotState:
+async def query_llm(state: BotState) -> dict:
+    prompt = build_prompt(state)
+    # Same question about the same documents: reuse the earlier answer
+    key, cached = await response_cache.alookup(state["input"], state.get("session_id", "default"), state.get("query_vector"))
+    tokens = {"prompt_estimate": count_tokens(prompt)}
+    if cached is not None:
+        return {"response": cached, "cached": True, "tokens": tokens}
+    usage = {}
+    response = await aquery_ollama(prompt, usage=usage)
+    response_cache.store(key, response)
+    tokens.update({"prompt": usage.get("prompt_tokens"), "completion": usage.get("completion_tokens")})
+    return {"response": response, "cached": False, "tokens": tokens}
+
+def decide_followup(state: BotState) -> dict:
     # Remove manual followup message, let LLM decide
-    state["followup_required"] = False
-    return state
+    return {"followup_required": False}
 
-def update_memory(state: BotState) -> BotState:
+def update_memory(state: BotState) -> dict:
     text = state["input"]
-    mem = state["memory"]
+    mem = dict(state["memory"])
 
     # Extract duration
     match = re.search(r"(for|since)\s+(\d+\s+\w+)", text.lower())
@@ -128,21 +205,48 @@ def update_memory(state: BotState) -> BotState:
             mem["triggers"] = word
             break
 
-    state["memory"] = mem
-    return state
+    return {"memory": mem}
+
+def _add_context_nodes(graph: StateGraph):
+    """
+    START -> load_memory -> update_memory -> END
+    START -> embed_question -> retrieve_chat, retrieve_docs (in parallel)
+    The prompt only needs the two retrievals, so memory never delays it.
+    """
+    graph.add_node("load_memory", timed("load_memory", load_memory))
+    graph.add_node("update_memory", timed("update_memory", update_memory))
+    graph.add_node("embed_question", timed("embed_question", embed_question))
+    graph.add_node("retrieve_chat", timed("retrieve_chat", retrieve_chat))
+    graph.add_node("retrieve_docs", timed("retrieve_docs", retrieve_docs))
+
+    graph.add_edge(START, "load_memory")
+    graph.add_edge("load_memory", "update_memory")
+    graph.add_edge("update_memory", END)
+    graph.add_edge(START, "embed_question")
+    graph.add_edge("embed_question", "retrieve_chat")
+    graph.add_edge("embed_question", "retrieve_docs")
 
 def build_graph() -> Runnable:
+    """Nodes are async; run the compiled graph with `ainvoke`."""
     graph = StateGraph(BotState)
-    graph.add_node("load_memory", load_memory)
-    graph.add_node("retrieve", retrieve_chunks)
-    graph.add_node("llm", query_llm)
-    graph.add_node("followup_logic", decide_followup)
-    graph.add_node("update_memory", update_memory)
-
-    graph.set_entry_point("load_memory")
-    graph.add_edge("load_memory", "retrieve")
-    graph.add_edge("retrieve", "update_memory")
-    graph.add_edge("update_memory", "llm")
+    _add_context_nodes(graph)
+    graph.add_node("llm", timed("llm", query_llm))
+    graph.add_node("followup_logic", timed("followup_logic", decide_followup))
+
+    # llm waits for both retrievals
+    graph.add_edge(["retrieve_chat", "retrieve_docs"], "llm")
     graph.add_edge("llm", "followup_logic")
-    graph.set_finish_point("followup_logic")
+    graph.add_edge("followup_logic", END)
+    return graph.compile()
+
+
+def build_context_graph() -> Runnable:
+    """
+    Same pipeline as build_graph, stopping before the LLM call.
+    Used by the streaming endpoint, which generates the response itself.
+    """
+    graph = StateGraph(BotState)
+    _add_context_nodes(graph)
+    graph.add_edge("retrieve_chat", END)
+    graph.add_edge("retrieve_docs", END)
     return graph.compile()
@@ -1,152 +1,239 @@
 # app.py
+from components.startup import warmup, readiness, PROCESS_START, STARTUP_WARMUP
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, Form, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import Request
+from fastapi.responses import FileResponse, StreamingResponse, Response, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
 from components.document_loader import load_document, chunk_text
-from components.vector_store import save_faiss_index, embed_chunks, delete_faiss_index
-from components.asr import transcribe_audio, stream_asr
-from components.memory_store import get_memory, save_memory, list_sessions, delete_session
-from agents.graph_builder import build_graph
+from components.vector_store import add_document, embed_chunks, delete_faiss_index
+from components.asr import transcribe_audio, stream_asr, asr_pool
+from components.asr_pool import ASRQueueFull
+from components.memory_store import (
+    get_memory, get_messages, get_session_documents, remove_session_document, arecord_turn, list_sessions, delete_session,
+)
+from components.ingest import save_upload, start_ingest, get_job, discard_uploads
+from components.llm_ollama import ollama_client, ERROR_MESSAGE, NO_RESPONSE_MESSAGE
+from components import response_cache
+from components.context_packer import count_tokens, get_token_counter
+from components.metrics import HTTP_REQUEST_SECONDS, stats_collector, render as render_metrics
+from agents.graph_builder import build_graph, build_context_graph, build_prompt
+from agents.batch_qa import parse_items, arun_batch, BATCH_LLM_CONCURRENCY, BATCH_MAX_ITEMS
 
 import os
+import json
+import time
 import shutil
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional
+
+# LOG_LEVEL=DEBUG adds request payloads, prompts and retrieved context to the log
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger("app")
 
 UPLOAD_FOLDER = "uploads"
 AUDIO_FOLDER = "audio"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(AUDIO_FOLDER, exist_ok=True)
 
+warmup.record("imports", time.time() - PROCESS_START)
+
+_graph_start = time.perf_counter()
 graph = build_graph()
-app = FastAPI()
+context_graph = build_context_graph()
+warmup.record("graph", time.perf_counter() - _graph_start)
+
+def _warm_embeddings():
+    from components.embedding_service import get_embedding_service
+    get_embedding_service().warm_up()
+
+warmup.add("embedding_model", _warm_embeddings)
+warmup.add("tokenizer", get_token_counter().load)
+warmup.add("whisper", asr_pool.load)
+
+@asynccontextmanager
+async def lifespan(app):
+    # Models load after the port is bound; /readyz reports when they are done
+    if STARTUP_WARMUP:
+        warmup.start()
+    logger.info("Started in %.1fs", time.time() - PROCESS_START)
+    yield
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 app.mount("/frontend", StaticFiles(directory="frontend"), name="frontend")
 
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, not the raw path, so ids do not blow up cardinality
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        HTTP_REQUEST_SECONDS.labels(request.method, path, str(status)).observe(time.perf_counter() - start)
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up and serving."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: models warmed up, Redis and Ollama reachable. 503 until all hold."""
+    checks = await readiness()
+    ready = all(checks.values())
+    return JSONResponse({"ready": ready, "checks": checks, **warmup.report()}, status_code=200 if ready else 503)
+
 @app.get("/")
 def get_index():
     return FileResponse("frontend/index.html")
 
-@app.post("/upload")
+@app.post("/upload", status_code=202)
 async def upload_doc(file: UploadFile = File(...), session_id: str = Form("default")):
+    """
+    Streams the file to disk and indexes it in the background.
+    Poll GET /jobs/{job_id} for progress.
+    """
+    if not file.filename.endswith((".pdf", ".docx")):
+        raise HTTPException(status_code=400, detail="Unsupported file type.")
     try:
-        if not file.filename.endswith((".pdf", ".docx")):
-            raise HTTPException(status_code=400, detail="Unsupported file type.")
-        
         path = f"{UPLOAD_FOLDER}/{session_id}_{file.filename}"
-        with open(path, "wb") as f:
-            f.write(await file.read())
-        
-        text = load_document(path)
-        if len(text.strip()) < 50:
-            os.remove(path)
-            raise HTTPException(status_code=400, detail="Document is too short to process.")
-
-        chunks = chunk_text(text)
-        if not chunks:
-            os.remove(path)
-            raise HTTPException(status_code=400, detail="Failed to split document into chunks.")
-        
-        embeddings = embed_chunks(chunks)
-        if embeddings.shape[0] == 0:
-            os.remove(path)
-            raise HTTPException(status_code=400, detail="Embedding failed.")
-
-        save_faiss_index(embeddings, chunks, index_name=f"{session_id}.faiss")
-
-        # Save document name in memory
-        memory = get_memory(session_id)
-        memory.setdefault("documents", [])
-        memory["documents"].append(file.filename)
-        save_memory(session_id, memory)
-
-        return {"status": "uploaded", "filename": file.filename}
+        upload = await save_upload(file, path)
+        job = await start_ingest(upload, path, session_id, file.filename)
+        return {"status": "processing", "filename": file.filename, "job_id": job["job_id"]}
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("Upload failed")
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
+@app.get("/jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    job = await get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job.")
+    return job
+
 @app.post("/delete_doc")
 def delete_document(session_id: str = Form(...), filename: str = Form(...)):
     file_path = f"{UPLOAD_FOLDER}/{session_id}_{filename}"
+    # First, so an upload of it still being ingested cannot bring it back
+    discard_uploads(file_path)
     if os.path.exists(file_path):
         os.remove(file_path)
 
     # Remove only the deleted document's chunks from the FAISS index
-    from components.vector_store import load_faiss_index, embed_chunks, save_faiss_index
-    from components.document_loader import load_document, chunk_text
+    from components.vector_store import remove_document, has_untracked_chunks
     index_name = f"{session_id}.faiss"
-    index_path = os.path.join("vector_store", index_name)
-    chunks_path = index_path + ".pkl"
-    if os.path.exists(index_path) and os.path.exists(chunks_path):
-        # Load all chunks
-        import pickle
-        with open(chunks_path, "rb") as f:
-            all_chunks = pickle.load(f)
-        # Rebuild chunks for all remaining documents
-        memory = get_memory(session_id)
-        remaining_docs = [doc for doc in memory.get("documents", []) if doc != filename]
-        new_chunks = []
-        new_embeddings = []
-        from sentence_transformers import SentenceTransformer
-        model = SentenceTransformer("all-MiniLM-L6-v2")
-        for doc in remaining_docs:
+    if has_untracked_chunks(index_name):
+        # Indexes built before per-document tracking cannot tell documents apart;
+        # rebuild them once from the remaining files, after which deletes are by ID
+        delete_faiss_index(index_name)
+        for doc in get_session_documents(session_id):
             doc_path = f"{UPLOAD_FOLDER}/{session_id}_{doc}"
-            if os.path.exists(doc_path):
-                text = load_document(doc_path)
-                doc_chunks = chunk_text(text)
+            if doc != filename and os.path.exists(doc_path):
+                doc_chunks = chunk_text(load_document(doc_path))
                 if doc_chunks:
-                    new_chunks.extend(doc_chunks)
-                    new_embeddings.extend(model.encode(doc_chunks, convert_to_numpy=True, show_progress_bar=False))
-        if new_chunks and new_embeddings:
-            import numpy as np
-            new_embeddings = np.array(new_embeddings).astype("float32")
-            save_faiss_index(new_embeddings, new_chunks, index_name=index_name)
-        else:
-            # No docs left, delete index
-            from components.vector_store import delete_faiss_index
-            delete_faiss_index(index_name)
+                    add_document(doc, embed_chunks(doc_chunks), doc_chunks, index_name=index_name)
+    else:
+        remove_document(filename, index_name=index_name)
 
     # Remove from memory
-    memory = get_memory(session_id)
-    memory["documents"] = [doc for doc in memory.get("documents", []) if doc != filename]
-    save_memory(session_id, memory)
+    remove_session_document(session_id, filename)
 
     return {"status": "deleted"}
 
 @app.post("/ask")
 async def ask(question: str = Form(...), session_id: str = Form("default")):
-    memory = get_memory(session_id)
-    result = graph.invoke({"input": question, "session_id": session_id})
+    result = await graph.ainvoke({"input": question, "session_id": session_id})
     response_text = result["response"]
-
-    memory["messages"].append({"role": "user", "text": question})
-    memory["messages"].append({"role": "bot", "text": response_text})
-    save_memory(session_id, memory)
-
-    # --- Store user and bot messages in FAISS index (after response) ---
-    from components.vector_store import save_chat_message_embedding
-    save_chat_message_embedding(session_id, question)
-    print(f"[FAISS] Added user message to chat index: {question}")
-    save_chat_message_embedding(session_id, response_text)
-    print(f"[FAISS] Added bot message to chat index: {response_text}")
+    await arecord_turn(session_id, question, response_text)
 
     return {
         "response": response_text,
-        "followup": result.get("followup_required", False)
+        "followup": result.get("followup_required", False),
+        "cached": result.get("cached", False),
+        "timings": result.get("timings", {}),
+        "tokens": result.get("tokens", {}),
     }
 
+@app.post("/ask/stream")
+async def ask_stream(question: str = Form(...), session_id: str = Form("default")):
+    """
+    Server-sent events variant of /ask: one `data: {"token": ...}` event per
+    generated token, then `event: done` with the full response.
+    """
+    state = await context_graph.ainvoke({"input": question, "session_id": session_id})
+    prompt = build_prompt(state)
+    tokens = {"prompt_estimate": count_tokens(prompt)}
+    key, cached = await response_cache.alookup(question, session_id, state.get("query_vector"))
+
+    async def events():
+        if cached is not None:
+            yield f"data: {json.dumps({'token': cached})}\n\n"
+            await arecord_turn(session_id, question, cached)
+            yield f"event: done\ndata: {json.dumps({'response': cached, 'followup': False, 'tokens': tokens})}\n\n"
+            return
+        parts = []
+        usage = {}
+        try:
+            async for token in ollama_client.stream_chat(prompt, usage=usage):
+                parts.append(token)
+                yield f"data: {json.dumps({'token': token})}\n\n"
+        except Exception:
+            logger.exception("Streaming response failed")
+            yield f"event: error\ndata: {json.dumps({'detail': ERROR_MESSAGE})}\n\n"
+            return
+        response_text = "".join(parts).strip() or NO_RESPONSE_MESSAGE
+        response_cache.store(key, response_text)
+        await arecord_turn(session_id, question, response_text)
+        tokens.update({"prompt": usage.get("prompt_tokens"), "completion": usage.get("completion_tokens")})
+        yield f"event: done\ndata: {json.dumps({'response': response_text, 'followup': False, 'tokens': tokens})}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/ask/batch")
+async def ask_batch(request: Request, write_memory: bool = False, concurrency: Optional[int] = None):
+    """
+    JSONL in, JSONL out: the body holds one {"session_id", "question"[, "id"]}
+    per line, and one result per item (response, tokens, timings or error) is
+    streamed back as it finishes. Chat memory is only written with
+    write_memory=true. concurrency can lower BATCH_LLM_CONCURRENCY, not raise it.
+    """
+    body = (await request.body()).decode("utf-8")
+    items, errors = parse_items(body.splitlines())
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} items per batch.")
+    concurrency = min(max(concurrency or BATCH_LLM_CONCURRENCY, 1), BATCH_LLM_CONCURRENCY)
+
+    async def lines():
+        for error in errors:
+            yield json.dumps(error) + "\n"
+        async for result in arun_batch(items, concurrency, write_memory):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 @app.get("/chats")
-def list_chats():
-    return list_sessions()
+def list_chats(cursor: Optional[str] = None, limit: int = 50):
+    try:
+        return list_sessions(cursor=cursor, limit=min(max(limit, 1), 200))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
 
 @app.get("/chat/{session_id}")
-def get_chat(session_id: str):
-    session = get_memory(session_id)
+def get_chat(session_id: str, last: Optional[int] = None):
+    """`last` limits the response to the most recent N messages."""
+    session = get_memory(session_id, messages=False)
     return {
         "session_id": session["session_id"],
         "created": session.get("created"),
-        "messages": session.get("messages", []),
+        "messages": get_messages(session_id, -last if last else 0, -1),
         "documents": session.get("documents", [])
     }
 
@@ -162,7 +249,10 @@ async def transcribe(file: UploadFile = File(...)):
     path = f"{UPLOAD_FOLDER}/{file.filename}"
     with open(path, "wb") as f:
         f.write(await file.read())
-    return {"transcription": transcribe_audio(path)}
+    try:
+        return {"transcription": await transcribe_audio(path)}
+    except ASRQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
 @app.websocket("/ws/asr")
 async def websocket_asr_endpoint(websocket: WebSocket):
@@ -170,9 +260,44 @@ async def websocket_asr_endpoint(websocket: WebSocket):
     try:
         await stream_asr(websocket)
     except WebSocketDisconnect:
-        print("WebSocket disconnected")
+        logger.info("WebSocket disconnected")
+
+def _index_cache_stats():
+    from components.vector_store import index_manager
+    return index_manager.stats()
+
+def _embedding_cache_stats():
+    from components.embedding_service import get_embedding_service
+    cache = get_embedding_service().cache
+    return cache.stats() if cache else {}
+
+stats_collector.register("index_cache", _index_cache_stats)
+stats_collector.register("embedding_cache", _embedding_cache_stats)
+stats_collector.register("response_cache", response_cache.response_cache.stats)
+stats_collector.register("asr", asr_pool.stats)
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus exposition: per-route, per-node and per-stage latency histograms plus cache and ASR counters."""
+    body, content_type = render_metrics()
+    return Response(body, media_type=content_type)
+
+@app.get("/stats/index_cache")
+def index_cache_stats():
+    return _index_cache_stats()
+
+@app.get("/stats/embedding_cache")
+def embedding_cache_stats():
+    return _embedding_cache_stats()
+
+@app.get("/stats/response_cache")
+def response_cache_stats():
+    return response_cache.response_cache.stats()
+
+@app.get("/stats/asr")
+def asr_stats():
+    return asr_pool.stats()
 
 @app.get("/documents/{session_id}")
 def get_documents(session_id: str):
-    session = get_memory(session_id)
-    return session.get("documents", [])
+    return get_session_documents(session_id)
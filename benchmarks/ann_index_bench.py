@@ -0,0 +1,72 @@
+# benchmarks/ann_index_bench.py
+"""
+Recall, throughput and size of the index kinds in components/index_factory.py.
+
+Builds flat, HNSW and IVF-PQ indexes over the same synthetic clustered
+vectors (shaped like sentence embeddings: unit length, 384 dims) and
+reports, for each kind:
+
+    recall@k   overlap of its top k with exact (flat) search
+    QPS        single-query searches per second on one thread
+    bytes/vec  serialized index size divided by the vector count
+    build s    time to train and add
+
+    python benchmarks/ann_index_bench.py [-n 200000] [--dim 384] [-k 10] [--queries 1000]
+
+The kind index_factory would pick for n under ANN_MEMORY_BUDGET is printed at the end.
+"""
+import argparse
+import os
+import sys
+import time
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from components.index_factory import FLAT, HNSW, IVFPQ, build_index, choose_index_kind, ANN_MEMORY_BUDGET
+
+def synthetic(n, dim, clusters, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype("float32")
+    x = centers[rng.integers(0, clusters, n)] + 0.5 * rng.standard_normal((n, dim)).astype("float32")
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+def measure(index, queries, k):
+    start = time.perf_counter()
+    results = [index.search(q.reshape(1, -1), k)[1][0] for q in queries]
+    return np.array(results), len(queries) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=200000, help="indexed vectors")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(1)
+    data = synthetic(args.n + args.queries, args.dim, args.clusters, args.seed)
+    vectors, queries = data[:args.n], data[args.n:]
+    ids = np.arange(args.n, dtype="int64")
+
+    truth = None
+    print(f"{args.n} vectors, dim {args.dim}, {args.queries} queries, k={args.k}\n")
+    print(f"{'kind':<8}{'recall@k':>10}{'QPS':>10}{'bytes/vec':>12}{'build s':>10}")
+    for kind in (FLAT, HNSW, IVFPQ):
+        start = time.perf_counter()
+        index = build_index(vectors, ids, kind=kind)
+        build = time.perf_counter() - start
+        found, qps = measure(index, queries, args.k)
+        if truth is None:
+            truth = found
+        recall = np.mean([len(set(f) & set(t)) / args.k for f, t in zip(found, truth)])
+        size = len(faiss.serialize_index(index)) / args.n
+        print(f"{kind:<8}{recall:>10.3f}{qps:>10.0f}{size:>12.0f}{build:>10.1f}")
+
+    print(f"\nindex_factory picks '{choose_index_kind(args.n, args.dim)}' for {args.n} vectors "
+          f"under ANN_MEMORY_BUDGET={ANN_MEMORY_BUDGET}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# benchmarks/ask_concurrency_bench.py
+"""
+Checks that concurrent /ask pipelines overlap on one event loop.
+
+Runs the /ask LangGraph pipeline once on its own, then N copies concurrently,
+against a fake Ollama with a fixed generation time. If the pipeline blocked
+the loop the concurrent run would take ~N times as long; it should take
+about as long as one call. Event-loop lag is sampled throughout, since that
+is what stalls other requests such as /ws/asr frames.
+
+    python benchmarks/ask_concurrency_bench.py [-n 8] [--redis-url redis://localhost:6379/0]
+
+Without --redis-url an in-process fakeredis is used. Exits non-zero if the
+calls serialized. tests/test_ask_concurrency.py runs the same check with the
+test suite.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_ollama import start_in_thread
+
+async def measure_lag(stop, samples):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        samples.append(time.perf_counter() - start - 0.01)
+
+async def run(graph, n):
+    stop = asyncio.Event()
+    lag = []
+    ticker = asyncio.create_task(measure_lag(stop, lag))
+
+    start = time.perf_counter()
+    await graph.ainvoke({"input": "What does my HbA1c mean?", "session_id": "bench_single"})
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        graph.ainvoke({"input": "What does my HbA1c mean?", "session_id": f"bench_{i}"}) for i in range(n)
+    ])
+    concurrent = time.perf_counter() - start
+
+    stop.set()
+    await ticker
+    return single, concurrent, max(lag) if lag else 0.0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=8, help="concurrent /ask pipelines")
+    parser.add_argument("--port", type=int, default=11436)
+    parser.add_argument("--latency", type=float, default=1.0, help="fake Ollama time to first token")
+    parser.add_argument("--redis-url", default=None)
+    args = parser.parse_args()
+
+    start_in_thread(args.port, latency=args.latency, tokens=10, tokens_per_sec=50)
+    os.environ["OLLAMA_URL"] = f"http://127.0.0.1:{args.port}"
+    if args.redis_url:
+        os.environ["REDIS_URL"] = args.redis_url
+
+    from components import memory_store
+    if not args.redis_url:
+        import fakeredis
+        memory_store.aredis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    from agents.graph_builder import build_graph
+
+    single, concurrent, lag = asyncio.run(run(build_graph(), args.n))
+    overlap = args.n * single / concurrent
+    print(f"single call:        {single:.2f} s")
+    print(f"{args.n} concurrent calls: {concurrent:.2f} s (serial would be ~{args.n * single:.2f} s)")
+    print(f"overlap factor:     {overlap:.1f}x")
+    print(f"max event-loop lag: {lag * 1000:.1f} ms")
+    # Anything well above 2 single-call durations means the calls queued behind each other
+    sys.exit(0 if concurrent < 2 * single else 1)
+
+if __name__ == "__main__":
+    main()
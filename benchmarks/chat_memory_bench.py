@@ -0,0 +1,99 @@
+# benchmarks/chat_memory_bench.py
+"""
+Per-turn chat-memory latency as history grows.
+
+A "turn" is what /ask does to chat memory: one search plus two appends
+(user and bot message). Vectors are random, so no embedding model is needed.
+
+    python benchmarks/chat_memory_bench.py [--legacy] [--dim 384]
+
+--legacy also times the old read-modify-write .faiss + .pkl scheme for comparison.
+"""
+import argparse
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from components.chat_log import ChatLog
+
+CHECKPOINTS = [10, 100, 1000, 10000]
+
+def legacy_append(folder, vector, text):
+    index_path = os.path.join(folder, "bench_chat.faiss")
+    chunks_path = index_path + ".pkl"
+    if os.path.exists(index_path):
+        index = faiss.read_index(index_path)
+        with open(chunks_path, "rb") as f:
+            messages = pickle.load(f)
+    else:
+        index = faiss.IndexFlatL2(len(vector))
+        messages = []
+    index.add(vector.reshape(1, -1))
+    messages.append(text)
+    faiss.write_index(index, index_path)
+    with open(chunks_path, "wb") as f:
+        pickle.dump(messages, f)
+
+def legacy_search(folder, query):
+    index_path = os.path.join(folder, "bench_chat.faiss")
+    index = faiss.read_index(index_path)
+    with open(index_path + ".pkl", "rb") as f:
+        messages = pickle.load(f)
+    _, I = index.search(query.reshape(1, -1), 5)
+    return [messages[i] for i in I[0] if i >= 0]
+
+def run(append, search, dim, turns, rng):
+    results = []
+    written = 0
+    for checkpoint in CHECKPOINTS:
+        while written < checkpoint:
+            append(rng.random(dim, dtype="float32"), f"message {written} " + "x" * 200)
+            written += 1
+        timings = []
+        for _ in range(turns):
+            start = time.perf_counter()
+            search(rng.random(dim, dtype="float32"))
+            append(rng.random(dim, dtype="float32"), "user question " + "x" * 200)
+            append(rng.random(dim, dtype="float32"), "bot answer " + "x" * 200)
+            timings.append(time.perf_counter() - start)
+        written += 2 * turns
+        results.append((checkpoint, np.median(timings) * 1000, np.percentile(timings, 95) * 1000))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--legacy", action="store_true")
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    folder = tempfile.mkdtemp(prefix="chat_bench_")
+    try:
+        log = ChatLog(folder, "bench")
+        rows = {"append-only": run(log.append, lambda q: log.search(q, 5), args.dim, args.turns, rng)}
+        if args.legacy:
+            legacy_folder = os.path.join(folder, "legacy")
+            os.makedirs(legacy_folder)
+            rows["legacy"] = run(
+                lambda v, t: legacy_append(legacy_folder, v, t),
+                lambda q: legacy_search(legacy_folder, q),
+                args.dim, args.turns, rng,
+            )
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    print(f"{'store':<12} {'messages':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for name, results in rows.items():
+        for messages, p50, p95 in results:
+            print(f"{name:<12} {messages:>9} {p50:>9.2f} {p95:>9.2f}")
+
+if __name__ == "__main__":
+    main()
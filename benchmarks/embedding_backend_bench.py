@@ -0,0 +1,148 @@
+# benchmarks/embedding_backend_bench.py
+"""
+PyTorch vs ONNX Runtime (fp32 and int8) embedding backends.
+
+Each backend runs in its own process, so first-call numbers include its
+imports and model load as a freshly started worker would see them:
+
+    load s      imports + model load (the ONNX export is made beforehand, once)
+    first ms    first single-query encode after load
+    texts/s     encode throughput over --texts texts at --batch-size
+
+The ONNX vectors are then compared with the PyTorch ones, which is what the
+existing indexes were built with:
+
+    min cos / mean cos   cosine similarity to the PyTorch vector of the same text
+    recall@k             overlap of the top k for each question, searching an
+                         index of PyTorch passage vectors with this backend's
+                         question vectors, against PyTorch's own top k
+
+    python benchmarks/embedding_backend_bench.py [--texts 2000] [--batch-size 64] [--threads 0]
+                                                 [--backends torch,onnx,onnx-int8]
+                                                 [--fp32-tolerance 0.9999] [--int8-tolerance 0.98]
+
+Exits with status 1 if a backend's min cos is below its tolerance.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+BACKENDS = {
+    "torch": {"backend": "torch", "int8": False},
+    "onnx": {"backend": "onnx", "int8": False},
+    "onnx-int8": {"backend": "onnx", "int8": True},
+}
+QUESTIONS = [
+    "What does my HbA1c mean?",
+    "Is my cholesterol in the normal range?",
+    "Why is my creatinine elevated?",
+    "Are my platelets low?",
+    "What is a normal fasting glucose level?",
+]
+
+def make_texts(n, seed=0):
+    """Questions and document chunks of mixed length, as the service embeds them."""
+    rng = np.random.default_rng(seed)
+    vocab = ("glucose hemoglobin cholesterol triglycerides creatinine platelets range normal "
+             "elevated result patient sample fasting level reference units test value").split()
+    texts = []
+    for i in range(n):
+        if i % 4 == 0:
+            texts.append(QUESTIONS[i // 4 % len(QUESTIONS)] + f" ({i})")
+        else:
+            texts.append(" ".join(rng.choice(vocab, int(rng.integers(20, 200)))))
+    return texts
+
+def child(args):
+    start = time.perf_counter()
+    from components.embedding_service import EmbeddingService
+    spec = BACKENDS[args.child]
+    service = EmbeddingService(cache=None, max_batch_size=args.batch_size, threads=args.threads, **spec)
+    service.model
+    load = time.perf_counter() - start
+
+    start = time.perf_counter()
+    service.encode([QUESTIONS[0]])
+    first = time.perf_counter() - start
+
+    texts = make_texts(args.texts)
+    start = time.perf_counter()
+    vectors = service.encode(texts)
+    throughput = len(texts) / (time.perf_counter() - start)
+    np.save(args.out, vectors)
+    print(json.dumps({"load_s": load, "first_ms": first * 1000, "texts_per_s": throughput}))
+
+def run_child(name, args, out):
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", name, "--out", out,
+           "--texts", str(args.texts), "--batch-size", str(args.batch_size), "--threads", str(args.threads)]
+    return json.loads(subprocess.check_output(cmd).decode().strip().splitlines()[-1])
+
+def top_k(index_vectors, queries, k):
+    return np.argsort(-(queries @ index_vectors.T), axis=1)[:, :k]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads, 0 for the library default")
+    parser.add_argument("--backends", default="torch,onnx,onnx-int8")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--fp32-tolerance", type=float, default=0.9999, help="minimum cosine to PyTorch, onnx")
+    parser.add_argument("--int8-tolerance", type=float, default=0.98, help="minimum cosine to PyTorch, onnx-int8")
+    parser.add_argument("--child", choices=list(BACKENDS), help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args)
+
+    # PyTorch first: it is the reference the others are compared with
+    names = ["torch"] + [name for name in args.backends.split(",") if name != "torch"]
+    if any(BACKENDS[name]["backend"] == "onnx" for name in names):
+        from components.embedding_service import EMBED_MODEL_NAME
+        from components.onnx_embedder import export_dir, export_model, CONFIG_FILE
+        path = export_dir(EMBED_MODEL_NAME)
+        if not os.path.exists(os.path.join(path, CONFIG_FILE)):
+            print(f"Exporting {EMBED_MODEL_NAME} to {path} ...")
+            export_model(EMBED_MODEL_NAME, path, quantize=True)
+
+    texts = make_texts(args.texts)
+    questions = np.array([i for i in range(len(texts)) if i % 4 == 0])
+    passages = np.array([i for i in range(len(texts)) if i % 4])
+    print(f"{len(texts)} texts, batch size {args.batch_size}, threads {args.threads or 'default'}\n")
+    print(f"{'backend':<11}{'load s':>8}{'first ms':>10}{'texts/s':>10}{'min cos':>10}{'mean cos':>10}{'recall@k':>10}")
+
+    failed = []
+    with tempfile.TemporaryDirectory() as tmp:
+        reference = None
+        for name in names:
+            out = os.path.join(tmp, f"{name}.npy")
+            result = run_child(name, args, out)
+            vectors = np.load(out)
+            if reference is None:
+                reference = vectors
+                truth = top_k(reference[passages], reference[questions], args.k)
+            cos = np.sum(vectors * reference, axis=1) / (
+                np.linalg.norm(vectors, axis=1) * np.linalg.norm(reference, axis=1))
+            found = top_k(reference[passages], vectors[questions], args.k)
+            recall = np.mean([len(set(f) & set(t)) / args.k for f, t in zip(found, truth)])
+            print(f"{name:<11}{result['load_s']:>8.2f}{result['first_ms']:>10.1f}{result['texts_per_s']:>10.0f}"
+                  f"{cos.min():>10.5f}{cos.mean():>10.5f}{recall:>10.3f}")
+            tolerance = args.int8_tolerance if BACKENDS[name]["int8"] else args.fp32_tolerance
+            if name != "torch" and cos.min() < tolerance:
+                failed.append(f"{name}: min cos {cos.min():.5f} < {tolerance}")
+
+    if failed:
+        print("\nOutside tolerance:\n  " + "\n  ".join(failed))
+        sys.exit(1)
+    print("\nAll backends within tolerance")
+
+if __name__ == "__main__":
+    main()
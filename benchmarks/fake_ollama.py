@@ -0,0 +1,76 @@
+# benchmarks/fake_ollama.py
+"""
+Stand-in for Ollama's /api/chat so the app can be exercised without a model.
+
+    python benchmarks/fake_ollama.py --port 11435 --latency 0.5 --tokens 40 --tokens-per-sec 20
+
+Then start the app with OLLAMA_URL=http://127.0.0.1:11435.
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+def create_app(latency=0.5, tokens=40, tokens_per_sec=20.0):
+    """
+    latency: seconds before the first token (prompt processing)
+    tokens: tokens generated per response
+    tokens_per_sec: generation rate after the first token
+    """
+    async def chat(request):
+        body = await request.json()
+        prompt = body["messages"][-1]["content"]
+        words = [f"token{i} " for i in range(tokens)]
+
+        if not body.get("stream", True):
+            await asyncio.sleep(latency + tokens / tokens_per_sec)
+            return JSONResponse({"message": {"role": "assistant", "content": "".join(words)}, "done": True})
+
+        async def generate():
+            await asyncio.sleep(latency)
+            for word in words:
+                yield json.dumps({"message": {"role": "assistant", "content": word}, "done": False}) + "\n"
+                await asyncio.sleep(1.0 / tokens_per_sec)
+            yield json.dumps({
+                "message": {"role": "assistant", "content": ""},
+                "done": True,
+                "prompt_eval_count": len(prompt.split()),
+                "eval_count": tokens,
+            }) + "\n"
+
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+    async def tags(request):
+        return JSONResponse({"models": [{"name": "medllama2:latest"}]})
+
+    return Starlette(routes=[
+        Route("/api/chat", chat, methods=["POST"]),
+        Route("/api/tags", tags, methods=["GET"]),
+    ])
+
+def start_in_thread(port=11435, **kwargs) -> uvicorn.Server:
+    """Run the fake server in a daemon thread and wait until it accepts connections."""
+    server = uvicorn.Server(uvicorn.Config(create_app(**kwargs), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="fake-ollama", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--tokens-per-sec", type=float, default=20.0)
+    args = parser.parse_args()
+    app = create_app(args.latency, args.tokens, args.tokens_per_sec)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+# benchmarks/load_bench.py
+"""
+End-to-end load test of app.py against local stand-ins.
+
+Boots the FastAPI app in-process on a temporary working directory, with
+benchmarks/fake_ollama.py as the LLM and fakeredis (or --redis-url) as the
+store, then runs each scenario for --duration seconds with --clients
+concurrent clients, one session per client:
+
+    ask          POST /ask                      stages: per graph node (from the response)
+    ask_stream   POST /ask/stream               stages: first_token
+    upload       POST /upload + poll /jobs      stages: ingest, extract, embed, index
+    delete_doc   POST /delete_doc (after an untimed upload)
+    chats        GET /chats
+    ws_asr       /ws/asr streaming synthetic speech, then "end"
+                                                stages: first_partial, last_final_after_end
+
+Uploads are synthetic PDFs and DOCX files; audio is synthetic 16 kHz speech-like
+bursts separated by silence. Embedding and Whisper models are the real ones.
+
+    python benchmarks/load_bench.py [--clients 8] [--duration 20] [--scenarios ask,chats]
+                                    [--out load_results.json] [--baseline previous.json]
+
+Results (p50/p95/p99 latency, throughput, errors, per-stage p50/p95) are printed
+and written to --out as JSON; with --baseline the p50/p95 change against an
+earlier run is printed too.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import numpy as np
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.join(REPO, "benchmarks"))
+from fake_ollama import start_in_thread
+
+SCENARIOS = ("ask", "ask_stream", "upload", "delete_doc", "chats", "ws_asr")
+QUESTIONS = [
+    "What does my HbA1c mean?",
+    "Is my cholesterol in the normal range?",
+    "What should I ask my doctor about these results?",
+    "I have had a headache for 3 days, mostly when walking.",
+]
+SAMPLE_RATE = 16000
+
+# --- synthetic inputs ---
+
+def lorem(words, seed):
+    rng = np.random.default_rng(seed)
+    vocab = ("glucose hemoglobin cholesterol triglycerides creatinine platelets range normal "
+             "elevated result patient sample fasting level reference units test value").split()
+    return " ".join(rng.choice(vocab, words))
+
+def make_pdf(path, pages, seed=0):
+    import fitz
+    doc = fitz.open()
+    for p in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), lorem(350, seed + p), fontsize=9)
+    doc.save(path)
+    doc.close()
+
+def make_docx(path, paragraphs, seed=0):
+    import docx
+    document = docx.Document()
+    for p in range(paragraphs):
+        document.add_paragraph(lorem(120, seed + p))
+    document.save(path)
+
+def make_speech(seconds, seed=0) -> bytes:
+    """16-bit PCM: ~1.5 s voiced bursts (harmonics + noise) separated by ~0.8 s of near-silence."""
+    rng = np.random.default_rng(seed)
+    audio = []
+    while sum(len(a) for a in audio) < seconds * SAMPLE_RATE:
+        n = int(rng.uniform(1.0, 2.0) * SAMPLE_RATE)
+        t = np.arange(n) / SAMPLE_RATE
+        f0 = rng.uniform(100, 220)
+        voiced = sum(np.sin(2 * np.pi * f0 * k * t) / k for k in range(1, 6))
+        envelope = np.abs(np.sin(np.pi * 3 * t)) * 0.3
+        audio.append(voiced * envelope + 0.02 * rng.standard_normal(n))
+        audio.append(0.002 * rng.standard_normal(int(0.8 * SAMPLE_RATE)))
+    pcm = np.clip(np.concatenate(audio), -1, 1)
+    return (pcm * 32767).astype("<i2").tobytes()
+
+# --- app under test ---
+
+def boot_app(port, args):
+    workdir = tempfile.mkdtemp(prefix="load_bench_")
+    os.symlink(os.path.join(REPO, "frontend"), os.path.join(workdir, "frontend"))
+    os.chdir(workdir)
+    os.environ["OLLAMA_URL"] = f"http://127.0.0.1:{args.ollama_port}"
+    if args.redis_url:
+        os.environ["REDIS_URL"] = args.redis_url
+
+    from components import memory_store
+    if not args.redis_url:
+        import fakeredis
+        server = fakeredis.FakeServer()
+        memory_store.redis = fakeredis.FakeRedis(server=server, decode_responses=True)
+        memory_store.aredis = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+
+    import uvicorn
+    import app as app_module
+    server = uvicorn.Server(uvicorn.Config(app_module.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="app", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return workdir
+
+# --- scenarios: each returns (latency seconds, {stage: ms}) ---
+
+async def wait_job(client, job_id, timeout=600):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        job = (await client.get(f"/jobs/{job_id}")).json()
+        if job["state"] in ("done", "failed"):
+            if job["state"] == "failed":
+                raise RuntimeError(f"ingest failed: {job['error']}")
+            return job
+        await asyncio.sleep(0.1)
+    raise TimeoutError(f"job {job_id} did not finish")
+
+async def upload(client, ctx, session_id, n):
+    kind = "pdf" if n % 2 == 0 else "docx"
+    path = ctx["files"][kind]
+    name = f"report_{n}.{kind}"
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        res = await client.post("/upload", data={"session_id": session_id}, files={"file": (name, f)})
+    res.raise_for_status()
+    accepted = time.perf_counter() - start
+    job = await wait_job(client, res.json()["job_id"])
+    stages = {"ingest": (job["finished"] - job["created"]) * 1000}
+    stages.update({k: v * 1000 for k, v in job.get("timings", {}).items()})
+    return accepted, stages, name
+
+async def op_upload(client, ctx, session_id, n):
+    latency, stages, _ = await upload(client, ctx, session_id, n)
+    return latency, stages
+
+async def op_delete_doc(client, ctx, session_id, n):
+    _, _, name = await upload(client, ctx, session_id, n)
+    start = time.perf_counter()
+    res = await client.post("/delete_doc", data={"session_id": session_id, "filename": name})
+    res.raise_for_status()
+    return time.perf_counter() - start, {}
+
+async def op_ask(client, ctx, session_id, n):
+    start = time.perf_counter()
+    res = await client.post("/ask", data={"question": QUESTIONS[n % len(QUESTIONS)], "session_id": session_id})
+    res.raise_for_status()
+    return time.perf_counter() - start, res.json().get("timings", {})
+
+async def op_ask_stream(client, ctx, session_id, n):
+    start = time.perf_counter()
+    first = None
+    data = {"question": QUESTIONS[n % len(QUESTIONS)], "session_id": session_id}
+    async with client.stream("POST", "/ask/stream", data=data) as res:
+        res.raise_for_status()
+        async for line in res.aiter_lines():
+            if line.startswith("data:") and first is None:
+                first = time.perf_counter() - start
+            if line.startswith("event: error"):
+                raise RuntimeError("stream reported an error")
+    return time.perf_counter() - start, {"first_token": (first or 0) * 1000}
+
+async def op_chats(client, ctx, session_id, n):
+    start = time.perf_counter()
+    res = await client.get("/chats")
+    res.raise_for_status()
+    return time.perf_counter() - start, {}
+
+async def op_ws_asr(client, ctx, session_id, n):
+    import websockets
+    pcm, chunk = ctx["speech"], SAMPLE_RATE // 10 * 2  # 100 ms frames
+    start = time.perf_counter()
+    first_partial = None
+    async with websockets.connect(f"ws://127.0.0.1:{ctx['port']}/ws/asr", max_size=None) as ws:
+        async def receive(deadline):
+            nonlocal first_partial
+            last_final = None
+            while True:
+                try:
+                    message = json.loads(await asyncio.wait_for(ws.recv(), max(0.01, deadline - time.perf_counter())))
+                except asyncio.TimeoutError:
+                    return last_final
+                if message["type"] == "partial" and first_partial is None:
+                    first_partial = time.perf_counter() - start
+                if message["type"] == "final":
+                    last_final = time.perf_counter()
+
+        receiver = asyncio.create_task(receive(float("inf")))
+        for offset in range(0, len(pcm), chunk):
+            await ws.send(pcm[offset:offset + chunk])
+            await asyncio.sleep(0.1 / ctx["asr_speed"])
+        receiver.cancel()
+        ended = time.perf_counter()
+        await ws.send("end")
+        # Whatever was still in progress is finalized after "end"; stop once the server goes quiet
+        last_final = await receive(ended + ctx["asr_tail"])
+    stages = {"first_partial": (first_partial or 0) * 1000}
+    if last_final is not None and last_final > ended:
+        stages["last_final_after_end"] = (last_final - ended) * 1000
+    return time.perf_counter() - start, stages
+
+OPS = {
+    "ask": op_ask, "ask_stream": op_ask_stream, "upload": op_upload,
+    "delete_doc": op_delete_doc, "chats": op_chats, "ws_asr": op_ws_asr,
+}
+
+# --- driver ---
+
+def summarize(latencies, stages, errors, elapsed):
+    ms = np.array(latencies) * 1000 if latencies else np.zeros(0)
+    pct = lambda a, q: float(np.percentile(a, q)) if len(a) else None
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "p50": pct(ms, 50), "p95": pct(ms, 95), "p99": pct(ms, 99),
+            "mean": float(ms.mean()) if len(ms) else None, "max": float(ms.max()) if len(ms) else None,
+        },
+        "stages_ms": {
+            name: {"p50": pct(np.array(values), 50), "p95": pct(np.array(values), 95)}
+            for name, values in sorted(stages.items())
+        },
+    }
+
+async def run_scenario(name, args, ctx):
+    op = OPS[name]
+    latencies, stages, errors = [], {}, []
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{ctx['port']}", timeout=args.timeout) as client:
+        if name in ("ask", "ask_stream"):
+            # Give every session a document so retrieval has something to search
+            await asyncio.gather(*[upload(client, ctx, f"bench_{name}_{c}", 0) for c in range(args.clients)])
+
+        deadline = time.perf_counter() + args.duration
+
+        async def worker(c):
+            n = 0
+            while time.perf_counter() < deadline:
+                try:
+                    latency, stage_ms = await op(client, ctx, f"bench_{name}_{c}", n)
+                except Exception as e:
+                    errors.append(f"{type(e).__name__}: {e}")
+                else:
+                    latencies.append(latency)
+                    for stage, value in stage_ms.items():
+                        stages.setdefault(stage, []).append(value)
+                n += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(c) for c in range(args.clients)])
+        elapsed = time.perf_counter() - start
+    result = summarize(latencies, stages, len(errors), elapsed)
+    result["error_samples"] = sorted(set(errors))[:5]
+    return result
+
+def print_report(results, baseline):
+    print(f"\n{'scenario':<12}{'reqs':>7}{'err':>5}{'rps':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    fmt = lambda v: f"{v:>10.1f}" if v is not None else f"{'-':>10}"
+    for name, r in results.items():
+        lat = r["latency_ms"]
+        print(f"{name:<12}{r['requests']:>7}{r['errors']:>5}{r['throughput_rps']:>8.2f}"
+              f"{fmt(lat['p50'])}{fmt(lat['p95'])}{fmt(lat['p99'])}")
+        for stage, s in r["stages_ms"].items():
+            print(f"  {stage:<30}{fmt(s['p50'])}{fmt(s['p95'])}")
+        old = (baseline or {}).get(name)
+        if old and old["latency_ms"]["p50"] and lat["p50"]:
+            change = lambda q: 100 * (lat[q] / old["latency_ms"][q] - 1)
+            print(f"  vs baseline: p50 {change('p50'):+.0f}%  p95 {change('p95'):+.0f}%")
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "-C", REPO, "rev-parse", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per scenario")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ollama-port", type=int, default=11437)
+    parser.add_argument("--ollama-latency", type=float, default=0.5, help="fake Ollama time to first token")
+    parser.add_argument("--ollama-tokens", type=int, default=40)
+    parser.add_argument("--ollama-tokens-per-sec", type=float, default=20.0)
+    parser.add_argument("--redis-url", default=None, help="use a real Redis instead of fakeredis")
+    parser.add_argument("--pdf-pages", type=int, default=10)
+    parser.add_argument("--audio-seconds", type=float, default=10.0)
+    parser.add_argument("--asr-speed", type=float, default=1.0, help="audio send rate as a multiple of real time")
+    parser.add_argument("--asr-tail", type=float, default=10.0, help="seconds to wait for finals after 'end'")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--out", default="load_results.json")
+    parser.add_argument("--baseline", default=None, help="earlier --out file to compare against")
+    args = parser.parse_args()
+    out = os.path.abspath(args.out)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    start_in_thread(args.ollama_port, latency=args.ollama_latency, tokens=args.ollama_tokens,
+                    tokens_per_sec=args.ollama_tokens_per_sec)
+    workdir = boot_app(args.port, args)
+    files = {"pdf": os.path.join(workdir, "synthetic.pdf"), "docx": os.path.join(workdir, "synthetic.docx")}
+    make_pdf(files["pdf"], args.pdf_pages)
+    make_docx(files["docx"], args.pdf_pages * 3)
+    ctx = {
+        "port": args.port, "files": files, "speech": make_speech(args.audio_seconds),
+        "asr_speed": args.asr_speed, "asr_tail": args.asr_tail,
+    }
+
+    results = {}
+    for name in args.scenarios.split(","):
+        print(f"running {name} ({args.clients} clients, {args.duration:.0f} s)...", flush=True)
+        results[name] = asyncio.run(run_scenario(name, args, ctx))
+
+    print_report(results, baseline)
+    report = {
+        "meta": {"timestamp": time.time(), "commit": git_commit(), "workdir": workdir, "args": vars(args)},
+        "results": results,
+    }
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nwrote {out}")
+
+if __name__ == "__main__":
+    main()
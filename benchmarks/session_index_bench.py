@@ -0,0 +1,156 @@
+# benchmarks/session_index_bench.py
+"""
+Memory, load time and recall of session indexes per ANN_FLAT_CODEC, with and
+without INDEX_MMAP.
+
+Writes --sessions flat indexes of --per-session synthetic embeddings (unit
+length, clustered per session like a document's chunks) in each codec, then
+for every codec and load mode starts a fresh process that loads all of them
+and runs --queries searches per session, as a node serving those sessions
+would. Reported per row:
+
+    stored     codec actually written (int8 and pq fall back to fp16 below their training minimum)
+    disk B/v   index file bytes per vector
+    load ms    mean faiss read per session
+    anon MB    private memory after loading and searching everything
+    file MB    file-backed (page cache, shared between processes) resident memory
+    search us  mean time per query
+    recall@k   overlap with exact float32 search, at the retrieval path's
+               document (3) and chat (5) top_k, and at 10
+
+    python benchmarks/session_index_bench.py [--sessions 2000] [--per-session 200] [--dim 384]
+                                             [--codecs float32,fp16,int8,pq] [--queries 5]
+
+Memory figures come from /proc/self/status and are only shown on Linux.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import faiss
+import numpy as np
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+from components.index_factory import flat_storage, flat_codec, load_index
+
+KS = (3, 5, 10)
+
+def session_vectors(session, n, dim, seed):
+    """n document-chunk-like vectors around a few topics, plus queries near them."""
+    rng = np.random.default_rng((seed, session))
+    topics = rng.standard_normal((4, dim)).astype("float32")
+    x = topics[rng.integers(0, len(topics), n)] + 0.8 * rng.standard_normal((n, dim)).astype("float32")
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+def queries_for(vectors, count, seed):
+    rng = np.random.default_rng(seed)
+    q = vectors[rng.integers(0, len(vectors), count)] + 0.1 * rng.standard_normal((count, vectors.shape[1])).astype("float32")
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+def memory_mb():
+    fields = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("RssAnon", "RssFile"):
+                    fields[key] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return fields
+
+def child(args):
+    paths = sorted(os.path.join(args.folder, f) for f in os.listdir(args.folder) if f.endswith(".index"))
+    queries = np.load(os.path.join(args.folder, "queries.npy"))
+    before = memory_mb()
+    start = time.perf_counter()
+    indexes = [load_index(path, mmap=args.mmap)[0] for path in paths]
+    load = (time.perf_counter() - start) / len(paths)
+
+    found = []
+    start = time.perf_counter()
+    for index, q in zip(indexes, queries):
+        found.append(index.search(q, max(KS))[1])
+    search = (time.perf_counter() - start) / queries.shape[0] / queries.shape[1]
+    np.save(args.out, np.stack(found))
+    after = memory_mb()
+    print(json.dumps({
+        "load_ms": load * 1000,
+        "search_us": search * 1e6,
+        "anon_mb": after.get("RssAnon", 0) - before.get("RssAnon", 0),
+        "file_mb": after.get("RssFile", 0) - before.get("RssFile", 0),
+    }))
+
+def run_child(folder, mmap, out):
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", "--folder", folder, "--out", out]
+    if mmap:
+        cmd.append("--mmap")
+    return json.loads(subprocess.check_output(cmd).decode().strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--per-session", type=int, default=200, help="vectors per session index")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--codecs", default="float32,fp16,int8,pq")
+    parser.add_argument("--queries", type=int, default=5, help="searches per session")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--mmap", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--folder", help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args)
+
+    faiss.omp_set_num_threads(1)
+    codecs = args.codecs.split(",")
+    print(f"{args.sessions} sessions x {args.per_session} vectors, dim {args.dim}, "
+          f"{args.queries} queries per session\n")
+    print(f"{'codec':<9}{'mmap':<6}{'stored':<9}{'disk B/v':>9}{'load ms':>9}{'anon MB':>9}{'file MB':>9}"
+          f"{'search us':>10}" + "".join(f"{'recall@' + str(k):>10}" for k in KS))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        truth, queries = [], []
+        folders = {codec: os.path.join(tmp, codec) for codec in codecs}
+        for folder in folders.values():
+            os.makedirs(folder)
+        ids = np.arange(args.per_session, dtype="int64")
+        stored = {}
+        for session in range(args.sessions):
+            vectors = session_vectors(session, args.per_session, args.dim, args.seed)
+            q = queries_for(vectors, args.queries, args.seed + session)
+            queries.append(q)
+            # Exact float32 search is what the existing indexes return
+            distances = ((q[:, None, :] - vectors[None, :, :]) ** 2).sum(axis=2)
+            truth.append(np.argsort(distances, axis=1)[:, :max(KS)])
+            for codec, folder in folders.items():
+                index = faiss.IndexIDMap2(flat_storage(args.dim, vectors, codec))
+                index.add_with_ids(vectors, ids)
+                stored[codec] = flat_codec(index)
+                faiss.write_index(index, os.path.join(folder, f"{session:06d}.index"))
+        for folder in folders.values():
+            np.save(os.path.join(folder, "queries.npy"), np.stack(queries))
+
+        vectors_total = args.sessions * args.per_session
+        for codec, folder in folders.items():
+            disk = sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder) if f.endswith(".index"))
+            for mmap in (False, True):
+                out = os.path.join(tmp, "found.npy")
+                result = run_child(folder, mmap, out)
+                found = np.load(out)
+                recalls = [
+                    np.mean([len(set(f[:k]) & set(t[:k])) / k
+                             for fs, ts in zip(found, truth) for f, t in zip(fs, ts)])
+                    for k in KS
+                ]
+                print(f"{codec:<9}{'yes' if mmap else 'no':<6}{stored[codec]:<9}{disk / vectors_total:>9.0f}"
+                      f"{result['load_ms']:>9.3f}{result['anon_mb']:>9.1f}{result['file_mb']:>9.1f}"
+                      f"{result['search_us']:>10.1f}" + "".join(f"{r:>10.3f}" for r in recalls))
+
+if __name__ == "__main__":
+    main()
@@ -1,51 +1,189 @@
 # components/asr.py
 import os
-import uuid
+import json
 import asyncio
+import uuid
+import logging
+from collections import deque
 import numpy as np
 import soundfile as sf
-from io import BytesIO
-from faster_whisper import WhisperModel
 from starlette.websockets import WebSocket
+from components.asr_pool import ASRPool, ASRQueueFull
+
+logger = logging.getLogger(__name__)
 
-# Init model
-model = WhisperModel("medium", device="cpu", compute_type="int8")
+SAMPLE_RATE = 16000
+ASR_FRAME_MS = int(os.getenv("ASR_FRAME_MS", "30"))
+ASR_VAD_MIN_RMS = float(os.getenv("ASR_VAD_MIN_RMS", "0.01"))
+ASR_VAD_NOISE_RATIO = float(os.getenv("ASR_VAD_NOISE_RATIO", "3.0"))
+ASR_MIN_SILENCE_MS = int(os.getenv("ASR_MIN_SILENCE_MS", "600"))
+ASR_PREROLL_MS = int(os.getenv("ASR_PREROLL_MS", "200"))
+ASR_PARTIAL_INTERVAL_MS = int(os.getenv("ASR_PARTIAL_INTERVAL_MS", "1000"))
+ASR_MAX_SEGMENT_S = float(os.getenv("ASR_MAX_SEGMENT_S", "15"))
+
+# Shared inference workers for every session
+asr_pool = ASRPool()
 
 # Directory to save audio
 AUDIO_DIR = "audio"
 os.makedirs(AUDIO_DIR, exist_ok=True)
 
 # Transcribe audio file (for /transcribe endpoint)
-def transcribe_audio(file_path: str) -> str:
-    segments, _ = model.transcribe(file_path, language="en", task="translate")
-    return " ".join([s.text.strip() for s in segments])
+async def transcribe_audio(file_path: str) -> str:
+    return await asr_pool.transcribe(f"upload:{file_path}", file_path, batched=True)
+
+class SpeechSegmenter:
+    """
+    Energy-based voice activity segmentation for a 16 kHz mono stream.
+
+    feed() consumes raw samples and returns work items:
+      ("final", audio)   a finished utterance (trailing silence or max length reached)
+      ("partial", audio) the utterance in progress, at most every ASR_PARTIAL_INTERVAL_MS
+    Only speech is ever returned, and each utterance is finalized exactly once.
+    Memory is bounded by ASR_MAX_SEGMENT_S regardless of session length.
+    """
+    def __init__(self):
+        self.frame = SAMPLE_RATE * ASR_FRAME_MS // 1000
+        self.min_silence_frames = max(1, ASR_MIN_SILENCE_MS // ASR_FRAME_MS)
+        self.partial_frames = max(1, ASR_PARTIAL_INTERVAL_MS // ASR_FRAME_MS)
+        self.max_frames = int(ASR_MAX_SEGMENT_S * 1000 // ASR_FRAME_MS)
+        self.preroll = deque(maxlen=max(1, ASR_PREROLL_MS // ASR_FRAME_MS))
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.noise_floor = ASR_VAD_MIN_RMS / ASR_VAD_NOISE_RATIO
+        self.segment = []
+        self.silence = 0
+        self.since_partial = 0
+
+    def _is_speech(self, frame) -> bool:
+        rms = float(np.sqrt(np.mean(frame ** 2)))
+        speech = rms > max(ASR_VAD_MIN_RMS, self.noise_floor * ASR_VAD_NOISE_RATIO)
+        if not speech:
+            # Track background noise slowly so the threshold adapts to the room
+            self.noise_floor = 0.95 * self.noise_floor + 0.05 * rms
+        return speech
+
+    def _take_segment(self):
+        audio = np.concatenate(self.segment)
+        self.segment = []
+        self.silence = 0
+        self.since_partial = 0
+        return audio
+
+    def feed(self, samples: np.ndarray):
+        work = []
+        self.pending = np.concatenate([self.pending, samples])
+        usable = len(self.pending) // self.frame * self.frame
+        frames, self.pending = self.pending[:usable], self.pending[usable:]
+
+        for frame in frames.reshape(-1, self.frame):
+            speech = self._is_speech(frame)
+            if not self.segment:
+                if speech:
+                    self.segment = list(self.preroll) + [frame]
+                    self.preroll.clear()
+                else:
+                    self.preroll.append(frame)
+                continue
+
+            self.segment.append(frame)
+            self.since_partial += 1
+            self.silence = 0 if speech else self.silence + 1
+            if self.silence >= self.min_silence_frames or len(self.segment) >= self.max_frames:
+                work.append(("final", self._take_segment()))
+
+        if self.segment and self.since_partial >= self.partial_frames:
+            self.since_partial = 0
+            work.append(("partial", np.concatenate(self.segment)))
+        return work
+
+    def flush(self):
+        return [("final", self._take_segment())] if self.segment else []
 
 # Async transcription for live WebSocket stream
 async def stream_asr(websocket: WebSocket):
+    """
+    Receives 16-bit PCM at 16 kHz and sends JSON messages:
+      {"type": "partial", "text": ...}  provisional text of the utterance in progress
+      {"type": "final", "text": ...}    committed text of a finished utterance
+      {"type": "busy"}                  the server is overloaded and an utterance was not transcribed
+    Sending the text message "end" commits the utterance in progress.
+    The whole session is written to audio/<id>.wav as it arrives.
+    """
     session_id = str(uuid.uuid4())
-    audio_chunks = []
-    try:
+    segmenter = SpeechSegmenter()
+    # Recent committed text, the prompt for the next utterance
+    committed = deque(maxlen=3)
+    recording = sf.SoundFile(f"{AUDIO_DIR}/{session_id}.wav", mode="w", samplerate=SAMPLE_RATE, channels=1, subtype="PCM_16")
+    # (kind, future) in the order the work was submitted; a None future is a rejected final
+    results = asyncio.Queue()
+
+    def submit(work):
+        # Queued in the pool, which drops a partial superseded by a newer one and
+        # bounds how much of the session may wait (ASR_MAX_QUEUED_PER_SESSION)
+        for kind, audio in work:
+            try:
+                # Keeps wording consistent across utterances
+                future = asr_pool.submit(session_id, audio, " ".join(committed), droppable=(kind == "partial"))
+            except ASRQueueFull:
+                # Keep the session open: a partial is just skipped, a lost final is reported
+                if kind == "final":
+                    results.put_nowait((kind, None))
+                continue
+            results.put_nowait((kind, future))
+
+    async def send_results():
         while True:
-            data = await websocket.receive_bytes()
-            
+            kind, future = await results.get()
+            try:
+                text = None if future is None else await asyncio.wrap_future(future)
+            except Exception:
+                logger.exception("Transcription failed for session %s", session_id)
+                future = None
+            if future is None:
+                if kind == "final":
+                    await websocket.send_text(json.dumps({"type": "busy"}))
+                continue
+            if text is None:
+                # Superseded by a newer partial
+                continue
+            if kind == "final" and text:
+                committed.append(text)
+            if text or kind == "final":
+                await websocket.send_text(json.dumps({"type": kind, "text": text}))
+
+    # Results are awaited and sent by their own task, so a slow transcription
+    # never stops this loop from reading audio
+    sender = asyncio.create_task(send_results())
+    try:
+        while not sender.done():
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("text") == "end":
+                # Client is done talking: commit whatever is still in progress
+                submit(segmenter.flush())
+                continue
+            data = message.get("bytes")
+            if not data:
+                continue
+
             # Convert PCM to float32 waveform
             if len(data) % 2 != 0:
                 data += b'\x00'
             audio_np = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
-            audio_chunks.append(audio_np)
-
-            # Concatenate and transcribe
-            if sum(len(chunk) for chunk in audio_chunks) >= 16000 * 3:  # 3 sec buffer
-                full_audio = np.concatenate(audio_chunks[-5:])
-                audio_chunks = audio_chunks[-5:]
+            recording.write(audio_np)
 
-                segments, _ = model.transcribe(full_audio, language="en", task="translate")
-                text = " ".join(s.text.strip() for s in segments)
-                await websocket.send_text(text)
+            work = segmenter.feed(audio_np)
+            # A newer partial supersedes older ones, and a final supersedes them all
+            finals = [w for w in work if w[0] == "final"]
+            partials = [w for w in work if w[0] == "partial"]
+            submit(finals + partials[-1:])
     except Exception as e:
-        print(f"WebSocket disconnected: {e}")
+        logger.info("WebSocket disconnected: %s", e)
     finally:
-        # Save full audio to file
-        if audio_chunks:
-            final_audio = np.concatenate(audio_chunks)
-            sf.write(f"{AUDIO_DIR}/{session_id}.wav", final_audio, samplerate=16000)
+        sender.cancel()
+        if sender.done() and not sender.cancelled() and sender.exception():
+            logger.info("WebSocket send failed: %s", sender.exception())
+        # Nobody is left to send the results to
+        asr_pool.cancel(session_id)
+        recording.close()
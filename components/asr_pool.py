@@ -0,0 +1,202 @@
+# components/asr_pool.py
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+import numpy as np
+from components.metrics import observe
+
+logger = logging.getLogger(__name__)
+
+ASR_MODEL = os.getenv("ASR_MODEL", "medium")
+ASR_WORKERS = int(os.getenv("ASR_WORKERS", "2"))
+ASR_CPU_THREADS = int(os.getenv("ASR_CPU_THREADS", "4"))
+ASR_MAX_QUEUED_PER_SESSION = int(os.getenv("ASR_MAX_QUEUED_PER_SESSION", "4"))
+ASR_BATCH_SIZE = int(os.getenv("ASR_BATCH_SIZE", "8"))
+
+class ASRQueueFull(Exception):
+    pass
+
+class _Job:
+    def __init__(self, session_id, audio, prompt, droppable, batched):
+        self.session_id = session_id
+        self.audio = audio
+        self.prompt = prompt
+        self.droppable = droppable
+        self.batched = batched
+        self.future = Future()
+        self.enqueued = time.monotonic()
+
+class ASRPool:
+    """
+    Whisper inference shared by every /ws/asr session and /transcribe upload.
+
+    One CTranslate2 model is loaded with num_workers=workers so that `workers`
+    threads can decode in parallel, each using cpu_threads threads. Jobs are
+    queued per session and workers take them round-robin across sessions, so a
+    busy session cannot starve the others. Per session at most
+    max_queued_per_session jobs may wait; a droppable job (a provisional
+    partial) replaces the session's previous queued one instead of adding to it.
+    Whole-file jobs go through faster-whisper's BatchedInferencePipeline, which
+    batches the file's VAD segments into one forward pass.
+
+    Nothing is loaded at construction: the model is loaded and the workers
+    started by load(), called from the startup warm-up or by the first submit().
+    Jobs submitted meanwhile wait in the queue.
+    """
+    def __init__(self, model_name=ASR_MODEL, workers=ASR_WORKERS, cpu_threads=ASR_CPU_THREADS,
+                 max_queued_per_session=ASR_MAX_QUEUED_PER_SESSION, batch_size=ASR_BATCH_SIZE):
+        self.model_name = model_name
+        self.workers = workers
+        self.cpu_threads = cpu_threads
+        self.model = None
+        self.batched = None
+        self.batch_size = batch_size
+        self.max_queued_per_session = max_queued_per_session
+        self._queues = OrderedDict()
+        self._cond = threading.Condition()
+        self._latencies = deque(maxlen=1000)
+        self.processed = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.busy = 0
+        self._load_lock = threading.Lock()
+        self._loader = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.model is not None
+
+    def load(self):
+        """Load the model and start the workers; blocks until done. Safe to call repeatedly."""
+        if self.model is not None:
+            return
+        with self._load_lock:
+            if self.model is not None:
+                return
+            from faster_whisper import WhisperModel, BatchedInferencePipeline
+            model = WhisperModel(self.model_name, device="cpu", compute_type="int8",
+                                 cpu_threads=self.cpu_threads, num_workers=self.workers)
+            self.batched = BatchedInferencePipeline(model=model)
+            self.model = model
+            for i in range(self.workers):
+                threading.Thread(target=self._run, name=f"asr-worker-{i}", daemon=True).start()
+
+    def _load_in_background(self):
+        # submit() runs on the event loop, so it must not wait for the model itself
+        with self._load_lock:
+            if self.model is None and self._loader is None:
+                self._loader = threading.Thread(target=self._background_load, name="asr-loader", daemon=True)
+                self._loader.start()
+
+    def _background_load(self):
+        try:
+            self.load()
+        except Exception as e:
+            logger.exception("Loading Whisper model %s failed", self.model_name)
+            # Fail what is queued; the next submit() tries again
+            with self._cond:
+                jobs = [job for queue in self._queues.values() for job in queue]
+                self._queues.clear()
+            for job in jobs:
+                job.future.set_exception(e)
+        finally:
+            self._loader = None
+
+    def submit(self, session_id, audio, prompt=None, droppable=False, batched=False) -> Future:
+        """
+        Queue audio (a float32 array or a file path) for transcription.
+        The future resolves to the text, or None if a newer droppable job superseded it.
+        """
+        job = _Job(session_id, audio, prompt, droppable, batched)
+        with self._cond:
+            queue = self._queues.setdefault(session_id, deque())
+            if droppable:
+                for i, old in enumerate(queue):
+                    if old.droppable:
+                        del queue[i]
+                        old.future.set_result(None)
+                        self.dropped += 1
+                        break
+            if len(queue) >= self.max_queued_per_session:
+                if not queue:
+                    del self._queues[session_id]
+                self.rejected += 1
+                raise ASRQueueFull(f"Too many pending transcriptions for session {session_id}")
+            queue.append(job)
+            self._cond.notify()
+        if self.model is None:
+            self._load_in_background()
+        return job.future
+
+    def cancel(self, session_id):
+        """Drop a session's queued jobs (e.g. its client went away); their futures resolve to None."""
+        with self._cond:
+            queue = self._queues.pop(session_id, None)
+        for job in queue or ():
+            job.future.set_result(None)
+
+    async def transcribe(self, session_id, audio, prompt=None, droppable=False, batched=False):
+        return await asyncio.wrap_future(self.submit(session_id, audio, prompt, droppable, batched))
+
+    def _next_job(self):
+        with self._cond:
+            while not self._queues:
+                self._cond.wait()
+            # Round-robin: take the oldest session's first job, then move the session to the back
+            session_id, queue = self._queues.popitem(last=False)
+            job = queue.popleft()
+            if queue:
+                self._queues[session_id] = queue
+            self.busy += 1
+            return job
+
+    def _decode(self, job) -> str:
+        if job.batched:
+            segments, _ = self.batched.transcribe(job.audio, language="en", task="translate", batch_size=self.batch_size)
+        else:
+            segments, _ = self.model.transcribe(
+                job.audio, language="en", task="translate",
+                initial_prompt=job.prompt or None, condition_on_previous_text=False,
+            )
+        return " ".join(s.text.strip() for s in segments).strip()
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            started = time.monotonic()
+            try:
+                text = self._decode(job)
+            except Exception as e:
+                job.future.set_exception(e)
+                text = None
+            else:
+                job.future.set_result(text)
+            finished = time.monotonic()
+            observe("whisper_queue_wait", started - job.enqueued)
+            observe("whisper_decode", finished - started)
+            with self._cond:
+                self.busy -= 1
+                self.processed += 1
+                self._latencies.append((started - job.enqueued, finished - started))
+
+    def stats(self) -> dict:
+        with self._cond:
+            waits = np.array([w for w, _ in self._latencies]) if self._latencies else np.zeros(1)
+            decodes = np.array([d for _, d in self._latencies]) if self._latencies else np.zeros(1)
+            return {
+                "queue_depth": sum(len(q) for q in self._queues.values()),
+                "sessions_waiting": len(self._queues),
+                "loaded": self.loaded,
+                "busy_workers": self.busy,
+                "processed": self.processed,
+                "dropped": self.dropped,
+                "rejected": self.rejected,
+                "queue_wait_ms_p50": float(np.percentile(waits, 50) * 1000),
+                "queue_wait_ms_p95": float(np.percentile(waits, 95) * 1000),
+                "decode_ms_p50": float(np.percentile(decodes, 50) * 1000),
+                "decode_ms_p95": float(np.percentile(decodes, 95) * 1000),
+            }
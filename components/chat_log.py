@@ -0,0 +1,293 @@
+# components/chat_log.py
+import os
+import pickle
+from array import array
+import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import faiss
+import numpy as np
+from filelock import FileLock
+from components.metrics import timer
+from components.index_factory import flat_storage, load_index, owned_copy
+
+CHAT_COMPACT_THRESHOLD = int(os.getenv("CHAT_COMPACT_THRESHOLD", "256"))
+CHAT_LOG_CACHE_SIZE = int(os.getenv("CHAT_LOG_CACHE_SIZE", "1024"))
+
+# Vector log header: magic + embedding dimension
+_VEC_MAGIC = b"MNVC"
+_VEC_HEADER = struct.Struct("<4sI")
+
+# Compaction is cheap to schedule and must never block a request
+_compactor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-compactor")
+
+def _append(f, data: bytes):
+    f.write(data)
+    f.flush()
+    os.fsync(f.fileno())
+
+class ChatLog:
+    """
+    Append-only chat memory for one session.
+
+    On disk (all under `folder`, prefixed with `{session_id}_chat`):
+      .vec   header + float32 vectors, one row per message
+      .off   uint64 start offset of each message in .txt
+      .txt   UTF-8 message text, length-prefixed
+      .faiss compacted flat index over the first N messages (ANN_FLAT_CODEC)
+
+    Each append only touches the tail of the three logs and is fsynced.
+    Searches combine the compacted index with a brute-force scan of the
+    in-memory tail; the tail is folded into the index in the background.
+
+    Several processes may share a session: appends, repairs and snapshot
+    replacement hold {session_id}_chat.lock, and before each search or append
+    a process reads the rows other processes appended since it last looked.
+    """
+    def __init__(self, folder, session_id):
+        self.session_id = session_id
+        base = os.path.join(folder, f"{session_id}_chat")
+        self.vec_path = base + ".vec"
+        self.off_path = base + ".off"
+        self.txt_path = base + ".txt"
+        self.index_path = base + ".faiss"
+        self.lock = threading.RLock()
+        self.file_lock = FileLock(base + ".lock")
+        self.dim = None
+        self.index = None
+        self.mapped = False
+        self.offsets = array("Q")
+        self.tail = None
+        self._compacting = False
+        self._deleted = False
+        with self.file_lock:
+            self._open()
+
+    @property
+    def count(self) -> int:
+        return len(self.offsets)
+
+    def exists(self) -> bool:
+        with self.lock:
+            self._refresh()
+            return self.count > 0
+
+    def _open(self):
+        """Load the logs, cutting off a partial record left by a crash (holding file_lock)."""
+        self.dim = None
+        self.index = None
+        self.mapped = False
+        self.offsets = array("Q")
+        self.tail = None
+        self._migrate_legacy()
+        if not os.path.exists(self.vec_path):
+            return
+        with open(self.vec_path, "rb") as f:
+            magic, dim = _VEC_HEADER.unpack(f.read(_VEC_HEADER.size))
+        if magic != _VEC_MAGIC:
+            raise ValueError(f"Corrupt chat vector log: {self.vec_path}")
+        self.dim = dim
+        row = dim * 4
+
+        # A crash can leave any of the logs one partial record ahead; trust only complete rows
+        vec_rows = (os.path.getsize(self.vec_path) - _VEC_HEADER.size) // row
+        self.offsets = array("Q")
+        if os.path.exists(self.off_path):
+            with open(self.off_path, "rb") as f:
+                data = f.read()
+            self.offsets.frombytes(data[:len(data) // 8 * 8])
+        count = min(vec_rows, len(self.offsets))
+        del self.offsets[count:]
+        os.truncate(self.vec_path, _VEC_HEADER.size + count * row)
+        with open(self.off_path, "ab") as f:
+            f.truncate(count * 8)
+
+        compacted = 0
+        if os.path.exists(self.index_path):
+            index, mapped = load_index(self.index_path)
+            if index.d == dim and index.ntotal <= count:
+                self.index, self.mapped = index, mapped
+                compacted = index.ntotal
+        if self.index is None:
+            self.index = flat_storage(dim)
+        self.tail = np.fromfile(
+            self.vec_path, dtype="<f4", count=(count - compacted) * dim,
+            offset=_VEC_HEADER.size + compacted * row,
+        ).reshape(-1, dim)
+
+    def _refresh(self):
+        """Pick up messages other processes appended (holding self.lock)."""
+        try:
+            size = os.path.getsize(self.vec_path)
+        except FileNotFoundError:
+            size = 0
+        if self.dim is None:
+            if size:
+                with self.file_lock:
+                    self._open()
+            return
+        row = self.dim * 4
+        expected = _VEC_HEADER.size + self.count * row
+        if size == expected:
+            return
+        if size < expected:
+            # Deleted (and maybe restarted) by another process
+            with self.file_lock:
+                self._open()
+            return
+        # A vector row is written last, so its offset and text are already complete
+        rows = (size - expected) // row
+        with open(self.off_path, "rb") as f:
+            f.seek(self.count * 8)
+            data = f.read(rows * 8)
+        rows = min(rows, len(data) // 8)
+        if not rows:
+            return
+        vectors = np.fromfile(self.vec_path, dtype="<f4", count=rows * self.dim, offset=expected).reshape(-1, self.dim)
+        self.offsets.frombytes(data[:rows * 8])
+        self.tail = np.vstack([self.tail, vectors])
+
+    def _migrate_legacy(self):
+        # Older builds stored chat memory as {session}_chat.faiss plus a pickled message list
+        legacy_chunks = self.index_path + ".pkl"
+        if os.path.exists(self.vec_path) or not os.path.exists(legacy_chunks) or not os.path.exists(self.index_path):
+            return
+        index = faiss.read_index(self.index_path)
+        with open(legacy_chunks, "rb") as f:
+            messages = pickle.load(f)
+        vectors = index.reconstruct_n(0, index.ntotal) if index.ntotal else np.zeros((0, index.d), dtype="float32")
+        with open(self.vec_path, "wb") as vf, open(self.off_path, "wb") as of, open(self.txt_path, "wb") as tf:
+            vf.write(_VEC_HEADER.pack(_VEC_MAGIC, index.d))
+            offset = 0
+            for vector, text in zip(vectors, messages):
+                data = text.encode("utf-8")
+                tf.write(struct.pack("<I", len(data)) + data)
+                of.write(struct.pack("<Q", offset))
+                vf.write(np.asarray(vector, dtype="<f4").tobytes())
+                offset += 4 + len(data)
+            for f in (vf, of, tf):
+                f.flush()
+                os.fsync(f.fileno())
+        os.remove(legacy_chunks)
+
+    def append(self, vector, text: str):
+        vector = np.asarray(vector, dtype="<f4").reshape(1, -1)
+        data = text.encode("utf-8")
+        with self.lock, self.file_lock:
+            if self._deleted:
+                return
+            self._refresh()
+            if self.dim is None:
+                self.dim = vector.shape[1]
+                self.index = flat_storage(self.dim)
+                self.tail = np.zeros((0, self.dim), dtype="<f4")
+                with open(self.vec_path, "wb") as f:
+                    _append(f, _VEC_HEADER.pack(_VEC_MAGIC, self.dim))
+
+            # Text first, then its offset, then the vector: a message only
+            # counts once its vector row is durable
+            with open(self.txt_path, "ab") as f:
+                offset = f.tell()
+                _append(f, struct.pack("<I", len(data)) + data)
+            with open(self.off_path, "ab") as f:
+                _append(f, struct.pack("<Q", offset))
+            with open(self.vec_path, "ab") as f:
+                _append(f, vector.tobytes())
+
+            self.offsets.append(offset)
+            self.tail = np.vstack([self.tail, vector])
+            if len(self.tail) >= CHAT_COMPACT_THRESHOLD and not self._compacting:
+                self._compacting = True
+                _compactor.submit(self.compact)
+
+    def compact(self):
+        """Fold the in-memory tail into the FAISS index and persist a snapshot of it."""
+        with self.lock:
+            try:
+                if self._deleted or self.tail is None or not len(self.tail):
+                    return
+                if not self.index.ntotal:
+                    # Trained codecs (see ANN_FLAT_CODEC) learn from the first batch
+                    self.index = flat_storage(self.dim, self.tail)
+                elif self.mapped:
+                    self.index, self.mapped = owned_copy(self.index), False
+                self.index.add(np.ascontiguousarray(self.tail, dtype="float32"))
+                self.tail = self.tail[:0]
+                snapshot = faiss.serialize_index(self.index)
+            finally:
+                self._compacting = False
+        # The index can always be rebuilt from the vector log, so a crash here is harmless.
+        # Every process compacts its own copy; the snapshots agree on the rows they cover
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            _append(f, snapshot.tobytes())
+        with self.lock, self.file_lock:
+            if not self._deleted and os.path.exists(self.vec_path):
+                os.replace(tmp_path, self.index_path)
+            elif os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def search(self, query_vec, top_k=5):
+        query_vec = np.asarray(query_vec, dtype="float32").reshape(1, -1)
+        with self.lock, timer("chat_search"):
+            self._refresh()
+            if not self.count:
+                return []
+            hits = []
+            if self.index.ntotal:
+                D, I = self.index.search(query_vec, min(top_k, self.index.ntotal))
+                hits.extend((d, i) for d, i in zip(D[0], I[0]) if i >= 0)
+            if len(self.tail):
+                distances = ((self.tail - query_vec) ** 2).sum(axis=1)
+                base = self.index.ntotal
+                hits.extend((d, base + i) for i, d in enumerate(distances))
+            hits.sort(key=lambda h: h[0])
+            ids = [int(i) for _, i in hits[:top_k]]
+            offsets = [self.offsets[i] for i in ids]
+        return self._read_texts(offsets)
+
+    def _read_texts(self, offsets):
+        texts = []
+        with open(self.txt_path, "rb") as f:
+            for offset in offsets:
+                f.seek(offset)
+                (length,) = struct.unpack("<I", f.read(4))
+                texts.append(f.read(length).decode("utf-8"))
+        return texts
+
+    def delete(self):
+        with self.lock, self.file_lock:
+            self._deleted = True
+            _remove_files(self.index_path[:-len(".faiss")])
+
+def _remove_files(base):
+    for suffix in (".vec", ".off", ".txt", ".faiss", ".faiss.pkl"):
+        if os.path.exists(base + suffix):
+            os.remove(base + suffix)
+
+_logs = OrderedDict()
+_logs_lock = threading.Lock()
+
+def get_chat_log(folder, session_id) -> ChatLog:
+    with _logs_lock:
+        log = _logs.get(session_id)
+        if log is not None:
+            _logs.move_to_end(session_id)
+            return log
+        log = ChatLog(folder, session_id)
+        _logs[session_id] = log
+        # Everything is already durable, so dropping a log only costs a reload
+        while len(_logs) > CHAT_LOG_CACHE_SIZE:
+            _logs.popitem(last=False)
+        return log
+
+def delete_chat_log(folder, session_id):
+    with _logs_lock:
+        log = _logs.pop(session_id, None)
+    if log is not None:
+        log.delete()
+    else:
+        base = os.path.join(folder, f"{session_id}_chat")
+        with FileLock(base + ".lock"):
+            _remove_files(base)
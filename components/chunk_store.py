@@ -0,0 +1,293 @@
+# components/chunk_store.py
+import os
+import re
+import mmap
+import numpy as np
+import zstandard
+
+# 0 stores text as-is; chunks are short, so compression mostly pays off for long ones
+CHUNK_STORE_ZSTD_LEVEL = int(os.getenv("CHUNK_STORE_ZSTD_LEVEL", "0"))
+# Rewrite the text blob (into a new generation) on flush once this fraction of it belongs to deleted chunks
+CHUNK_STORE_COMPACT_RATIO = float(os.getenv("CHUNK_STORE_COMPACT_RATIO", "0.5"))
+
+RECORD = np.dtype([("offset", "<u8"), ("length", "<u4"), ("page", "<i4"), ("flags", "<u4"), ("reserved", "<u4")])
+DELETED = 1
+ZSTD = 2
+
+class ChunkStore:
+    """
+    Chunk texts of one index, addressed by vector id.
+
+      <base>.chunks.idx      one RECORD per id: offset and length in the blob, source page, flags
+      <base>.r<N>.chunks.idx the same, rewritten when index version N published deletions
+      <base>.chunks.txt      the texts back to back, memory-mapped for reads
+
+    Ids are positions, so a lookup reads one record and one slice of the blob;
+    nothing else is deserialized. Appends write only the tail of both files.
+    Deletes flip a flag in memory and reach disk as a new copy of the records
+    (publish_records), so a published record file never changes below its
+    published size. The records (24 bytes per chunk) are kept in memory.
+    Supports the dict operations the vector store uses: `id in store`,
+    `store[id]`, len() and iteration over live ids. Callers serialize access
+    (IndexEntry.lock).
+
+    size: read only the first `size` records. Other processes open the files
+    of the published index version this way while its owner appends past it;
+    only the owner writes (see IndexManager).
+    records: which record file to read, as returned by publish_records (0: <base>.chunks.idx).
+    """
+    def __init__(self, base, size=None, records=0):
+        self.base = base
+        self.records = records
+        self.idx_path = self.records_path(base, records)
+        self.txt_path = base + ".chunks.txt"
+        self.pending_deletes = False
+        self._records = np.zeros(0, dtype=RECORD)
+        if os.path.exists(self.idx_path):
+            self._records = np.fromfile(self.idx_path, dtype=RECORD, count=-1 if size is None else size)
+        self._idx = None
+        self._txt = None
+        self._map = None
+        self._compressor = zstandard.ZstdCompressor(level=CHUNK_STORE_ZSTD_LEVEL) if CHUNK_STORE_ZSTD_LEVEL else None
+        self._decompressor = zstandard.ZstdDecompressor()
+        self._recount()
+
+    @classmethod
+    def exists(cls, base) -> bool:
+        return os.path.exists(base + ".chunks.idx")
+
+    @classmethod
+    def records_path(cls, base, records=0) -> str:
+        return base + ".chunks.idx" if not records else f"{base}.r{records}.chunks.idx"
+
+    @classmethod
+    def record_files(cls, base) -> dict:
+        """{records: path} of the record files of base on disk."""
+        folder, name = os.path.split(base)
+        pattern = re.compile(re.escape(name) + r"(?:\.r(\d+))?\.chunks\.idx")
+        found = {}
+        for f in os.listdir(folder or "."):
+            match = pattern.fullmatch(f)
+            if match:
+                found[int(match.group(1) or 0)] = os.path.join(folder, f)
+        return found
+
+    @classmethod
+    def remove_files(cls, base):
+        for path in [*cls.record_files(base).values(), base + ".chunks.txt"]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    @classmethod
+    def from_dict(cls, base, chunks):
+        """Build a store from an {id: text} dict (pickles written by older builds)."""
+        store = cls(base)
+        store.truncate(0)
+        size = max(chunks) + 1 if chunks else 0
+        texts = [chunks.get(i, "") for i in range(size)]
+        store.append(0, texts)
+        # Written with the converted index (publish_records)
+        store.remove_ids([i for i in range(size) if i not in chunks])
+        store.sync()
+        return store
+
+    @classmethod
+    def recover(cls, base):
+        """Finish or roll back an in-place compaction interrupted under older builds (owner only)."""
+        idx_tmp, txt_tmp = base + ".chunks.idx.tmp", base + ".chunks.txt.tmp"
+        if os.path.exists(idx_tmp) and not os.path.exists(txt_tmp):
+            os.replace(idx_tmp, base + ".chunks.idx")
+        for path in (idx_tmp, txt_tmp):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _recount(self):
+        live = (self._records["flags"] & DELETED) == 0
+        self.live = int(live.sum())
+        self.live_bytes = int(self._records["length"][live].sum())
+
+    def _files(self):
+        if self._idx is None:
+            open(self.idx_path, "ab").close()
+            self._idx = open(self.idx_path, "r+b")
+            self._txt = open(self.txt_path, "ab")
+        return self._idx, self._txt
+
+    def _mapped(self, end):
+        if self._map is None or end > len(self._map):
+            # The blob has grown since it was mapped
+            if self._txt is not None:
+                self._txt.flush()
+            if self._map is not None:
+                self._map.close()
+            with open(self.txt_path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    @property
+    def size(self) -> int:
+        """Number of ids ever assigned, including deleted ones."""
+        return len(self._records)
+
+    def __len__(self):
+        return self.live
+
+    def __bool__(self):
+        return self.live > 0
+
+    def __contains__(self, i):
+        return 0 <= i < len(self._records) and not self._records["flags"][i] & DELETED
+
+    def __iter__(self):
+        return iter(np.flatnonzero((self._records["flags"] & DELETED) == 0).tolist())
+
+    def __getitem__(self, i):
+        if i not in self:
+            raise KeyError(i)
+        return self._read(self._records[i])
+
+    def get_many(self, ids) -> list:
+        return [self[i] for i in ids]
+
+    def page(self, i):
+        page = int(self._records["page"][i])
+        return None if page < 0 else page
+
+    def _read(self, record):
+        start, end = int(record["offset"]), int(record["offset"]) + int(record["length"])
+        if end == start:
+            return ""
+        data = self._mapped(end)[start:end]
+        if record["flags"] & ZSTD:
+            data = self._decompressor.decompress(data)
+        return data.decode("utf-8")
+
+    def append(self, start, texts, pages=None):
+        """Store texts under ids start, start+1, ... (start must be the next unused id)."""
+        if start != len(self._records):
+            raise ValueError(f"Chunk ids must be appended in order: expected {len(self._records)}, got {start}")
+        idx, txt = self._files()
+        txt.seek(0, os.SEEK_END)
+        offset = txt.tell()
+        records = np.zeros(len(texts), dtype=RECORD)
+        blobs = []
+        for n, text in enumerate(texts):
+            data = text.encode("utf-8")
+            if self._compressor is not None:
+                packed = self._compressor.compress(data)
+                if len(packed) < len(data):
+                    data = packed
+                    records["flags"][n] = ZSTD
+            records["offset"][n] = offset
+            records["length"][n] = len(data)
+            records["page"][n] = -1 if pages is None or pages[n] is None else pages[n]
+            offset += len(data)
+            blobs.append(data)
+        txt.write(b"".join(blobs))
+        idx.seek(0, os.SEEK_END)
+        idx.write(records.tobytes())
+        self._records = np.concatenate([self._records, records])
+        self.live += len(texts)
+        self.live_bytes += int(records["length"].sum())
+
+    def remove_ids(self, ids):
+        ids = np.asarray([i for i in ids if i in self], dtype="int64")
+        if not len(ids):
+            return
+        self._records["flags"][ids] |= DELETED
+        self.live -= len(ids)
+        self.live_bytes -= int(self._records["length"][ids].sum())
+        # Not written in place: readers loading the published version share the file
+        self.pending_deletes = True
+
+    def remove(self, start, end):
+        self.remove_ids(range(start, min(end, len(self._records))))
+
+    def truncate(self, size):
+        """
+        Drop ids >= size, in memory and on disk: chunks appended after the last
+        published index version by an owner that crashed before flushing.
+        """
+        on_disk = os.path.getsize(self.idx_path) // RECORD.itemsize if os.path.exists(self.idx_path) else 0
+        if size >= max(len(self._records), on_disk):
+            return
+        self.close()
+        if size > len(self._records):
+            self._records = np.fromfile(self.idx_path, dtype=RECORD, count=size)
+        self._records = self._records[:size]
+        # Offsets only grow, so the blob ends where the last kept record ends
+        end = int(self._records["offset"][-1]) + int(self._records["length"][-1]) if size else 0
+        for path, length in ((self.idx_path, size * RECORD.itemsize), (self.txt_path, end)):
+            if os.path.exists(path):
+                with open(path, "r+b") as f:
+                    f.truncate(length)
+        self._recount()
+
+    def sync(self):
+        """Flush appends to disk (called when the owning index is flushed)."""
+        if self._idx is not None:
+            for f in (self._txt, self._idx):
+                f.flush()
+                os.fsync(f.fileno())
+
+    def publish_records(self, records: int) -> int:
+        """
+        Make deletions durable: write all records to a new file for `records`
+        (the index version being published) and append to that from now on.
+        Returns the record file in use, for the manifest; unchanged if nothing
+        was deleted since the last call.
+        """
+        if not self.pending_deletes:
+            return self.records
+        path = self.records_path(self.base, records)
+        with open(path + ".tmp", "wb") as f:
+            f.write(self._records.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self.close()
+        self.idx_path = path
+        self.records = records
+        self.pending_deletes = False
+        return records
+
+    def needs_compaction(self) -> bool:
+        """Deleted texts make up at least CHUNK_STORE_COMPACT_RATIO of the blob."""
+        total = int(self._records["length"].sum())
+        return bool(total) and (total - self.live_bytes) / total >= CHUNK_STORE_COMPACT_RATIO
+
+    def compact_to(self, base):
+        """
+        Copy the live texts into a new store at base, keeping ids, and return it.
+        The files of this store are left untouched for readers still using them.
+        """
+        ChunkStore.remove_files(base)
+        records = self._records.copy()
+        with open(base + ".chunks.txt", "wb") as out:
+            offset = 0
+            for i in range(len(records)):
+                if records["flags"][i] & DELETED:
+                    records["offset"][i], records["length"][i] = offset, 0
+                    continue
+                start = int(self._records["offset"][i])
+                end = start + int(records["length"][i])
+                out.write(self._mapped(end)[start:end])
+                records["offset"][i] = offset
+                offset += int(records["length"][i])
+            out.flush()
+            os.fsync(out.fileno())
+        with open(base + ".chunks.idx", "wb") as out:
+            out.write(records.tobytes())
+            out.flush()
+            os.fsync(out.fileno())
+        self.close()
+        return ChunkStore(base)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._idx is not None:
+            self._idx.close()
+            self._txt.close()
+            self._idx = self._txt = None
@@ -0,0 +1,106 @@
+# components/context_packer.py
+import os
+import logging
+import threading
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# tokenizer.json of the LLM, deployed with it; medllama2 is a Llama 2 model, so
+# Llama 2's tokenizer.json counts the same. Empty to always estimate.
+TOKENIZER_PATH = os.getenv("TOKENIZER_PATH", "models/llama-tokenizer/tokenizer.json")
+# Whole prompt, including what the model generates: the model's context window
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "0")) or int(os.getenv("OLLAMA_NUM_CTX", "0")) or 2048
+RESPONSE_TOKEN_RESERVE = int(os.getenv("RESPONSE_TOKEN_RESERVE", "512"))
+# Upper bound on the context share that goes to chat history; documents get the rest
+CHAT_CONTEXT_SHARE = float(os.getenv("CHAT_CONTEXT_SHARE", "0.25"))
+
+class TokenCounter:
+    """
+    Token counts for the LLM's tokenizer, loaded from a local tokenizer.json
+    on first use; nothing is downloaded. If it cannot be loaded (no file, no
+    tokenizers package) a warning is logged and counts fall back to an
+    estimate of 4 characters per token, which overestimates English text for
+    Llama and so stays within budget.
+    """
+    def __init__(self, path=TOKENIZER_PATH):
+        self.path = path
+        self._tokenizer = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._loaded:
+            return self._tokenizer
+        with self._lock:
+            if not self._loaded:
+                try:
+                    if not self.path:
+                        raise ValueError("TOKENIZER_PATH is not set")
+                    from tokenizers import Tokenizer
+                    self._tokenizer = Tokenizer.from_file(self.path)
+                except Exception as e:
+                    logger.warning("LLM tokenizer %r unavailable, estimating token counts at 4 characters per token: %s",
+                                   self.path, e)
+                self._loaded = True
+        return self._tokenizer
+
+    @property
+    def exact(self) -> bool:
+        return self.load() is not None
+
+    def count(self, text: str) -> int:
+        tokenizer = self.load()
+        if tokenizer is None:
+            return (len(text) + 3) // 4
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def count_many(self, texts: List[str]) -> List[int]:
+        tokenizer = self.load()
+        if tokenizer is None:
+            return [(len(text) + 3) // 4 for text in texts]
+        return [len(e.ids) for e in tokenizer.encode_batch(list(texts), add_special_tokens=False)]
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """The longest prefix of text that is at most max_tokens tokens."""
+        if max_tokens <= 0:
+            return ""
+        tokenizer = self.load()
+        if tokenizer is None:
+            return text[:max_tokens * 4]
+        encoding = tokenizer.encode(text, add_special_tokens=False)
+        if len(encoding.ids) <= max_tokens:
+            return text
+        return text[:encoding.offsets[max_tokens - 1][1]]
+
+_counter = TokenCounter()
+
+def get_token_counter() -> TokenCounter:
+    return _counter
+
+def count_tokens(text: str) -> int:
+    return _counter.count(text)
+
+def pack(texts: List[str], budget: int, counter: TokenCounter = None) -> Tuple[List[str], int]:
+    """
+    Take texts in order (best retrieval score first) while they fit in budget
+    tokens. If not even the first one fits it is truncated, so the best match
+    is never dropped entirely. Returns the packed texts and the tokens used.
+    """
+    counter = counter or _counter
+    packed, used = [], 0
+    # A newline separates the texts in the prompt
+    for text, tokens in zip(texts, counter.count_many(texts)):
+        if used + tokens + 1 > budget:
+            if not packed and budget > 1:
+                text = counter.truncate(text, budget - 1)
+                packed.append(text)
+                used += counter.count(text) + 1
+            break
+        packed.append(text)
+        used += tokens + 1
+    return packed, used
+
+def context_budget(template_tokens: int, budget: int = PROMPT_TOKEN_BUDGET, reserve: int = RESPONSE_TOKEN_RESERVE) -> int:
+    """Tokens left for retrieved context once the fixed part of the prompt and the answer are accounted for."""
+    return max(0, budget - reserve - template_tokens)
@@ -1,16 +1,34 @@
 # components/document_loader.py
 import os
+import asyncio
 import fitz
 import docx
-from typing import List
-from components.llm_ollama import query_ollama  # or your LLM function
+import xxhash
+from typing import Iterable, Iterator, List
+from components.llm_ollama import aquery_ollama  # or your LLM function
+from components.context_packer import get_token_counter
+
+SUMMARY_MAX_IN_FLIGHT = int(os.getenv("SUMMARY_MAX_IN_FLIGHT", "4"))
+# In LLM (Llama) tokens. The embedding model reads at most 256 WordPiece tokens
+# (all-MiniLM-L6-v2, [CLS] and [SEP] included) and ignores the rest. The two
+# tokenizers split differently (Llama breaks numbers into single digits,
+# WordPiece breaks rare medical terms into many pieces), so a chunk's counts
+# differ between them; 200 leaves room for WordPiece to run longer.
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "200"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
 
 def load_pdf(file_path: str) -> str:
-    text = ""
     with fitz.open(file_path) as doc:
-        for page in doc:
-            text += page.get_text()
-    return text
+        return "".join(page.get_text() for page in doc)
+
+def pdf_page_count(file_path: str) -> int:
+    with fitz.open(file_path) as doc:
+        return doc.page_count
+
+def extract_pdf_pages(file_path: str, start: int, end: int) -> List[str]:
+    """Text of pages [start, end). Runs in ingestion worker processes."""
+    with fitz.open(file_path) as doc:
+        return [doc[i].get_text() for i in range(start, min(end, doc.page_count))]
 
 def load_docx(file_path: str) -> str:
     doc = docx.Document(file_path)
@@ -24,37 +42,113 @@ def load_document(file_path: str) -> str:
     else:
         raise ValueError("Unsupported file format. Use PDF or DOCX.")
 
-def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
-    words = text.split()
-    chunks = []
-    start = 0
-    while start < len(words):
-        end = start + chunk_size
-        chunk = " ".join(words[start:end])
-        chunks.append(chunk)
-        start += chunk_size - overlap
-    return chunks
-
-def recursive_summarize(chunks, summarize_func, max_chunks_per_pass=8):
+def chunk_text(text: str, chunk_size: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    return list(iter_chunks([text], chunk_size, overlap))
+
+class TextChunker:
     """
-    Recursively summarize a list of text chunks using the provided summarize_func.
-    summarize_func: function that takes a list of strings and returns a summary string.
-    max_chunks_per_pass: how many chunks to summarize at once (fits LLM context window).
+    Incremental chunk_text: feed() consecutive pieces of one document (e.g. pages)
+    and each chunk is returned as soon as its words have arrived. The output is
+    the same as chunk_text("".join(pieces)) when pieces end on whitespace.
+
+    Chunks are runs of whole words of at most chunk_size LLM tokens (a single
+    longer word becomes its own chunk), and each starts with the last words of
+    the previous one, up to overlap tokens. Words are counted one at a time,
+    which for the Llama tokenizer matches how they are counted in running text.
     """
-    if len(chunks) <= max_chunks_per_pass:
-        return summarize_func(chunks)
-    # Summarize in batches
-    summaries = []
-    for i in range(0, len(chunks), max_chunks_per_pass):
-        batch = chunks[i:i+max_chunks_per_pass]
-        summary = summarize_func(batch)
-        summaries.append(summary)
-    # Recursively summarize the summaries
-    return recursive_summarize(summaries, summarize_func, max_chunks_per_pass)
-
-def summarize_chunks_with_llm(chunks):
+    def __init__(self, chunk_size: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP_TOKENS, counter=None):
+        self.chunk_size = chunk_size
+        self.overlap = min(overlap, chunk_size - 1)
+        self.counter = counter or get_token_counter()
+        self.words = []
+        self.tokens = []  # token count of each word in self.words
+        self.total = 0
+        self.emitted = 0  # leading words already part of a chunk (the overlap)
+
+    def feed(self, text: str) -> List[str]:
+        words = text.split()
+        if words:
+            counts = self.counter.count_many(words)
+            self.words.extend(words)
+            self.tokens.extend(counts)
+            self.total += sum(counts)
+        chunks = []
+        # Only once the words overflow a chunk is it known where the chunk ends
+        while self.total > self.chunk_size:
+            chunks.append(self._take())
+        return chunks
+
+    def finish(self) -> List[str]:
+        chunks = []
+        while self.total > self.chunk_size:
+            chunks.append(self._take())
+        if len(self.words) > self.emitted:
+            chunks.append(" ".join(self.words))
+        self.words, self.tokens, self.total, self.emitted = [], [], 0, 0
+        return chunks
+
+    def _take(self) -> str:
+        end, used = 1, self.tokens[0]
+        while end < len(self.words) and used + self.tokens[end] <= self.chunk_size:
+            used += self.tokens[end]
+            end += 1
+        chunk = " ".join(self.words[:end])
+        # The next chunk starts with the trailing words that fit in overlap
+        start, kept = end, 0
+        while start > 1 and kept + self.tokens[start - 1] <= self.overlap:
+            start -= 1
+            kept += self.tokens[start]
+        self.total -= sum(self.tokens[:start])
+        del self.words[:start]
+        del self.tokens[:start]
+        self.emitted = end - start
+        return chunk
+
+def iter_chunks(texts: Iterable[str], chunk_size: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP_TOKENS) -> Iterator[str]:
+    chunker = TextChunker(chunk_size, overlap)
+    for text in texts:
+        yield from chunker.feed(text)
+    yield from chunker.finish()
+
+def chunks_hash(chunks) -> str:
+    """Content hash of an ordered list of chunks; used as a summary cache key."""
+    h = xxhash.xxh3_128()
+    for chunk in chunks:
+        h.update(chunk.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+async def arecursive_summarize(chunks, summarize_func, max_chunks_per_pass=8, max_in_flight=SUMMARY_MAX_IN_FLIGHT, cache=None,
+                               semaphore=None):
     """
-    Summarize a list of text chunks using your LLM.
+    Recursively summarize a list of text chunks: the batches of each level are
+    summarized concurrently, with at most max_in_flight calls to summarize_func outstanding.
+    summarize_func: async function that takes a list of strings and returns a summary string.
+    max_chunks_per_pass: how many chunks to summarize at once (fits LLM context window).
+    cache: optional dict of chunks_hash(batch) -> summary. Hits skip the LLM and new
+    summaries (intermediate and final) are added to it.
+    semaphore: bounds the calls instead of max_in_flight, shared with whatever
+    else the caller runs on it (e.g. a batch's LLM slots).
     """
-    prompt = "\n\n".join(chunks) + "\n\nSummarize the above medical content in clear, concise bullet points."
-    return query_ollama(prompt)
+    cache = cache if cache is not None else {}
+    semaphore = semaphore or asyncio.Semaphore(max_in_flight)
+
+    async def summarize(batch):
+        key = chunks_hash(batch)
+        if key not in cache:
+            async with semaphore:
+                cache[key] = await summarize_func(batch)
+        return cache[key]
+
+    level = list(chunks)
+    while len(level) > max_chunks_per_pass:
+        batches = [level[i:i+max_chunks_per_pass] for i in range(0, len(level), max_chunks_per_pass)]
+        level = await asyncio.gather(*(summarize(batch) for batch in batches))
+    return await summarize(level)
+
+def _summary_prompt(chunks):
+    return "\n\n".join(chunks) + "\n\nSummarize the above medical content in clear, concise bullet points."
+
+async def asummarize_chunks_with_llm(chunks):
+    """Summarize a list of text chunks using your LLM."""
+    return await aquery_ollama(_summary_prompt(chunks))
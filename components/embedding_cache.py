@@ -0,0 +1,142 @@
+# components/embedding_cache.py
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+import xxhash
+
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", os.path.join("cache", "embeddings.sqlite"))
+EMBED_CACHE_MAX_BYTES = int(os.getenv("EMBED_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+def normalize_text(text: str) -> str:
+    # The MiniLM tokenizer splits on whitespace, so runs of whitespace never change the embedding
+    return " ".join(text.split())
+
+def cache_key(model_name: str, text: str, backend: str = "torch") -> bytes:
+    """
+    backend: what computed the vector ("torch", "onnx", "onnx-int8"). Their
+    vectors differ slightly, so each gets its own entries; torch keys keep the
+    format they had before there was a choice of backend.
+    """
+    model = model_name if backend == "torch" else f"{model_name}\0{backend}"
+    return xxhash.xxh3_128_digest(f"{model}\0{normalize_text(text)}".encode("utf-8"))
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache keyed by (model name and backend, hash of normalized chunk text).
+    Vectors are stored as raw float32 blobs in SQLite; when the cache grows past
+    max_bytes the least recently used rows are evicted. The file is shared by
+    all workers, so its size is kept in the database itself (the meta row
+    "bytes", maintained by triggers) rather than counted per process.
+    """
+    def __init__(self, path=EMBED_CACHE_PATH, max_bytes=EMBED_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = None
+        # Last size read from the database, for stats()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            # Caches written before the meta row existed are measured once
+            conn.execute(
+                "INSERT OR IGNORE INTO meta (name, value) "
+                "SELECT 'bytes', COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS embeddings_insert AFTER INSERT ON embeddings BEGIN "
+                "UPDATE meta SET value = value + LENGTH(NEW.vector) WHERE name = 'bytes'; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS embeddings_delete AFTER DELETE ON embeddings BEGIN "
+                "UPDATE meta SET value = value - LENGTH(OLD.vector) WHERE name = 'bytes'; END"
+            )
+            conn.execute("COMMIT")
+            self._bytes = self._size(conn)
+            self._conn = conn
+        return self._conn
+
+    def _size(self, conn) -> int:
+        return conn.execute("SELECT value FROM meta WHERE name = 'bytes'").fetchone()[0]
+
+    def get_many(self, keys):
+        """Return {key: vector} for the keys that are cached."""
+        if not keys:
+            return {}
+        found = {}
+        with self._lock:
+            conn = self._connect()
+            unique = list(set(keys))
+            # Stay under SQLite's bound-parameter limit
+            for i in range(0, len(unique), 500):
+                batch = unique[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype="float32")
+            if found:
+                now = time.time()
+                conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+            self.hits += sum(1 for k in keys if k in found)
+            self.misses += sum(1 for k in keys if k not in found)
+        return found
+
+    def put_many(self, items):
+        """items: iterable of (key, vector)"""
+        now = time.time()
+        rows = [(key, np.asarray(vector, dtype="float32").tobytes(), now) for key, vector in items]
+        if not rows:
+            return
+        with self._lock:
+            conn = self._connect()
+            # IMMEDIATE: other workers' inserts and evictions wait, so the size read is current
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany("INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows)
+                self._bytes = self._size(conn)
+                if self._bytes > self.max_bytes:
+                    self._evict(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self, conn):
+        # Evict down to 90% of the budget so we do not evict on every insert
+        target = int(self.max_bytes * 0.9)
+        while self._bytes > target:
+            keys = conn.execute("SELECT key FROM embeddings ORDER BY last_used LIMIT 256").fetchall()
+            if not keys:
+                break
+            conn.executemany("DELETE FROM embeddings WHERE key = ?", keys)
+            self._bytes = self._size(conn)
+            self.evictions += len(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
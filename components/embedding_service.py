@@ -0,0 +1,178 @@
+# components/embedding_service.py
+import os
+import threading
+import time
+from concurrent.futures import Future
+from queue import Queue, Empty
+import numpy as np
+from components.embedding_cache import EmbeddingCache, cache_key
+from components.metrics import timer
+
+EMBED_MODEL_NAME = os.getenv("EMBED_MODEL_NAME", "all-MiniLM-L6-v2")
+EMBED_MAX_BATCH_SIZE = int(os.getenv("EMBED_MAX_BATCH_SIZE", "64"))
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "1") == "1"
+# "torch" (SentenceTransformer) or "onnx" (ONNX Runtime, see components/onnx_embedder.py)
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+# onnx backend only: int8 dynamically quantized weights
+EMBED_ONNX_INT8 = os.getenv("EMBED_ONNX_INT8", "1") == "1"
+# Intra-op threads for either backend; 0 keeps the library default
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0"))
+
+class EmbeddingService:
+    """
+    Process-wide SentenceTransformer wrapper.
+    The model is loaded once and small encode requests coming from different
+    threads are coalesced by a background worker into a single forward pass.
+    max_batch_size: upper bound on texts per forward pass.
+    max_wait_ms: how long the worker waits for more requests before encoding.
+    cache: optional EmbeddingCache; only texts missing from it reach the model.
+    backend: "torch" or "onnx"; both give the same vectors within a small
+    tolerance (see benchmarks/embedding_backend_bench.py), so indexes written
+    by one are valid for the other. Cache entries are kept per backend.
+    """
+    def __init__(self, model_name=EMBED_MODEL_NAME, max_batch_size=EMBED_MAX_BATCH_SIZE, max_wait_ms=EMBED_MAX_WAIT_MS, cache=None,
+                 backend=EMBED_BACKEND, int8=EMBED_ONNX_INT8, threads=EMBED_THREADS):
+        if backend not in ("torch", "onnx"):
+            raise ValueError(f"Unknown embedding backend: {backend}")
+        self.model_name = model_name
+        self.backend = backend
+        self.int8 = int8
+        self.threads = threads
+        self.cache = cache
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._queue = Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self._load()
+        return self._model
+
+    def _load(self):
+        if self.backend == "onnx":
+            from components.onnx_embedder import OnnxEmbedder
+            return OnnxEmbedder(self.model_name, quantize=self.int8, threads=self.threads)
+        import torch
+        from sentence_transformers import SentenceTransformer
+        if self.threads > 0:
+            # Process-wide: this also limits any other torch work in the process
+            torch.set_num_threads(self.threads)
+        return SentenceTransformer(self.model_name)
+
+    @property
+    def variant(self) -> str:
+        """Backend and weights the vectors come from: "torch", "onnx" or "onnx-int8"."""
+        if self.backend == "onnx" and self.int8:
+            return "onnx-int8"
+        return self.backend
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def warm_up(self):
+        """Load the model and run one forward pass, so the first request does not pay for either."""
+        self._encode_now(["warm-up"])
+
+    @property
+    def dim(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts) -> np.ndarray:
+        if isinstance(texts, str):
+            texts = [texts]
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.dim), dtype="float32")
+        if self.cache is None:
+            return self._encode_batched(texts)
+
+        keys = [cache_key(self.model_name, text, self.variant) for text in texts]
+        vectors = self.cache.get_many(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in missing:
+                missing[key] = text
+        if missing:
+            fresh = dict(zip(missing, self._encode_batched(list(missing.values()))))
+            self.cache.put_many(fresh.items())
+            vectors.update(fresh)
+        return np.stack([vectors[key] for key in keys]).astype("float32")
+
+    def _encode_batched(self, texts) -> np.ndarray:
+        # Requests that already fill a batch gain nothing from waiting
+        if len(texts) >= self.max_batch_size:
+            return self._encode_now(texts)
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((texts, future))
+        return future.result()
+
+    def _encode_now(self, texts) -> np.ndarray:
+        with timer("embed"):
+            embeddings = self.model.encode(
+                texts, batch_size=self.max_batch_size, convert_to_numpy=True, show_progress_bar=False
+            )
+        return np.asarray(embeddings, dtype="float32")
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        carry = None
+        while True:
+            first = carry if carry is not None else self._queue.get()
+            carry = None
+            pending = [first]
+            size = len(first[0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except Empty:
+                    break
+                if size + len(item[0]) > self.max_batch_size:
+                    carry = item
+                    break
+                pending.append(item)
+                size += len(item[0])
+
+            batch = [text for texts, _ in pending for text in texts]
+            try:
+                embeddings = self._encode_now(batch)
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+
+            start = 0
+            for texts, future in pending:
+                future.set_result(embeddings[start:start + len(texts)])
+                start += len(texts)
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_embedding_service() -> EmbeddingService:
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = EmbeddingService(cache=EmbeddingCache() if EMBED_CACHE_ENABLED else None)
+    return _service
@@ -0,0 +1,15 @@
+# components/executor.py
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+CPU_EXECUTOR_WORKERS = int(os.getenv("CPU_EXECUTOR_WORKERS", str(min(8, os.cpu_count() or 4))))
+
+# Bounded pool for CPU-bound work (embedding, FAISS search, parsing) called from
+# the event loop. numpy, torch and faiss release the GIL, so threads do overlap.
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_EXECUTOR_WORKERS, thread_name_prefix="cpu")
+
+async def run_cpu(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cpu_executor, functools.partial(fn, *args, **kwargs))
@@ -0,0 +1,566 @@
+# components/index_cache.py
+import os
+import json
+import atexit
+import pickle
+import threading
+import time
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+import faiss
+import numpy as np
+from filelock import FileLock
+from components.index_factory import new_index, index_nbytes, load_index, owned_copy
+from components.chunk_store import ChunkStore, RECORD
+
+logger = logging.getLogger(__name__)
+
+INDEX_CACHE_MAX_BYTES = int(os.getenv("INDEX_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+INDEX_FLUSH_INTERVAL = float(os.getenv("INDEX_FLUSH_INTERVAL", "2.0"))
+# How long a write waits for another process to publish and release the index
+INDEX_LOCK_TIMEOUT = float(os.getenv("INDEX_LOCK_TIMEOUT", "60"))
+
+class IndexEntry:
+    """
+    An ID-mapped FAISS index held in memory, with its chunk texts on disk.
+    chunks: ChunkStore, {vector id: chunk text}
+    docs: {document name: [[start, end), ...]} vector ID ranges owned by each document
+    trained_size: number of vectors the index was last built from (see index_factory)
+    content_hash: chunks_hash of all chunks, computed on demand and reset by writes
+    version: published version this entry was loaded from or last written as (0: none)
+    chunk_generation: which generation of chunk files `chunks` lives in
+    mapped: index vectors are memory-mapped from the snapshot (read-only, see load_index)
+    Callers must hold `lock` while reading or mutating index/chunks/docs.
+    """
+    def __init__(self, name, index, chunks, docs=None, next_id=None, trained_size=0, version=0, chunk_generation=0):
+        self.name = name
+        self.index = index
+        self.chunks = chunks
+        self.docs = docs or {}
+        self.next_id = next_id if next_id is not None else chunks.size
+        self.trained_size = trained_size
+        self.version = version
+        self.chunk_generation = chunk_generation
+        self.stamp = None
+        self.mapped = False
+        self.content_hash = None
+        self.lock = threading.RLock()
+        self.dirty = False
+        self.deleted = False
+
+    def nbytes(self) -> int:
+        # Chunk texts are memory-mapped; only their offset records are resident.
+        # So are mapped vectors, which leaves their ids (8 bytes, and 8 more for the reverse map)
+        index = self.index.ntotal * 16 if self.mapped else index_nbytes(self.index)
+        return index + self.chunks.size * RECORD.itemsize
+
+    def untracked(self) -> bool:
+        """True if some chunks predate per-document tracking and belong to no document."""
+        tracked = sum(end - start for ranges in self.docs.values() for start, end in ranges)
+        return tracked < len(self.chunks)
+
+def _to_id_map(index, chunks):
+    # Indexes written before per-document tracking are plain IndexFlatL2 + a list of chunks
+    vectors = index.reconstruct_n(0, index.ntotal) if index.ntotal else np.zeros((0, index.d), dtype="float32")
+    id_map = new_index(index.d)
+    id_map.add_with_ids(vectors, np.arange(len(vectors), dtype="int64"))
+    return id_map, dict(enumerate(chunks))
+
+def _holds_lock_file(lock) -> bool:
+    """False if the file `lock` holds was removed or replaced since it was opened."""
+    fd = getattr(getattr(lock, "_context", None), "lock_file_fd", None)
+    if fd is None:
+        return True
+    try:
+        return os.fstat(fd).st_ino == os.stat(lock.lock_file).st_ino
+    except FileNotFoundError:
+        return False
+
+class IndexManager:
+    """
+    Keeps hot indexes resident, bounded by max_bytes with LRU eviction.
+    Writes only mark an entry dirty; a background thread persists dirty
+    entries every flush_interval seconds, and evicted entries are flushed first.
+
+    The folder can be shared by several processes (uvicorn workers). Per index:
+
+      <name>.manifest.json    the published version: snapshot, chunk generation, documents
+      <name>.v<N>             FAISS snapshot of version N
+      <name>[.g<G>].chunks.*  chunk store generation G (see ChunkStore)
+      <name>[.g<G>].r<N>.chunks.idx  its records as of version N, when N deleted chunks
+      <name>.lock             held by the process that owns the index
+
+    A process owns an index from its first write until the flush that
+    publishes it, so writes from other processes wait and then start from the
+    latest version. A flush writes a new snapshot and then replaces the
+    manifest, so readers load either the old or the new version, never a mix;
+    chunk deletions go to a new record file named in the manifest for the same reason.
+    Other processes stat the manifest on every get() and reload only when it
+    changed. Files of the previous version are kept for readers still loading it.
+    """
+    def __init__(self, folder, max_bytes=INDEX_CACHE_MAX_BYTES, flush_interval=INDEX_FLUSH_INTERVAL):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._dirty = set()
+        self._owned = set()
+        self._unprepared = set()
+        self._file_locks = {}
+        self._owner_locks = {}
+        self._lock = threading.RLock()
+        self._flusher = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flushes = 0
+        self.reloads = 0
+
+    def _paths(self, name):
+        """The index file older builds wrote (version 0) and the chunk pickle of even older ones."""
+        index_path = os.path.join(self.folder, name)
+        return index_path, index_path + ".pkl"
+
+    def _manifest_path(self, name):
+        return os.path.join(self.folder, name) + ".manifest.json"
+
+    def _snapshot_path(self, name, version):
+        index_path = os.path.join(self.folder, name)
+        return index_path if version == 0 else f"{index_path}.v{version}"
+
+    def _chunk_base(self, name, generation):
+        index_path = os.path.join(self.folder, name)
+        return index_path if generation == 0 else f"{index_path}.g{generation}"
+
+    def _stamp(self, name):
+        # The manifest is replaced, never rewritten, so a new version is a new inode
+        try:
+            st = os.stat(self._manifest_path(name))
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _read_manifest(self, name) -> dict:
+        try:
+            with open(self._manifest_path(name)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _on_disk(self, name) -> bool:
+        if os.path.exists(self._manifest_path(name)):
+            return True
+        index_path, pickle_path = self._paths(name)
+        return os.path.exists(index_path) and (ChunkStore.exists(index_path) or os.path.exists(pickle_path))
+
+    def _load(self, name, convert=False):
+        index_path, pickle_path = self._paths(name)
+        for attempt in range(3):
+            stamp = self._stamp(name)
+            manifest = self._read_manifest(name)
+            version = manifest.get("version", 0)
+            try:
+                index, mapped = load_index(self._snapshot_path(name, version))
+                break
+            except RuntimeError:
+                # Collected after two newer versions were published since we read the manifest
+                if attempt == 2 or self._stamp(name) == stamp:
+                    raise
+        generation = manifest.get("chunk_generation", 0)
+        base = self._chunk_base(name, generation)
+        next_id = manifest.get("next_id")
+
+        converted = convert and os.path.exists(pickle_path)
+        if converted:
+            # Move the pickled chunks into a chunk store; the pickle is removed once
+            # the index has been written back in the current format
+            with open(pickle_path, "rb") as f:
+                chunks = pickle.load(f)
+            if isinstance(chunks, list):
+                index, chunks = _to_id_map(index, chunks)
+                mapped = False
+            chunks = ChunkStore.from_dict(base, chunks)
+        else:
+            # An owner may be appending past next_id right now; read only what is published
+            chunks = ChunkStore(base, size=next_id, records=manifest.get("chunk_records", 0))
+        entry = IndexEntry(name, index, chunks, manifest.get("documents"), next_id,
+                           manifest.get("trained_size", index.ntotal), version, generation)
+        entry.stamp = stamp
+        entry.mapped = mapped
+        entry.dirty = converted
+        return entry
+
+    def exists(self, name) -> bool:
+        with self._lock:
+            if name in self._entries:
+                return True
+        return self._on_disk(name)
+
+    def get(self, name):
+        """Return the cached entry for `name`, loading it from disk on a miss. None if it does not exist."""
+        with self._lock:
+            entry = self._entries.get(name)
+            owned = name in self._owned
+        # Another process may have published a newer version; the owner's copy is the newest
+        if entry is not None and (owned or self._stamp(name) == entry.stamp):
+            with self._lock:
+                if self._entries.get(name) is entry:
+                    self._entries.move_to_end(name)
+                    self.hits += 1
+                    return entry
+        elif entry is not None:
+            self._drop_stale(entry)
+        with self._lock:
+            self.misses += 1
+
+        if not self._on_disk(name):
+            return None
+        convert = os.path.exists(self._paths(name)[1])
+        if convert:
+            # Converting a pickle writes files, which only the owner may do
+            self._acquire(name)
+        # Holding the owner lock keeps the flusher from releasing before the converted entry is in
+        with self._owner_lock(name) if convert else nullcontext():
+            entry = self._load(name, convert)
+            with self._lock:
+                # Another thread may have loaded it while we were reading
+                if name in self._entries:
+                    self._entries.move_to_end(name)
+                    return self._entries[name]
+                evicted = self._insert(entry)
+                if entry.dirty:
+                    self._dirty.add(name)
+        self._write_all(evicted)
+        if entry.dirty:
+            self._ensure_flusher()
+        return entry
+
+    def get_or_create(self, name, dim):
+        entry = self.get(name)
+        if entry is not None:
+            return entry
+        with self._lock:
+            if name in self._entries:
+                return self._entries[name]
+            chunks = ChunkStore(self._chunk_base(name, 0))
+            # Left over from an index that was never flushed
+            chunks.truncate(0)
+            entry = IndexEntry(name, new_index(dim), chunks)
+            evicted = self._insert(entry)
+        self._write_all(evicted)
+        return entry
+
+    @contextmanager
+    def writing(self, name, dim=None):
+        """
+        Yield the entry for `name` locked and at its latest version, with this
+        process as its owner; it is marked dirty afterwards. A missing index is
+        created with dimension dim, or None is yielded if dim is not given.
+        If the block raises, see _undo; either way the index is not left owned.
+        """
+        rolled_back = None
+        try:
+            while True:
+                self._acquire(name)
+                entry = self.get(name) if dim is None else self.get_or_create(name, dim)
+                if entry is None:
+                    self._release(name)
+                    yield None
+                    return
+                with entry.lock:
+                    with self._lock:
+                        # The flusher may have published and released it since _acquire
+                        current = name in self._owned and self._entries.get(name) is entry and not entry.deleted
+                    if current:
+                        if name in self._unprepared:
+                            self._prepare(entry)
+                            self._unprepared.discard(name)
+                        if entry.mapped:
+                            entry.index = owned_copy(entry.index)
+                            entry.mapped = False
+                        was_dirty = entry.dirty
+                        try:
+                            yield entry
+                        except BaseException:
+                            rolled_back = self._undo(entry, was_dirty)
+                            raise
+                        entry.dirty = True
+                        break
+        finally:
+            # Outside entry.lock: both take the owner lock first
+            if rolled_back:
+                self._release(name)
+            elif rolled_back is not None:
+                self.mark_dirty(entry)
+        self.mark_dirty(entry)
+
+    def _undo(self, entry, was_dirty) -> bool:
+        """
+        Clean up after a write that raised. Without earlier unpublished writes
+        the entry is dropped, so the next get() reloads the published version,
+        and True is returned. Otherwise it is kept for those writes and only
+        chunks appended past next_id are cut off; the vector store's writes
+        leave index and document ranges untouched when they fail.
+        """
+        if was_dirty:
+            entry.chunks.truncate(entry.next_id)
+            return False
+        with self._lock:
+            if self._entries.get(entry.name) is entry:
+                del self._entries[entry.name]
+                self._sizes.pop(entry.name, None)
+            self._dirty.discard(entry.name)
+        entry.dirty = False
+        entry.chunks.close()
+        return True
+
+    def mark_dirty(self, entry):
+        """Schedule a flush of an entry writing() has modified (and set dirty)."""
+        with self._lock:
+            if self._entries.get(entry.name) is not entry:
+                # Evicted while the caller was writing to it; persist right away
+                evicted = [entry]
+            else:
+                self._dirty.add(entry.name)
+                self._sizes[entry.name] = entry.nbytes()
+                evicted = self._evict()
+        self._write_all(evicted)
+        self._ensure_flusher()
+
+    def discard(self, name):
+        """Drop an entry without persisting it (the index is being deleted)."""
+        with self._lock:
+            entry = self._entries.pop(name, None)
+            self._sizes.pop(name, None)
+            self._dirty.discard(name)
+        if entry is not None:
+            with entry.lock:
+                entry.deleted = True
+                entry.dirty = False
+                entry.chunks.close()
+
+    def delete(self, name):
+        """Delete an index and all of its files, in every process."""
+        self._acquire(name)
+        try:
+            self.discard(name)
+            # Without the manifest the index is gone for everyone; the rest is cleanup
+            prefix = name + "."
+            doomed = [self._manifest_path(name)] + [
+                os.path.join(self.folder, f) for f in os.listdir(self.folder)
+                if f == name or (f.startswith(prefix) and not f.endswith(".lock") and f != name + ".manifest.json")
+            ]
+            for path in doomed:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            # Still held: a process waiting on it finds it unlinked and retries (_acquire)
+            try:
+                os.remove(self._file_locks[name].lock_file)
+            except OSError:
+                pass
+        finally:
+            self._release(name)
+
+    def flush(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            self._dirty.discard(name)
+        if entry is not None:
+            self._write(entry)
+
+    def flush_all(self):
+        with self._lock:
+            names = list(self._dirty)
+        for name in names:
+            self.flush(name)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "flushes": self.flushes,
+                "reloads": self.reloads,
+                "entries": len(self._entries),
+                "dirty": len(self._dirty),
+                "owned": len(self._owned),
+                "bytes": sum(self._sizes.values()),
+                "max_bytes": self.max_bytes,
+            }
+
+    def _owner_lock(self, name):
+        with self._lock:
+            if name not in self._owner_locks:
+                self._owner_locks[name] = threading.Lock()
+                # Acquired by a request thread, released by whichever thread publishes
+                self._file_locks[name] = FileLock(os.path.join(self.folder, name + ".lock"), thread_local=False)
+            return self._owner_locks[name]
+
+    def _acquire(self, name):
+        """Become the owner of `name`, waiting for another process to publish and release it."""
+        with self._owner_lock(name):
+            if name in self._owned:
+                return
+            os.makedirs(self.folder, exist_ok=True)
+            lock = self._file_locks[name]
+            deadline = time.monotonic() + INDEX_LOCK_TIMEOUT
+            lock.acquire(timeout=INDEX_LOCK_TIMEOUT)
+            # delete() removes the lock file while holding it; whoever was waiting
+            # on the removed file must lock the new one instead
+            while not _holds_lock_file(lock):
+                lock.release()
+                lock.acquire(timeout=max(0.0, deadline - time.monotonic()))
+            with self._lock:
+                self._owned.add(name)
+                self._unprepared.add(name)
+                entry = self._entries.get(name)
+            # Published by another process while we were not the owner
+            if entry is not None and entry.stamp != self._stamp(name):
+                self._drop_stale(entry)
+
+    def _prepare(self, entry):
+        # First write since becoming the owner: drop chunks a previous owner appended
+        # but died before publishing, so appends line up with next_id again
+        ChunkStore.recover(entry.chunks.base)
+        entry.chunks.truncate(entry.next_id)
+
+    def _release(self, name):
+        """Give up ownership of `name` if nothing is left to publish."""
+        with self._owner_lock(name):
+            with self._lock:
+                entry = self._entries.get(name)
+            if entry is None:
+                self._release_locked(name, None)
+                return
+            with entry.lock:
+                self._release_locked(name, entry)
+
+    def _release_locked(self, name, entry):
+        # Caller holds the owner lock and entry.lock, so no write can slip in
+        with self._lock:
+            if name not in self._owned or (entry is not None and entry.dirty):
+                return
+            self._owned.discard(name)
+        self._file_locks[name].release()
+
+    def _drop_stale(self, entry):
+        with self._lock:
+            if self._entries.get(entry.name) is entry:
+                del self._entries[entry.name]
+                self._sizes.pop(entry.name, None)
+                self.reloads += 1
+        with entry.lock:
+            entry.chunks.close()
+
+    def _insert(self, entry):
+        self._entries[entry.name] = entry
+        self._sizes[entry.name] = entry.nbytes()
+        return self._evict()
+
+    def _evict(self):
+        # Always keep the most recently used entry, even if it alone exceeds the budget.
+        # Evicted dirty entries are returned so they are written outside self._lock.
+        evicted = []
+        while len(self._entries) > 1 and sum(self._sizes.values()) > self.max_bytes:
+            name, entry = self._entries.popitem(last=False)
+            self._sizes.pop(name, None)
+            self._dirty.discard(name)
+            self.evictions += 1
+            evicted.append(entry)
+        return evicted
+
+    def _write_all(self, entries):
+        # Evicted entries: persist, then release their chunk files (reopened on demand)
+        for entry in entries:
+            self._write(entry)
+            with entry.lock:
+                entry.chunks.close()
+
+    def _write(self, entry):
+        name = entry.name
+        with self._owner_lock(name), entry.lock:
+            if not entry.deleted and entry.dirty:
+                self._publish(entry)
+            # Hand the index over after every publish, so a busy writer cannot
+            # keep other processes waiting; it re-acquires on its next write
+            self._release_locked(name, entry)
+
+    def _publish(self, entry):
+        name = entry.name
+        os.makedirs(self.folder, exist_ok=True)
+        # Chunks are appended as they arrive; make them durable before the
+        # index that refers to them
+        entry.chunks.sync()
+        previous = (entry.chunk_generation, entry.chunks.records)
+        if entry.chunks.needs_compaction():
+            entry.chunk_generation += 1
+            entry.chunks = entry.chunks.compact_to(self._chunk_base(name, entry.chunk_generation))
+        version = entry.version + 1
+        # Deletions go to a copy of the records: readers of the current version share the file
+        entry.chunks.publish_records(version)
+        snapshot = self._snapshot_path(name, version)
+        faiss.write_index(entry.index, snapshot + ".tmp")
+        os.replace(snapshot + ".tmp", snapshot)
+        manifest_path = self._manifest_path(name)
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump({
+                "version": version,
+                "chunk_generation": entry.chunk_generation,
+                "chunk_records": entry.chunks.records,
+                "next_id": entry.next_id,
+                "documents": entry.docs,
+                "trained_size": entry.trained_size,
+            }, f)
+        # Publishing point: from here on other processes load this version
+        os.replace(manifest_path + ".tmp", manifest_path)
+        entry.version = version
+        entry.stamp = self._stamp(name)
+        entry.dirty = False
+        self._collect(entry, previous)
+        with self._lock:
+            self.flushes += 1
+
+    def _collect(self, entry, previous):
+        # Readers may still be loading the previous version; anything older is unused
+        old_snapshot = entry.version - 2
+        old_generation = entry.chunk_generation - 2
+        paths = [self._paths(entry.name)[1]]
+        if old_snapshot >= 0:
+            paths.append(self._snapshot_path(entry.name, old_snapshot))
+        in_use = {(entry.chunk_generation, entry.chunks.records), previous}
+        for generation in {generation for generation, _ in in_use}:
+            files = ChunkStore.record_files(self._chunk_base(entry.name, generation))
+            paths += [path for records, path in files.items() if (generation, records) not in in_use]
+        if old_generation >= 0:
+            base = self._chunk_base(entry.name, old_generation)
+            paths += [*ChunkStore.record_files(base).values(), base + ".chunks.txt"]
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                # e.g. still open in another process on Windows; collected again next time
+                logger.debug("Could not remove %s: %s", path, e)
+
+    def _ensure_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name="index-flusher", daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush_all)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush_all()
+            except Exception:
+                logger.exception("Background index flush failed")
@@ -0,0 +1,227 @@
+# components/index_factory.py
+import os
+import math
+import faiss
+import numpy as np
+
+ANN_MEMORY_BUDGET = int(os.getenv("ANN_MEMORY_BUDGET", str(256 * 1024 * 1024)))
+ANN_FLAT_MAX = int(os.getenv("ANN_FLAT_MAX", "20000"))
+ANN_HNSW_M = int(os.getenv("ANN_HNSW_M", "32"))
+ANN_HNSW_EF_SEARCH = int(os.getenv("ANN_HNSW_EF_SEARCH", "64"))
+ANN_IVF_NPROBE = int(os.getenv("ANN_IVF_NPROBE", "16"))
+ANN_PQ_DIMS_PER_CODE = int(os.getenv("ANN_PQ_DIMS_PER_CODE", "8"))
+# An IVF index is retrained once it holds this many times the vectors it was trained on
+ANN_RETRAIN_GROWTH = float(os.getenv("ANN_RETRAIN_GROWTH", "4"))
+# An HNSW index is rebuilt once this fraction of its vectors are deleted
+ANN_MAX_TOMBSTONES = float(os.getenv("ANN_MAX_TOMBSTONES", "0.25"))
+# How flat indexes (most session indexes) store their vectors; see flat_storage
+ANN_FLAT_CODEC = os.getenv("ANN_FLAT_CODEC", "float32")
+# A pq index carries its own codebooks (256 centroids per code byte), which only
+# pay off for larger indexes; below this many vectors pq stores fp16 instead
+ANN_PQ_MIN_TRAIN = int(os.getenv("ANN_PQ_MIN_TRAIN", "4096"))
+# Map flat codes from the index file instead of reading them into memory, so
+# processes share them through the page cache; see load_index
+INDEX_MMAP = os.getenv("INDEX_MMAP", "0") == "1"
+
+FLAT, HNSW, IVFPQ = "flat", "hnsw", "ivfpq"
+_RANK = {FLAT: 0, HNSW: 1, IVFPQ: 2}
+FLOAT32, FP16, INT8, PQ = "float32", "fp16", "int8", "pq"
+# Vectors needed to train each trained codec; per-dimension int8 ranges from
+# fewer would clip much of what is added later
+_MIN_TRAIN = {INT8: 64, PQ: ANN_PQ_MIN_TRAIN}
+
+def _unwrap(index):
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+def index_kind(index) -> str:
+    inner = _unwrap(index)
+    if isinstance(inner, faiss.IndexHNSW):
+        return HNSW
+    if isinstance(inner, faiss.IndexIVF):
+        return IVFPQ
+    return FLAT
+
+def _pq_subquantizers(dim) -> int:
+    # Largest divisor of dim giving at least ANN_PQ_DIMS_PER_CODE dimensions per code byte
+    for m in range(max(1, dim // ANN_PQ_DIMS_PER_CODE), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+def _nlist(n) -> int:
+    return int(min(65536, max(16, 4 * math.sqrt(n))))
+
+def target_codec(n, codec=ANN_FLAT_CODEC) -> str:
+    """The codec a flat index of n vectors is built with."""
+    if codec not in (FLOAT32, FP16, INT8, PQ):
+        raise ValueError(f"Unknown flat index codec: {codec}")
+    if n < _MIN_TRAIN.get(codec, 0):
+        return FP16
+    return codec
+
+def flat_codec(index) -> str:
+    """How a flat index stores its vectors."""
+    inner = _unwrap(index)
+    if isinstance(inner, faiss.IndexScalarQuantizer):
+        return FP16 if inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else INT8
+    if isinstance(inner, faiss.IndexPQ):
+        return PQ
+    return FLOAT32
+
+def flat_storage(dim, train_vectors=None, codec=ANN_FLAT_CODEC):
+    """
+    Exact-search storage for flat indexes, in the given codec:
+      float32  IndexFlatL2, 4 bytes per dimension
+      fp16     half floats, 2 bytes per dimension; indistinguishable for retrieval
+      int8     1 byte per dimension, over each dimension's range in train_vectors
+      pq       product quantization, one byte per ANN_PQ_DIMS_PER_CODE dimensions
+    int8 and pq are trained on train_vectors and stored as fp16 while there are
+    too few of them; needs_rebuild retrains them as the index grows.
+    """
+    codec = target_codec(len(train_vectors) if train_vectors is not None else 0, codec)
+    if codec == FP16:
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    if codec == INT8:
+        storage = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+        # Some headroom for vectors added before the next retrain
+        storage.sq.rangestat_arg = 0.1
+        storage.train(np.ascontiguousarray(train_vectors, dtype="float32"))
+        return storage
+    if codec == PQ:
+        storage = faiss.IndexPQ(dim, _pq_subquantizers(dim), 8, faiss.METRIC_L2)
+        sample = train_vectors
+        if len(sample) > 256 * 64:
+            sample = sample[np.random.default_rng(0).choice(len(sample), 256 * 64, replace=False)]
+        storage.train(np.ascontiguousarray(sample, dtype="float32"))
+        return storage
+    return faiss.IndexFlatL2(dim)
+
+def bytes_per_vector(kind, dim, n=0) -> int:
+    """Approximate resident bytes per vector, including the 8-byte id; n matters for flat pq."""
+    if kind == FLAT:
+        codec = target_codec(n)
+        code = {FLOAT32: dim * 4, FP16: dim * 2, INT8: dim}.get(codec) or _pq_subquantizers(dim)
+        return code + 16
+    if kind == HNSW:
+        # Level-0 links are 2*M ints; upper levels add about 10% on top
+        return dim * 4 + int(ANN_HNSW_M * 2 * 4 * 1.1) + 16
+    return _pq_subquantizers(dim) + 8 + 16
+
+def index_nbytes(index) -> int:
+    inner = _unwrap(index)
+    if index_kind(index) == FLAT and isinstance(inner, faiss.IndexFlatCodes):
+        return index.ntotal * (inner.code_size + 16)
+    return index.ntotal * bytes_per_vector(index_kind(index), index.d)
+
+def load_index(path, mmap=INDEX_MMAP):
+    """
+    Read an index file; with mmap the vectors of flat indexes (and HNSW's
+    storage) stay in the file and are paged in on demand. Returns (index,
+    mapped). A mapped index must not be modified: faiss aborts the process
+    on add or remove, so take an owned_copy first.
+    """
+    if mmap:
+        return configure(faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC)), True
+    return configure(faiss.read_index(path)), False
+
+def owned_copy(index):
+    """An in-memory copy of a mapped index, which can be modified."""
+    return configure(faiss.deserialize_index(faiss.serialize_index(index)))
+
+def choose_index_kind(n, dim, max_bytes=ANN_MEMORY_BUDGET) -> str:
+    """
+    Exact search while it is cheap, HNSW while the full vectors fit the memory
+    budget, IVF-PQ (compressed codes) beyond that.
+    """
+    if n <= ANN_FLAT_MAX and n * bytes_per_vector(FLAT, dim, n) <= max_bytes:
+        return FLAT
+    if n * bytes_per_vector(HNSW, dim) <= max_bytes:
+        return HNSW
+    # IVF-PQ training needs a few dozen points per list and 256 per PQ centroid set
+    if n < 39 * _nlist(n) or n < 256:
+        return HNSW
+    return IVFPQ
+
+def configure(index):
+    """Apply search-time parameters, which are not all persisted by write_index."""
+    kind = index_kind(index)
+    inner = _unwrap(index)
+    if kind == HNSW:
+        inner.hnsw.efSearch = ANN_HNSW_EF_SEARCH
+    elif kind == IVFPQ:
+        inner.nprobe = ANN_IVF_NPROBE
+    return index
+
+def new_index(dim, kind=FLAT, train_vectors=None):
+    """
+    An empty index of the given kind that accepts add_with_ids and remove_ids
+    (HNSW cannot remove; see is_tombstoning). IVF-PQ needs train_vectors.
+    """
+    if kind == FLAT:
+        return faiss.IndexIDMap2(flat_storage(dim, train_vectors))
+    if kind == HNSW:
+        return configure(faiss.IndexIDMap2(faiss.IndexHNSWFlat(dim, ANN_HNSW_M)))
+    nlist = _nlist(len(train_vectors))
+    index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, nlist, _pq_subquantizers(dim), 8)
+    # Training on a sample is as good as on everything past ~256 points per list
+    sample = train_vectors
+    if len(sample) > 256 * nlist:
+        sample = sample[np.random.default_rng(0).choice(len(sample), 256 * nlist, replace=False)]
+    index.train(np.ascontiguousarray(sample, dtype="float32"))
+    # A hashtable direct map keeps reconstruct() working across remove_ids
+    index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    return configure(index)
+
+def build_index(vectors, ids, max_bytes=ANN_MEMORY_BUDGET, kind=None):
+    """Build the index kind suited to len(vectors) and fill it."""
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    kind = kind or choose_index_kind(len(vectors), vectors.shape[1], max_bytes)
+    index = new_index(vectors.shape[1], kind, train_vectors=vectors)
+    if len(vectors):
+        index.add_with_ids(vectors, np.asarray(ids, dtype="int64"))
+    return index
+
+def is_tombstoning(index) -> bool:
+    """True if removed vectors stay in the index and must be filtered out of results."""
+    return index_kind(index) == HNSW
+
+def remove_range(index, start, end):
+    if is_tombstoning(index):
+        return
+    if index_kind(index) == IVFPQ:
+        # The hashtable direct map only supports removal by explicit id list
+        ids = np.arange(start, end, dtype="int64")
+        index.remove_ids(faiss.IDSelectorArray(len(ids), faiss.swig_ptr(ids)))
+    else:
+        index.remove_ids(faiss.IDSelectorRange(start, end))
+
+def reconstruct(index, ids):
+    """Stored vectors for ids (exact for flat and HNSW, PQ-decoded for IVF-PQ)."""
+    ids = np.asarray(ids, dtype="int64")
+    if not len(ids):
+        return np.zeros((0, index.d), dtype="float32")
+    return index.reconstruct_batch(ids)
+
+def needs_rebuild(index, live, trained_size, max_bytes=ANN_MEMORY_BUDGET) -> bool:
+    """
+    live: vectors that are not deleted; trained_size: vectors the index was built from.
+    Rebuild when growth calls for a bigger kind, an IVF index has outgrown its
+    training, an HNSW index is mostly tombstones, or a flat index is not in
+    ANN_FLAT_CODEC (older indexes are converted on their next write).
+    """
+    kind = index_kind(index)
+    if _RANK[choose_index_kind(live, index.d, max_bytes)] > _RANK[kind]:
+        return True
+    if kind == FLAT:
+        codec = flat_codec(index)
+        # Trained codecs stay when an index shrinks below their minimum, and are retrained as it grows
+        if codec in _MIN_TRAIN:
+            return ANN_FLAT_CODEC != codec or live > ANN_RETRAIN_GROWTH * max(trained_size, 1)
+        return codec != target_codec(live)
+    if kind == IVFPQ and live > ANN_RETRAIN_GROWTH * max(trained_size, 1):
+        return True
+    if kind == HNSW and index.ntotal and (index.ntotal - live) / index.ntotal > ANN_MAX_TOMBSTONES:
+        return True
+    return False
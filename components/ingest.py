@@ -0,0 +1,221 @@
+# components/ingest.py
+import os
+import time
+import uuid
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import UploadFile
+from components.document_loader import TextChunker, load_docx, pdf_page_count, extract_pdf_pages
+from components.vector_store import append_document_chunks, rename_document, remove_document, embed_chunks, staging_name
+from components.memory_store import aadd_session_document, asave_job, aget_job
+from components.executor import run_cpu
+
+logger = logging.getLogger(__name__)
+
+INGEST_UPLOAD_CHUNK_BYTES = int(os.getenv("INGEST_UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+INGEST_PROCESSES = int(os.getenv("INGEST_PROCESSES", str(max(1, (os.cpu_count() or 2) // 2))))
+INGEST_PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", "16"))
+INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "64"))
+INGEST_MAX_JOBS = int(os.getenv("INGEST_MAX_JOBS", "2"))
+# Progress is written to Redis at most this often (plus on every state change)
+INGEST_PROGRESS_INTERVAL = float(os.getenv("INGEST_PROGRESS_INTERVAL", "1"))
+
+# save_upload's temporary files: <prefix><random>.<final file name>
+UPLOAD_PREFIX = ".upload."
+
+# Running jobs' tasks; their state lives in Redis so any worker can answer GET /jobs
+_tasks = set()
+_job_slots = None
+_process_pool = None
+
+def _get_process_pool():
+    global _process_pool
+    if _process_pool is None:
+        # spawn: the server process has threads, which fork does not handle safely
+        _process_pool = ProcessPoolExecutor(max_workers=INGEST_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+    return _process_pool
+
+async def save_upload(file: UploadFile, path: str) -> str:
+    """
+    Stream an upload to disk in fixed-size chunks instead of reading it into
+    memory. It is written to a temporary file next to path, whose name is
+    returned; the ingest job moves it to path once the document is indexed,
+    so a failed re-upload leaves the previous file in place.
+    """
+    folder, name = os.path.split(path)
+    upload = os.path.join(folder, f"{UPLOAD_PREFIX}{uuid.uuid4().hex}.{name}")
+    try:
+        with open(upload, "wb") as f:
+            while True:
+                data = await file.read(INGEST_UPLOAD_CHUNK_BYTES)
+                if not data:
+                    break
+                f.write(data)
+    except BaseException:
+        if os.path.exists(upload):
+            os.remove(upload)
+        raise
+    return upload
+
+def discard_uploads(path: str):
+    """
+    Remove uploads to path still being ingested. Their jobs then fail instead
+    of putting the document back after it was deleted.
+    """
+    folder, name = os.path.split(path)
+    for f in os.listdir(folder or "."):
+        if f.startswith(UPLOAD_PREFIX) and f.split(".", 3)[-1] == name:
+            try:
+                os.remove(os.path.join(folder, f))
+            except FileNotFoundError:
+                pass
+
+async def get_job(job_id: str):
+    return await aget_job(job_id)
+
+async def start_ingest(upload: str, path: str, session_id: str, filename: str) -> dict:
+    """Index the file save_upload wrote to upload in the background; it becomes path when done."""
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "session_id": session_id,
+        "filename": filename,
+        "state": "queued",
+        "pages_total": None,
+        "pages_done": 0,
+        "chunks_done": 0,
+        "error": None,
+        "created": time.time(),
+        "started": None,
+        "finished": None,
+        # Seconds spent per stage; "extract" also covers chunking and waiting on pages
+        "timings": {"extract": 0.0, "embed": 0.0, "index": 0.0},
+    }
+    try:
+        await asave_job(job)
+    except Exception:
+        os.remove(upload)
+        raise
+    task = asyncio.create_task(_run(job, upload, path))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return job
+
+async def _publish(job, force=True):
+    """Write the job's state to Redis; progress updates are throttled unless force."""
+    now = time.monotonic()
+    if not force and now - job.get("_published", 0) < INGEST_PROGRESS_INTERVAL:
+        return
+    job["_published"] = now
+    try:
+        await asave_job({k: v for k, v in job.items() if not k.startswith("_")})
+    except Exception:
+        # Only the status shown to pollers is lost; the ingest itself goes on
+        logger.warning("Could not save ingest job %s", job["job_id"], exc_info=True)
+
+async def _iter_pages(job, path):
+    """Yield page texts in order; PDF page ranges are extracted in parallel worker processes."""
+    if path.endswith(".docx"):
+        job["pages_total"] = 1
+        yield await run_cpu(load_docx, path)
+        job["pages_done"] = 1
+        return
+
+    loop = asyncio.get_running_loop()
+    pages = await run_cpu(pdf_page_count, path)
+    job["pages_total"] = pages
+    ranges = [(start, start + INGEST_PAGES_PER_TASK) for start in range(0, pages, INGEST_PAGES_PER_TASK)]
+    if len(ranges) <= 1:
+        futures = [run_cpu(extract_pdf_pages, path, start, end) for start, end in ranges]
+    else:
+        pool = _get_process_pool()
+        futures = [loop.run_in_executor(pool, extract_pdf_pages, path, start, end) for start, end in ranges]
+    # Submit everything up front, consume in page order
+    futures = [asyncio.ensure_future(f) for f in futures]
+    try:
+        for future in futures:
+            for text in await future:
+                job["pages_done"] += 1
+                yield text
+    finally:
+        for future in futures:
+            future.cancel()
+
+async def _run(job, upload, path):
+    global _job_slots
+    if _job_slots is None:
+        _job_slots = asyncio.Semaphore(INGEST_MAX_JOBS)
+
+    session_id, filename = job["session_id"], job["filename"]
+    index_name = f"{session_id}.faiss"
+    # New vectors are staged under a temporary name, hidden from searches, and
+    # swapped in when complete, so a re-upload replaces the old version in one step
+    staging = staging_name(filename, job["job_id"])
+    async with _job_slots:
+        job["started"] = time.time()
+        try:
+            job["state"] = "extracting"
+            await _publish(job)
+            chunker = TextChunker()
+            chars = 0
+            batch, pages = [], []
+            page = None
+
+            async def flush(chunks, chunk_pages):
+                job["state"] = "embedding"
+                start = time.perf_counter()
+                embeddings = await run_cpu(embed_chunks, chunks)
+                embedded = time.perf_counter()
+                await run_cpu(append_document_chunks, staging, embeddings, chunks, index_name, chunk_pages)
+                job["timings"]["embed"] += embedded - start
+                job["timings"]["index"] += time.perf_counter() - embedded
+                job["chunks_done"] += len(chunks)
+                await _publish(job, force=False)
+
+            # Pages feed the chunker as they arrive; the chunker feeds fixed-size embedding batches
+            async for text in _iter_pages(job, upload):
+                chars += len(text.strip())
+                # Each chunk is tagged with the (1-based) PDF page on which it ends
+                page = None if upload.endswith(".docx") else (page or 0) + 1
+                chunks = chunker.feed(text)
+                batch.extend(chunks)
+                pages.extend([page] * len(chunks))
+                while len(batch) >= INGEST_EMBED_BATCH:
+                    await flush(batch[:INGEST_EMBED_BATCH], pages[:INGEST_EMBED_BATCH])
+                    batch, pages = batch[INGEST_EMBED_BATCH:], pages[INGEST_EMBED_BATCH:]
+            chunks = chunker.finish()
+            batch.extend(chunks)
+            pages.extend([page] * len(chunks))
+            if chars < 50:
+                raise ValueError("Document is too short to process.")
+            if batch:
+                await flush(batch, pages)
+
+            if not job["chunks_done"]:
+                raise ValueError("Failed to split document into chunks.")
+
+            # Only now does the new file replace a previous upload of the same name.
+            # Deleting the document removes the upload (discard_uploads) and the
+            # staged vectors (remove_document), so a delete made meanwhile, before
+            # or after this point, makes one of these two steps fail.
+            try:
+                os.replace(upload, path)
+            except FileNotFoundError:
+                raise ValueError("Document was deleted while it was being indexed.")
+            if not await run_cpu(rename_document, staging, filename, index_name):
+                raise ValueError("Document was deleted while it was being indexed.")
+            await aadd_session_document(session_id, filename)
+            job["state"] = "done"
+        except Exception as e:
+            logger.exception("Ingest job %s failed", job["job_id"])
+            job["state"] = "failed"
+            job["error"] = str(e)
+            await run_cpu(remove_document, staging, index_name)
+            if os.path.exists(upload):
+                os.remove(upload)
+        finally:
+            job["finished"] = time.time()
+            timings = job["timings"]
+            timings["extract"] = max(0.0, job["finished"] - job["started"] - timings["embed"] - timings["index"])
+            await _publish(job)
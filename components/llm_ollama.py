@@ -1,34 +1,127 @@
 # components/llm_ollama.py
-import requests
-
-def query_ollama(prompt: str, model="medllama2"):
-    url = "http://localhost:11434/api/chat"
-    payload = {
-        "model": model,
-        "messages": [
-            {"role": "user", "content": prompt}
-        ],
-        "stream": False
-    }
-
-    print("[Query Ollama] Debugging information:", payload)
-
-    try:
-        response = requests.post(url, json=payload)
-        data = response.json()
-
-        print("\n==== RAW RESPONSE FROM OLLAMA ====")
-        print(data)
-
-        content = data.get("message", {}).get("content", "").strip()
-
-        if content:
-            return content
-        elif data.get("done_reason") == "load":
-            return "[Model is now loaded, please ask your question again.]"
-        else:
-            return "[No valid response from model. Try rephrasing your question.]"
-
-    except Exception as e:
-        print("[query_ollama] Exception:", e)
-        return "Sorry, something went wrong while processing your request."
+import os
+import json
+import asyncio
+import time
+import logging
+import weakref
+import httpx
+from components.metrics import observe, PROMPT_TOKENS
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "medllama2")
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "300"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "16"))
+OLLAMA_RETRIES = int(os.getenv("OLLAMA_RETRIES", "2"))
+# Context window to request from Ollama; 0 keeps the model's default
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "0"))
+
+MODEL_LOADED_MESSAGE = "[Model is now loaded, please ask your question again.]"
+NO_RESPONSE_MESSAGE = "[No valid response from model. Try rephrasing your question.]"
+ERROR_MESSAGE = "Sorry, something went wrong while processing your request."
+
+class OllamaError(Exception):
+    pass
+
+class OllamaClient:
+    """
+    Async client for Ollama's /api/chat with pooled keep-alive connections,
+    timeouts and retries. Responses are consumed as streaming NDJSON.
+    One httpx pool is kept per event loop, since httpx clients are loop-bound.
+    """
+    def __init__(self, base_url=OLLAMA_URL, model=OLLAMA_MODEL, timeout=OLLAMA_TIMEOUT,
+                 connect_timeout=OLLAMA_CONNECT_TIMEOUT, max_connections=OLLAMA_MAX_CONNECTIONS, retries=OLLAMA_RETRIES):
+        self.base_url = base_url
+        self.model = model
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.retries = retries
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=self.limits)
+            self._clients[loop] = client
+        return client
+
+    async def ping(self) -> bool:
+        """True if the Ollama server answers; used by /readyz."""
+        try:
+            response = await self._client().get("/api/tags", timeout=self.timeout.connect)
+            return response.status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    async def stream_chat(self, prompt: str, model=None, usage: dict = None):
+        """
+        Yield response tokens as Ollama generates them.
+        usage: optional dict that receives Ollama's measured prompt_tokens and completion_tokens.
+        """
+        payload = {
+            "model": model or self.model,
+            "messages": [
+                {"role": "user", "content": prompt}
+            ],
+            "stream": True
+        }
+        if OLLAMA_NUM_CTX:
+            payload["options"] = {"num_ctx": OLLAMA_NUM_CTX}
+        logger.debug("Ollama request: %s", payload)
+
+        start = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            emitted = False
+            try:
+                async with self._client().stream("POST", "/api/chat", json=payload) as response:
+                    if response.status_code >= 500:
+                        await response.aread()
+                        raise OllamaError(f"Ollama returned HTTP {response.status_code}")
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line.strip():
+                            continue
+                        data = json.loads(line)
+                        if data.get("error"):
+                            raise OllamaError(data["error"])
+                        token = data.get("message", {}).get("content", "")
+                        if token:
+                            if not emitted:
+                                observe("ollama_first_token", time.perf_counter() - start)
+                            emitted = True
+                            yield token
+                        if data.get("done"):
+                            observe("ollama", time.perf_counter() - start)
+                            if "prompt_eval_count" in data:
+                                PROMPT_TOKENS.observe(data["prompt_eval_count"])
+                            if usage is not None:
+                                usage["prompt_tokens"] = data.get("prompt_eval_count")
+                                usage["completion_tokens"] = data.get("eval_count")
+                            if not emitted and data.get("done_reason") == "load":
+                                yield MODEL_LOADED_MESSAGE
+                            return
+                return
+            except (httpx.TransportError, OllamaError) as e:
+                # Tokens already handed to the caller cannot be taken back, so only retry clean failures
+                if emitted or attempt == self.retries:
+                    raise
+                logger.warning("Ollama attempt %d failed, retrying: %s", attempt + 1, e)
+                await asyncio.sleep(0.5 * 2 ** attempt)
+
+    async def chat(self, prompt: str, model=None, usage: dict = None) -> str:
+        try:
+            parts = [token async for token in self.stream_chat(prompt, model, usage)]
+        except Exception:
+            logger.exception("Ollama request failed")
+            return ERROR_MESSAGE
+        content = "".join(parts).strip()
+        return content if content else NO_RESPONSE_MESSAGE
+
+ollama_client = OllamaClient()
+
+async def aquery_ollama(prompt: str, model=None, usage: dict = None) -> str:
+    return await ollama_client.chat(prompt, model, usage)
@@ -1,33 +1,55 @@
 # components/memory_store.py
-from redis import Redis
+from redis import Redis, BlockingConnectionPool, WatchError
+from redis.asyncio import Redis as AsyncRedis, BlockingConnectionPool as AsyncBlockingConnectionPool
 import json
+import time
 from datetime import datetime
-from components.vector_store import delete_faiss_index
+from components.vector_store import delete_faiss_index, save_chat_message_embedding
+from components.executor import run_cpu
+from components.metrics import timer
 import os
 
 UPLOAD_FOLDER = "uploads"  # Set this to your actual uploads directory
 
-redis = Redis(host="localhost", port=6379, decode_responses=True)
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "32"))
+# How long a finished or abandoned ingest job can still be polled
+INGEST_JOB_TTL = int(os.getenv("INGEST_JOB_TTL", str(24 * 3600)))
+
+# Bounded pools: callers wait for a free connection instead of opening one per request
+redis = Redis(connection_pool=BlockingConnectionPool.from_url(
+    REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS, decode_responses=True))
+# Used from the event loop by the async request path
+aredis = AsyncRedis(connection_pool=AsyncBlockingConnectionPool.from_url(
+    REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS, decode_responses=True))
+
+# Session layout:
+#   session_meta:{id}      hash  created, preview and the scalar memory fields
+#   session_messages:{id}  list  one JSON message per entry, appended per turn
+#   session_docs:{id}      set   uploaded document names
+#   sessions:index         zset  session ids scored by last activity, for /chats
+#   ingest_job:{job_id}    JSON  upload progress, shared by every worker (expires)
+# Sessions written before this layout are a JSON blob at session:{id}; they are
+# converted the first time they are read or listed.
+SESSION_INDEX_KEY = "sessions:index"
+SESSIONS_MIGRATED_KEY = "sessions:migrated"
+# Stored JSON-encoded in the meta hash; everything else there is a plain string
+JSON_FIELDS = ("symptoms", "duration", "triggers", "uploaded_files")
 
 def get_session_key(session_id: str) -> str:
+    """Legacy JSON blob key."""
     return f"session:{session_id}"
 
-def get_memory(session_id: str):
-    key = get_session_key(session_id)
-    data = redis.get(key)
-    if data:
-        memory = json.loads(data)
-        # Ensure required keys exist
-        memory.setdefault("session_id", session_id)
-        memory.setdefault("created", str(datetime.now()))
-        memory.setdefault("symptoms", [])
-        memory.setdefault("duration", None)
-        memory.setdefault("triggers", None)
-        memory.setdefault("messages", [])
-        memory.setdefault("uploaded_files", [])
-        return memory
+def get_session_meta_key(session_id: str) -> str:
+    return f"session_meta:{session_id}"
 
-    # Do not create/save a new session unless a real message is added
+def get_messages_key(session_id: str) -> str:
+    return f"session_messages:{session_id}"
+
+def get_documents_key(session_id: str) -> str:
+    return f"session_docs:{session_id}"
+
+def _new_memory(session_id: str) -> dict:
     return {
         "session_id": session_id,
         "created": str(datetime.now()),
@@ -35,46 +57,294 @@ def get_memory(session_id: str):
         "duration": None,
         "triggers": None,
         "messages": [],
-        "uploaded_files": []
+        "uploaded_files": [],
+        "documents": [],
     }
 
-def save_memory(session_id: str, memory: dict):
-    key = get_session_key(session_id)
-    # Only save if there is at least one real message
-    if memory.get("messages"):
-        redis.set(key, json.dumps(memory))
+def _parse_legacy(session_id: str, data: str) -> dict:
+    memory = _new_memory(session_id)
+    memory.update(json.loads(data))
+    return memory
+
+def _parse_memory(session_id: str, meta: dict, messages, documents) -> dict:
+    # Do not create/save a new session unless a real message is added
+    memory = _new_memory(session_id)
+    for field, value in meta.items():
+        if field in JSON_FIELDS:
+            memory[field] = json.loads(value)
+        elif field in ("session_id", "created"):
+            memory[field] = value
+    if messages is None:
+        memory.pop("messages")
     else:
-        # If no messages, ensure session is not saved
-        redis.delete(key)
+        memory["messages"] = [json.loads(m) for m in messages]
+    memory["documents"] = sorted(documents)
+    return memory
 
-def list_sessions():
-    keys = redis.keys("session:*")
-    sessions = []
-    for key in sorted(keys):
-        session = json.loads(redis.get(key))
-        # Only include sessions with at least one real message
-        if session.get("messages"):
-            preview = "No messages"
-            for msg in session["messages"]:
-                if msg["role"] == "user":
-                    preview = msg["text"]
-                    break
-            sessions.append({
-                "session_id": session["session_id"],
-                "created": session.get("created"),
-                "preview": preview
-            })
-    return sessions
+def _first_user_text(messages) -> str:
+    for msg in messages:
+        if msg["role"] == "user":
+            return msg["text"]
+    return None
 
-def delete_session(session_id: str):
+def _queue_save(pipe, session_id: str, memory: dict, score: float):
+    """Queue a full rewrite of a session in the structured layout."""
+    meta_key, messages_key, docs_key = get_session_meta_key(session_id), get_messages_key(session_id), get_documents_key(session_id)
+    pipe.delete(meta_key, messages_key, docs_key)
+    if memory.get("documents"):
+        pipe.sadd(docs_key, *memory["documents"])
+    # Only save the conversation if there is at least one real message
+    if not memory.get("messages"):
+        pipe.zrem(SESSION_INDEX_KEY, session_id)
+        return
+    meta = {"session_id": session_id, "created": memory.get("created") or str(datetime.now())}
+    meta.update({field: json.dumps(memory.get(field)) for field in JSON_FIELDS})
+    preview = _first_user_text(memory["messages"])
+    if preview is not None:
+        meta["preview"] = preview
+    pipe.hset(meta_key, mapping=meta)
+    pipe.rpush(messages_key, *[json.dumps(m) for m in memory["messages"]])
+    pipe.zadd(SESSION_INDEX_KEY, {session_id: score}, nx=True)
+
+def _legacy_score(memory: dict) -> float:
+    try:
+        return datetime.fromisoformat(memory.get("created", "")).timestamp()
+    except ValueError:
+        return 0
+
+def _migrate(session_id: str):
+    """Convert one legacy JSON session to the structured layout. Returns the memory, or None."""
     key = get_session_key(session_id)
-    redis.delete(key)
+    with redis.pipeline() as pipe:
+        try:
+            pipe.watch(key)
+            data = pipe.get(key)
+            if data is None:
+                return None
+            memory = _parse_legacy(session_id, data)
+            pipe.multi()
+            _queue_save(pipe, session_id, memory, score=_legacy_score(memory))
+            pipe.delete(key)
+            pipe.execute()
+        except WatchError:
+            # Another reader migrated it first
+            return None
+    return memory
+
+async def _amigrate(session_id: str):
+    key = get_session_key(session_id)
+    async with aredis.pipeline() as pipe:
+        try:
+            await pipe.watch(key)
+            data = await pipe.get(key)
+            if data is None:
+                return None
+            memory = _parse_legacy(session_id, data)
+            pipe.multi()
+            _queue_save(pipe, session_id, memory, score=_legacy_score(memory))
+            pipe.delete(key)
+            await pipe.execute()
+        except WatchError:
+            return None
+    return memory
+
+def _ensure_migrated(session_id: str):
+    if redis.exists(get_session_key(session_id)):
+        _migrate(session_id)
+
+async def _aensure_migrated(session_id: str):
+    if await aredis.exists(get_session_key(session_id)):
+        await _amigrate(session_id)
+
+def _queue_read(pipe, session_id: str, messages: bool):
+    pipe.hgetall(get_session_meta_key(session_id))
+    if messages:
+        pipe.lrange(get_messages_key(session_id), 0, -1)
+    pipe.smembers(get_documents_key(session_id))
+    pipe.exists(get_session_key(session_id))
+
+def _read_result(session_id: str, results: list, messages: bool) -> dict:
+    meta, *rest = results
+    msgs = rest.pop(0) if messages else None
+    documents, _legacy = rest
+    return _parse_memory(session_id, meta, msgs, documents)
+
+def get_memory(session_id: str, messages: bool = True):
+    """
+    The session as a dict. With messages=False the conversation is not fetched
+    and the dict has no "messages" key.
+    """
+    pipe = redis.pipeline(transaction=False)
+    _queue_read(pipe, session_id, messages)
+    with timer("redis_get_memory"):
+        results = pipe.execute()
+    if results[-1]:
+        memory = _migrate(session_id)
+        if memory is not None:
+            return memory if messages else {k: v for k, v in memory.items() if k != "messages"}
+        return get_memory(session_id, messages)
+    return _read_result(session_id, results, messages)
+
+async def aget_memory(session_id: str, messages: bool = True):
+    pipe = aredis.pipeline(transaction=False)
+    _queue_read(pipe, session_id, messages)
+    with timer("redis_get_memory"):
+        results = await pipe.execute()
+    if results[-1]:
+        memory = await _amigrate(session_id)
+        if memory is not None:
+            return memory if messages else {k: v for k, v in memory.items() if k != "messages"}
+        return await aget_memory(session_id, messages)
+    return _read_result(session_id, results, messages)
+
+async def aappend_messages(session_id: str, messages: list):
+    """Append messages to a session; O(len(messages)) regardless of conversation length."""
+    await _aensure_migrated(session_id)
+    meta_key = get_session_meta_key(session_id)
+    pipe = aredis.pipeline()
+    pipe.rpush(get_messages_key(session_id), *[json.dumps(m) for m in messages])
+    pipe.hsetnx(meta_key, "session_id", session_id)
+    pipe.hsetnx(meta_key, "created", str(datetime.now()))
+    preview = _first_user_text(messages)
+    if preview is not None:
+        # Only the session's first user message becomes its preview
+        pipe.hsetnx(meta_key, "preview", preview)
+    pipe.zadd(SESSION_INDEX_KEY, {session_id: time.time()})
+    with timer("redis_append_messages"):
+        await pipe.execute()
+
+async def arecord_turn(session_id: str, question: str, response: str):
+    """Append a question and its answer to the conversation and to the session's chat memory."""
+    await aappend_messages(session_id, [{"role": "user", "text": question}, {"role": "bot", "text": response}])
+    # Searched by later questions' retrieve_chat
+    await run_cpu(save_chat_message_embedding, session_id, question)
+    await run_cpu(save_chat_message_embedding, session_id, response)
+
+def get_messages(session_id: str, start: int = 0, end: int = -1) -> list:
+    """Messages start..end inclusive; negative indexes count from the newest."""
+    _ensure_migrated(session_id)
+    return [json.loads(m) for m in redis.lrange(get_messages_key(session_id), start, end)]
+
+def get_session_documents(session_id: str) -> list:
+    _ensure_migrated(session_id)
+    return sorted(redis.smembers(get_documents_key(session_id)))
+
+async def aadd_session_document(session_id: str, filename: str):
+    await _aensure_migrated(session_id)
+    await aredis.sadd(get_documents_key(session_id), filename)
+
+def remove_session_document(session_id: str, filename: str):
+    _ensure_migrated(session_id)
+    redis.srem(get_documents_key(session_id), filename)
+
+def get_summary_key(session_id: str) -> str:
+    return f"summaries:{session_id}"
+
+async def aget_summary_cache(session_id: str, docset_hash: str) -> dict:
+    """
+    Cached document summaries for a session, as {chunks_hash: summary}.
+    The cache belongs to one document set; if the session's documents have
+    changed since it was written it is dropped.
+    """
+    key = get_summary_key(session_id)
+    cache = await aredis.hgetall(key)
+    if cache.pop("docset", None) != docset_hash:
+        await aredis.delete(key)
+        return {}
+    return cache
+
+async def asave_summary_cache(session_id: str, docset_hash: str, cache: dict):
+    key = get_summary_key(session_id)
+    await aredis.hset(key, mapping={**cache, "docset": docset_hash})
+
+def get_job_key(job_id: str) -> str:
+    return f"ingest_job:{job_id}"
+
+async def asave_job(job: dict):
+    await aredis.set(get_job_key(job["job_id"]), json.dumps(job), ex=INGEST_JOB_TTL)
+
+async def aget_job(job_id: str):
+    data = await aredis.get(get_job_key(job_id))
+    return json.loads(data) if data else None
+
+def migrate_sessions():
+    """Convert every legacy JSON session to the structured layout (run once, from list_sessions)."""
+    for key in redis.scan_iter(match="session:*", count=500):
+        _migrate(key[len("session:"):])
+    redis.set(SESSIONS_MIGRATED_KEY, 1)
+
+def _page_after(score: float, member: str, limit: int) -> list:
+    """
+    Up to limit entries of the session index that come after (score, member) in
+    its newest-first order: lower scores, or an equal score and a member that
+    sorts lower (Redis orders ties by member).
+    """
+    pipe = redis.pipeline()
+    pipe.zscore(SESSION_INDEX_KEY, member)
+    pipe.zrevrank(SESSION_INDEX_KEY, member)
+    current, rank = pipe.execute()
+    if current == score:
+        return redis.zrevrange(SESSION_INDEX_KEY, rank + 1, rank + limit, withscores=True)
+    # The cursor's session has since moved or gone: skip the ties up to where it was
+    page, start = [], 0
+    while len(page) < limit:
+        rows = redis.zrevrangebyscore(SESSION_INDEX_KEY, score, "-inf", start=start, num=limit, withscores=True)
+        if not rows:
+            break
+        start += len(rows)
+        page.extend((m, s) for m, s in rows if s < score or m < member)
+    return page[:limit]
+
+def list_sessions(cursor: str = None, limit: int = 50):
+    """
+    Sessions with at least one message, most recently active first.
+    cursor: the `next_cursor` returned by the previous page (None for the first page).
+    Returns {"sessions": [...], "next_cursor": str or None}.
+    """
+    if not redis.exists(SESSIONS_MIGRATED_KEY):
+        migrate_sessions()
+
+    with timer("redis_list_sessions"):
+        if cursor is None:
+            page = redis.zrevrange(SESSION_INDEX_KEY, 0, limit, withscores=True)
+        else:
+            # "<score>:<session id>": sessions can share a score (e.g. migrated ones without a date)
+            score, _, member = cursor.partition(":")
+            page = _page_after(float(score), member, limit + 1)
+        has_more = len(page) > limit
+        page = page[:limit]
+
+        # All of the page's metadata in one pipelined round trip
+        pipe = redis.pipeline()
+        for session_id, _ in page:
+            pipe.hmget(get_session_meta_key(session_id), "created", "preview")
+        rows = pipe.execute() if page else []
+
+    sessions = []
+    for (session_id, score), (created, preview) in zip(page, rows):
+        sessions.append({
+            "session_id": session_id,
+            "created": created,
+            "preview": preview or "No messages",
+            "updated": score,
+        })
+    return {"sessions": sessions, "next_cursor": f"{page[-1][1]!r}:{page[-1][0]}" if has_more and page else None}
 
 def delete_session(session_id: str):
-    redis.delete(get_session_key(session_id))
+    pipe = redis.pipeline()
+    pipe.delete(
+        get_session_key(session_id), get_session_meta_key(session_id), get_messages_key(session_id),
+        get_documents_key(session_id), get_summary_key(session_id),
+    )
+    pipe.zrem(SESSION_INDEX_KEY, session_id)
+    pipe.execute()
+    # Delete uploaded files, including uploads still being ingested (".upload.<id>.<session>_<name>",
+    # see ingest.save_upload) first, so that their jobs fail rather than recreate the index
+    for f in os.listdir(UPLOAD_FOLDER):
+        if f.startswith(session_id + "_") or (f.startswith(".upload.") and f.split(".", 3)[-1].startswith(session_id + "_")):
+            try:
+                os.remove(os.path.join(UPLOAD_FOLDER, f))
+            except FileNotFoundError:
+                pass
     # Delete FAISS
     delete_faiss_index(f"{session_id}.faiss")
-    # Delete uploaded files
-    for f in os.listdir(UPLOAD_FOLDER):
-        if f.startswith(session_id + "_"):
-            os.remove(os.path.join(UPLOAD_FOLDER, f))
@@ -0,0 +1,68 @@
+# components/metrics.py
+import time
+import logging
+from contextlib import contextmanager
+from prometheus_client import Gauge, Histogram, CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+GRAPH_NODE_SECONDS = Histogram(
+    "graph_node_seconds", "Time spent in each LangGraph node", ["node"], buckets=_BUCKETS)
+STAGE_SECONDS = Histogram(
+    "stage_seconds", "Time spent in a backend operation (embedding, FAISS, Redis, Ollama, Whisper)",
+    ["stage"], buckets=_BUCKETS)
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "HTTP request latency by route", ["method", "route", "status"], buckets=_BUCKETS)
+PROMPT_TOKENS = Histogram(
+    "prompt_tokens", "Prompt tokens evaluated by Ollama per request",
+    buckets=(128, 256, 512, 1024, 1536, 2048, 3072, 4096, 8192))
+STARTUP_SECONDS = Gauge("startup_seconds", "Time to import or warm up each component", ["component"])
+
+@contextmanager
+def timer(stage: str):
+    """Observe the duration of the block in stage_seconds{stage=...}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+def observe(stage: str, seconds: float):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+# stats() keys that only ever grow are exported as counters, everything else as gauges
+_COUNTER_KEYS = {"hits", "misses", "evictions", "flushes", "processed", "dropped", "rejected"}
+
+class StatsCollector:
+    """Exports the components' stats() dicts (caches, ASR pool) at scrape time."""
+    def __init__(self):
+        self._sources = {}
+
+    def register(self, prefix: str, stats):
+        self._sources[prefix] = stats
+
+    def collect(self):
+        for prefix, stats in list(self._sources.items()):
+            try:
+                values = stats() or {}
+            except Exception:
+                logger.exception("Collecting %s stats failed", prefix)
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{prefix}_{key}"
+                if key in _COUNTER_KEYS:
+                    yield CounterMetricFamily(name, f"{prefix} {key}", value=value)
+                else:
+                    yield GaugeMetricFamily(name, f"{prefix} {key}", value=value)
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+def render():
+    """(body, content type) for the /metrics endpoint."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
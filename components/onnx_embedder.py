@@ -0,0 +1,161 @@
+# components/onnx_embedder.py
+import os
+import json
+import logging
+import numpy as np
+from filelock import FileLock
+
+logger = logging.getLogger(__name__)
+
+# Exported models live in EMBED_ONNX_DIR/<model name>/, one export per model
+EMBED_ONNX_DIR = os.getenv("EMBED_ONNX_DIR", "models/onnx")
+MODEL_FILE = "model.onnx"
+INT8_MODEL_FILE = "model_int8.onnx"
+CONFIG_FILE = "embedder.json"
+
+def export_dir(model_name: str, folder: str = EMBED_ONNX_DIR) -> str:
+    return os.path.join(folder, model_name.replace("/", "__"))
+
+def export_model(model_name: str, out_dir: str, quantize: bool = True):
+    """
+    Export a SentenceTransformer's transformer to out_dir/model.onnx, and with
+    quantize an int8 dynamically quantized copy next to it. The tokenizer and
+    what is needed to reproduce the pooling (mode, normalization, max length)
+    are saved alongside. Needs torch and sentence_transformers; loading the
+    export afterwards only needs onnxruntime and tokenizers.
+    Files are written under per-process temporary names and renamed into place;
+    OnnxEmbedder also holds a file lock so that only one worker exports.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    st = SentenceTransformer(model_name, device="cpu")
+    transformer = st[0]
+    pooling = next((m for m in st if isinstance(m, Pooling)), None)
+    if pooling is None or not (pooling.pooling_mode_mean_tokens or pooling.pooling_mode_cls_token):
+        raise ValueError(f"{model_name}: only mean or CLS pooling can be exported")
+
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = transformer.tokenizer
+    tokenizer.save_pretrained(out_dir)
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids).last_hidden_state
+
+    sample = tokenizer(["warm-up"], return_tensors="pt", return_token_type_ids=True)
+    names = ["input_ids", "attention_mask", "token_type_ids"]
+    model_path = os.path.join(out_dir, MODEL_FILE)
+    tmp = f".{os.getpid()}.tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            LastHiddenState(transformer.auto_model.eval()),
+            tuple(sample[name] for name in names),
+            model_path + tmp,
+            input_names=names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in names}, "last_hidden_state": {0: "batch", 1: "sequence"}},
+            opset_version=17,
+            dynamo=False,
+        )
+    os.replace(model_path + tmp, model_path)
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        int8_path = os.path.join(out_dir, INT8_MODEL_FILE)
+        quantize_dynamic(model_path, int8_path + tmp, weight_type=QuantType.QInt8)
+        os.replace(int8_path + tmp, int8_path)
+
+    # Written last: its presence marks a complete export
+    config_path = os.path.join(out_dir, CONFIG_FILE)
+    with open(config_path + tmp, "w") as f:
+        json.dump({
+            "model_name": model_name,
+            "dim": st.get_sentence_embedding_dimension(),
+            "max_seq_length": st.max_seq_length,
+            "pooling": "mean" if pooling.pooling_mode_mean_tokens else "cls",
+            "normalize": any(isinstance(m, Normalize) for m in st),
+            "pad_token_id": tokenizer.pad_token_id or 0,
+        }, f)
+    os.replace(config_path + tmp, config_path)
+    logger.info("Exported %s to %s", model_name, out_dir)
+
+class OnnxEmbedder:
+    """
+    SentenceTransformer stand-in running the exported model on ONNX Runtime.
+    Exports on first use if EMBED_ONNX_DIR has no export of the model yet.
+    Texts are sorted by token count and each batch is padded only to its own
+    longest text, so short queries do not pay for a long document chunk.
+    quantize: use the int8 copy of the weights (dynamic quantization).
+    threads: ONNX Runtime intra-op threads; 0 leaves the choice to it.
+    """
+    def __init__(self, model_name, quantize=True, threads=0, folder=EMBED_ONNX_DIR):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_name = model_name
+        self.quantize = quantize
+        path = export_dir(model_name, folder)
+        model_file = os.path.join(path, INT8_MODEL_FILE if quantize else MODEL_FILE)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Workers starting together: the first exports, the others wait and load its files
+        with FileLock(path + ".lock"):
+            if not os.path.exists(os.path.join(path, CONFIG_FILE)) or not os.path.exists(model_file):
+                export_model(model_name, path, quantize=quantize)
+        with open(os.path.join(path, CONFIG_FILE)) as f:
+            self.config = json.load(f)
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(path, "tokenizer.json"))
+        self.tokenizer.no_padding()
+        self.tokenizer.enable_truncation(self.config["max_seq_length"])
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = max(0, int(threads))
+        # Requests are already parallel across the executor's threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+        self._inputs = {i.name for i in self.session.get_inputs()}
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dim"]
+
+    def encode(self, texts, batch_size=32, **_) -> np.ndarray:
+        """Same output as SentenceTransformer.encode(texts, convert_to_numpy=True) for this model."""
+        if isinstance(texts, str):
+            texts = [texts]
+        encodings = self.tokenizer.encode_batch(list(texts))
+        out = np.zeros((len(encodings), self.config["dim"]), dtype="float32")
+        order = sorted(range(len(encodings)), key=lambda i: len(encodings[i].ids))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            out[batch] = self._forward([encodings[i] for i in batch])
+        return out
+
+    def _forward(self, encodings) -> np.ndarray:
+        length = max(len(e.ids) for e in encodings)
+        shape = (len(encodings), length)
+        input_ids = np.full(shape, self.config["pad_token_id"], dtype="int64")
+        attention_mask = np.zeros(shape, dtype="int64")
+        token_type_ids = np.zeros(shape, dtype="int64")
+        for row, e in enumerate(encodings):
+            n = len(e.ids)
+            input_ids[row, :n] = e.ids
+            attention_mask[row, :n] = 1
+            token_type_ids[row, :n] = e.type_ids
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask, "token_type_ids": token_type_ids}
+        hidden = self.session.run(None, {k: v for k, v in feeds.items() if k in self._inputs})[0]
+
+        if self.config["pooling"] == "cls":
+            pooled = hidden[:, 0]
+        else:
+            mask = attention_mask[..., None].astype("float32")
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config["normalize"]:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype("float32")
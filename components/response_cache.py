@@ -0,0 +1,118 @@
+# components/response_cache.py
+import os
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from components.vector_store import embed_chunks, document_set_hash
+from components.llm_ollama import ERROR_MESSAGE, NO_RESPONSE_MESSAGE, MODEL_LOADED_MESSAGE
+from components.executor import run_cpu
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0") == "1"
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.95"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+
+class ResponseCache:
+    """
+    LLM responses keyed by (bucket, question embedding).
+
+    A lookup matches a cached question in the same bucket whose embedding
+    has cosine similarity >= threshold with the new question. Buckets are
+    per session and document set (see _key): answers draw on the session's
+    own chat history, so they are never served to another session.
+    Entries expire after ttl seconds; beyond max_entries the least recently
+    used entry is dropped.
+    """
+    def __init__(self, threshold=RESPONSE_CACHE_THRESHOLD, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # id -> (docset, vector, response, created)
+        self._by_docset = {}           # docset -> {id: vector}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype="float32").reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, docset, vector):
+        vector = self._normalize(vector)
+        now = time.monotonic()
+        with self._lock:
+            candidates = self._by_docset.get(docset, {})
+            for entry_id in [i for i in candidates if now - self._entries[i][3] > self.ttl]:
+                self._remove(entry_id)
+            best, best_score = None, self.threshold
+            for entry_id, cached in candidates.items():
+                score = float(cached @ vector)
+                if score >= best_score:
+                    best, best_score = entry_id, score
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best)
+            return self._entries[best][2]
+
+    def put(self, docset, vector, response):
+        if response in (ERROR_MESSAGE, NO_RESPONSE_MESSAGE, MODEL_LOADED_MESSAGE):
+            return
+        vector = self._normalize(vector)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (docset, vector, response, time.monotonic())
+            self._by_docset.setdefault(docset, {})[entry_id] = vector
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, entry_id):
+        docset = self._entries.pop(entry_id)[0]
+        bucket = self._by_docset[docset]
+        del bucket[entry_id]
+        if not bucket:
+            del self._by_docset[docset]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": RESPONSE_CACHE_ENABLED,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "document_sets": len(self._by_docset),
+            }
+
+response_cache = ResponseCache()
+
+def _key(question, session_id, vector=None):
+    if vector is None:
+        vector = embed_chunks([question])[0]
+    # Any upload or delete changes the document set hash and so starts a fresh bucket
+    return (session_id, document_set_hash(f"{session_id}.faiss")), vector
+
+async def alookup(question, session_id, vector=None):
+    """
+    Returns (key, cached response or None). key is None when the cache is
+    disabled; pass it to store() along with the generated response.
+    vector: the question's embedding, if the caller already has it.
+    """
+    if not RESPONSE_CACHE_ENABLED:
+        return None, None
+    key = await run_cpu(_key, question, session_id, vector)
+    return key, response_cache.get(*key)
+
+def store(key, response):
+    if key is not None:
+        response_cache.put(*key, response)
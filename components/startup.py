@@ -0,0 +1,96 @@
+# components/startup.py
+import os
+import time
+import asyncio
+import logging
+import threading
+from components.metrics import STARTUP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# 0 skips the background warm-up: models then load on first use and /readyz ignores them
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "1") == "1"
+READYZ_TIMEOUT = float(os.getenv("READYZ_TIMEOUT", "2"))
+
+# app.py imports this module before anything heavy, so this is close to process start
+PROCESS_START = time.time()
+
+class Warmup:
+    """
+    Loads the heavy components (embedding model, Whisper) in a background
+    thread after the server has bound its port, and records how long each
+    step took. Steps run one after another so they do not compete for CPU
+    with each other; a failed step is logged and reported, the rest still run.
+    """
+    def __init__(self):
+        self._steps = []
+        self._timings = {}
+        self._status = {}
+        self._errors = {}
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def add(self, name, fn):
+        self._steps.append((name, fn))
+        self._status[name] = "pending"
+
+    def record(self, name, seconds):
+        """Record a startup phase that happened outside the warm-up (e.g. imports)."""
+        with self._lock:
+            self._timings[name] = round(seconds, 3)
+        STARTUP_SECONDS.labels(name).set(seconds)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        for name, fn in self._steps:
+            self._status[name] = "loading"
+            start = time.perf_counter()
+            try:
+                fn()
+            except Exception as e:
+                logger.exception("Warm-up of %s failed", name)
+                self._status[name] = "failed"
+                self._errors[name] = str(e)
+                continue
+            seconds = time.perf_counter() - start
+            self.record(name, seconds)
+            self._status[name] = "ready"
+            logger.info("%s ready in %.1fs", name, seconds)
+
+    @property
+    def ready(self) -> bool:
+        return all(status == "ready" for status in self._status.values())
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "uptime_s": round(time.time() - PROCESS_START, 3),
+                "components": dict(self._status),
+                "timings_s": dict(self._timings),
+                "errors": dict(self._errors),
+            }
+
+warmup = Warmup()
+
+async def _redis_ok() -> bool:
+    from components.memory_store import aredis
+    try:
+        return bool(await asyncio.wait_for(aredis.ping(), READYZ_TIMEOUT))
+    except Exception:
+        return False
+
+async def _ollama_ok() -> bool:
+    from components.llm_ollama import ollama_client
+    try:
+        return await asyncio.wait_for(ollama_client.ping(), READYZ_TIMEOUT)
+    except asyncio.TimeoutError:
+        return False
+
+async def readiness() -> dict:
+    """Per-check readiness: warmed-up models (unless warm-up is off), Redis and Ollama reachable."""
+    redis_ok, ollama_ok = await asyncio.gather(_redis_ok(), _ollama_ok())
+    return {"models": warmup.ready or not STARTUP_WARMUP, "redis": redis_ok, "ollama": ollama_ok}
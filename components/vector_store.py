@@ -1,126 +1,225 @@
 # components/vector_store.py
-import faiss
 import os
-import pickle
+import logging
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from components.embedding_service import get_embedding_service
+from components.index_cache import IndexManager
+from components.index_factory import build_index, needs_rebuild, reconstruct, remove_range, is_tombstoning
+from components.chat_log import get_chat_log, delete_chat_log
+from components.document_loader import chunks_hash
+from components.metrics import timer
+
+logger = logging.getLogger(__name__)
 
 INDEX_FOLDER = "vector_store"
 os.makedirs(INDEX_FOLDER, exist_ok=True)
 
-def save_faiss_index(new_embeddings, new_chunks, index_name="default.faiss"):
-    index_path = os.path.join(INDEX_FOLDER, index_name)
-    chunks_path = index_path + ".pkl"
-
-    dim = len(new_embeddings[0])
-    if os.path.exists(index_path) and os.path.exists(chunks_path):
-        # Load existing
-        existing_index = faiss.read_index(index_path)
-        with open(chunks_path, "rb") as f:
-            existing_chunks = pickle.load(f)
-        
-        # Merge
-        existing_index.add(new_embeddings)
-        all_chunks = existing_chunks + new_chunks
-    else:
-        # Create new
-        existing_index = faiss.IndexFlatL2(dim)
-        existing_index.add(new_embeddings)
-        all_chunks = new_chunks
-
-    # Save updated
-    faiss.write_index(existing_index, index_path)
-    with open(chunks_path, "wb") as f:
-        pickle.dump(all_chunks, f)
+# Hot indexes stay resident; writes are persisted in the background
+index_manager = IndexManager(INDEX_FOLDER)
+
+# Documents being ingested are added under staging_name() and hidden from every
+# read until rename_document() swaps them in under their real name
+STAGING_MARK = "\0ingest:"
+
+def staging_name(doc_name, tag):
+    return f"{doc_name}{STAGING_MARK}{tag}"
+
+def _hidden_ranges(entry):
+    return [r for name, ranges in entry.docs.items() if STAGING_MARK in name for r in ranges]
+
+def _visible_ids(entry):
+    """Ids of live chunks that are not staged, in id (document) order."""
+    ids = np.fromiter(entry.chunks, dtype="int64")
+    for start, end in _hidden_ranges(entry):
+        ids = ids[(ids < start) | (ids >= end)]
+    return ids.tolist()
+
+def _add_with_ids(entry, embeddings, chunks, pages=None):
+    start = entry.next_id
+    ids = np.arange(start, start + len(chunks), dtype="int64")
+    entry.chunks.append(start, chunks, pages)
+    try:
+        entry.index.add_with_ids(np.ascontiguousarray(embeddings, dtype="float32"), ids)
+    except BaseException:
+        # Keep the chunk store in step with next_id, or every later append fails
+        entry.chunks.truncate(start)
+        raise
+    entry.content_hash = None
+    entry.next_id = start + len(chunks)
+    _maybe_rebuild(entry)
+    return [start, entry.next_id]
+
+def _remove_ranges(entry, ranges):
+    if ranges:
+        entry.content_hash = None
+    for start, end in ranges:
+        remove_range(entry.index, start, end)
+        entry.chunks.remove(start, end)
+    if ranges:
+        _maybe_rebuild(entry)
+
+def _maybe_rebuild(entry):
+    """
+    Switch to a bigger index kind (flat -> HNSW -> IVF-PQ) or retrain when the
+    index has grown past what it was built for. Thresholds grow geometrically,
+    so the rebuild cost per added vector stays constant.
+    """
+    live = len(entry.chunks)
+    if not needs_rebuild(entry.index, live, entry.trained_size):
+        return
+    ids = sorted(entry.chunks)
+    entry.index = build_index(reconstruct(entry.index, ids), ids)
+    entry.trained_size = live
+
+def add_document(doc_name, embeddings, chunks, index_name="default.faiss"):
+    """
+    Add a document's chunks under their own vector ID range.
+    If the document is already indexed its old vectors are replaced in the same step,
+    so readers see either the old or the new version, never both.
+    """
+    with index_manager.writing(index_name, embeddings.shape[1]) as entry:
+        # The old version goes only once the new one is in, so a failed add keeps it
+        added = _add_with_ids(entry, embeddings, chunks)
+        _remove_ranges(entry, entry.docs.pop(doc_name, []))
+        entry.docs[doc_name] = [added]
+
+def append_document_chunks(doc_name, embeddings, chunks, index_name="default.faiss", pages=None):
+    """
+    Add one more batch of a document's chunks, extending its ID ranges (incremental ingestion).
+    pages: optional source page number per chunk, kept alongside the text.
+    """
+    with index_manager.writing(index_name, embeddings.shape[1]) as entry:
+        start, end = _add_with_ids(entry, embeddings, chunks, pages)
+        ranges = entry.docs.setdefault(doc_name, [])
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+
+def rename_document(old_name, new_name, index_name="default.faiss") -> bool:
+    """
+    Hand old_name's vectors over to new_name in one step, dropping whatever
+    new_name had before. Used to swap in a re-uploaded document once it is fully indexed.
+    Returns False, changing nothing, if old_name is not in the index (e.g. a
+    staged document removed by remove_document while it was being ingested).
+    """
+    with index_manager.writing(index_name) as entry:
+        if entry is None or old_name not in entry.docs:
+            return False
+        ranges = entry.docs.pop(old_name)
+        _remove_ranges(entry, entry.docs.pop(new_name, []))
+        entry.docs[new_name] = ranges
+        # Staged chunks become visible
+        entry.content_hash = None
+        return True
+
+def remove_document(doc_name, index_name="default.faiss") -> int:
+    """
+    Remove a document's vectors by ID, without re-embedding anything, along with
+    any staged upload of it still being ingested. Returns the number removed.
+    """
+    staged = doc_name + STAGING_MARK
+    with index_manager.writing(index_name) as entry:
+        if entry is None:
+            return 0
+        names = [name for name in entry.docs if name == doc_name or name.startswith(staged)]
+        ranges = [r for name in names for r in entry.docs.pop(name)]
+        _remove_ranges(entry, ranges)
+        empty = not entry.chunks
+    if empty:
+        delete_faiss_index(index_name)
+    return sum(end - start for start, end in ranges)
+
+def has_untracked_chunks(index_name="default.faiss") -> bool:
+    entry = index_manager.get(index_name)
+    if entry is None:
+        return False
+    with entry.lock:
+        return entry.untracked()
 
 def load_faiss_index(index_name="default.faiss"):
-    index_path = os.path.join(INDEX_FOLDER, index_name)
-    if not os.path.exists(index_path):
+    entry = index_manager.get(index_name)
+    if entry is None:
         return None, []
+    with entry.lock:
+        return entry.index, entry.chunks.get_many(_visible_ids(entry))
 
-    faiss_index = faiss.read_index(index_path)
-    with open(index_path + ".pkl", "rb") as f:
-        chunks = pickle.load(f)
-    return faiss_index, chunks
+def _search(entry, query_vecs, top_k):
+    with entry.lock, timer("faiss_search"):
+        hidden = _hidden_ranges(entry)
+        # Search past staged vectors
+        k = top_k + sum(end - start for start, end in hidden)
+        if is_tombstoning(entry.index):
+            # Deleted vectors are still in the graph; search past them
+            k += entry.index.ntotal - len(entry.chunks)
+        D, I = entry.index.search(query_vecs, min(k, max(entry.index.ntotal, 1)))
+        return [[entry.chunks[i] for i in row
+                 if i in entry.chunks and not any(start <= i < end for start, end in hidden)][:top_k] for row in I]
 
-def query_faiss(query, index_name="default.faiss", top_k=3):
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    query_vec = model.encode([query])
-    index, chunks = load_faiss_index(index_name)
-    if not index:
-        return []
+def search_faiss(query_vec, index_name="default.faiss", top_k=3):
+    """Chunks nearest to an embedded query (a (1, dim) or (dim,) vector)."""
+    return search_faiss_many(np.asarray(query_vec).reshape(1, -1), index_name, top_k)[0]
 
-    D, I = index.search(query_vec, top_k)
-    return [chunks[i] for i in I[0] if i < len(chunks)]
+def search_faiss_many(query_vecs, index_name="default.faiss", top_k=3):
+    """search_faiss for an (n, dim) array of queries, in one FAISS call. One list of chunks per query."""
+    entry = index_manager.get(index_name)
+    if entry is None:
+        return [[] for _ in query_vecs]
+    return _search(entry, np.ascontiguousarray(query_vecs, dtype="float32"), top_k)
 
 def embed_chunks(chunks):
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    embeddings = model.encode(chunks, convert_to_numpy=True, show_progress_bar=False)
-    return np.array(embeddings).astype("float32")
+    return get_embedding_service().encode(chunks)
 
 def delete_faiss_index(index_name):
-    index_path = os.path.join(INDEX_FOLDER, index_name)
-    chunks_path = index_path + ".pkl"
-    if os.path.exists(index_path):
-        os.remove(index_path)
-    if os.path.exists(chunks_path):
-        os.remove(chunks_path)
+    index_manager.delete(index_name)
 
 def get_all_chunks(index_name="default.faiss"):
     _, chunks = load_faiss_index(index_name)
     return chunks
 
+def get_leading_chunks(index_name="default.faiss", max_chars=6000):
+    """Chunks in document order until max_chars is reached; only those are read from the store."""
+    entry = index_manager.get(index_name)
+    if entry is None:
+        return []
+    chunks, used = [], 0
+    with entry.lock:
+        for i in _visible_ids(entry):
+            text = entry.chunks[i]
+            if chunks and used + len(text) > max_chars:
+                break
+            chunks.append(text)
+            used += len(text)
+    return chunks
+
+def document_set_hash(index_name="default.faiss") -> str:
+    """chunks_hash of the index's chunks, cached until the index changes. "" if there is no index."""
+    entry = index_manager.get(index_name)
+    if entry is None:
+        return ""
+    with entry.lock:
+        if entry.content_hash is None:
+            entry.content_hash = chunks_hash(entry.chunks.get_many(_visible_ids(entry)))
+        return entry.content_hash
+
 def save_chat_message_embedding(session_id, message_text):
     """
-    Embed a chat message and add it to the session's chat FAISS index.
-    """
-    index_name = f"{session_id}_chat.faiss"
-    index_path = os.path.join(INDEX_FOLDER, index_name)
-    chunks_path = index_path + ".pkl"
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    embedding = model.encode([message_text], convert_to_numpy=True, show_progress_bar=False)
-    embedding = np.array(embedding).astype("float32")
-    # Save or append
-    if os.path.exists(index_path) and os.path.exists(chunks_path):
-        index = faiss.read_index(index_path)
-        with open(chunks_path, "rb") as f:
-            messages = pickle.load(f)
-        index.add(embedding)
-        messages.append(message_text)
-        print(f"[FAISS] Appended message to index: {message_text}")
-    else:
-        index = faiss.IndexFlatL2(embedding.shape[1])
-        index.add(embedding)
-        messages = [message_text]
-        print(f"[FAISS] Created new chat index with message: {message_text}")
-    faiss.write_index(index, index_path)
-    with open(chunks_path, "wb") as f:
-        pickle.dump(messages, f)
-    print(f"[FAISS] Saved chat index and messages for session: {session_id}")
-
-def query_chat_faiss(session_id, query, top_k=5):
+    Embed a chat message and append it to the session's chat memory log.
     """
-    Query the session's chat FAISS index for relevant previous messages.
-    """
-    index_name = f"{session_id}_chat.faiss"
-    index_path = os.path.join(INDEX_FOLDER, index_name)
-    chunks_path = index_path + ".pkl"
-    if not os.path.exists(index_path) or not os.path.exists(chunks_path):
-        return []
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    query_vec = model.encode([query], convert_to_numpy=True, show_progress_bar=False)
-    index = faiss.read_index(index_path)
-    with open(chunks_path, "rb") as f:
-        messages = pickle.load(f)
-    D, I = index.search(query_vec, top_k)
-    print("[FAISS] Query results:", D, I)
-    return [messages[i] for i in I[0] if i < len(messages)]
+    embedding = embed_chunks([message_text])
+    get_chat_log(INDEX_FOLDER, session_id).append(embedding[0], message_text)
+    logger.debug("Appended message to chat memory for session %s", session_id)
+
+def search_chat(session_id, query_vec, top_k=5):
+    """The session's previous messages nearest to an embedded query."""
+    return search_chat_many(session_id, [query_vec], top_k)[0]
+
+def search_chat_many(session_id, query_vecs, top_k=5):
+    """search_chat for several queries, opening the session's chat log once."""
+    chat_log = get_chat_log(INDEX_FOLDER, session_id)
+    if not chat_log.exists():
+        return [[] for _ in query_vecs]
+    return [chat_log.search(query_vec, top_k) for query_vec in query_vecs]
 
 def delete_chat_faiss_index(session_id):
-    index_name = f"{session_id}_chat.faiss"
-    index_path = os.path.join(INDEX_FOLDER, index_name)
-    chunks_path = index_path + ".pkl"
-    if os.path.exists(index_path):
-        os.remove(index_path)
-    if os.path.exists(chunks_path):
-        os.remove(chunks_path)
\ No newline at end of file
+    delete_chat_log(INDEX_FOLDER, session_id)
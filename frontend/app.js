@@ -35,7 +35,23 @@ async function uploadDoc() {
     }
 
     const data = await res.json();
-    document.getElementById("uploadStatus").innerText = data.status;
+    document.getElementById("uploadStatus").innerText = "Processing...";
+
+    // Indexing runs in the background; poll the job until it finishes
+    while (true) {
+      await new Promise(r => setTimeout(r, 1000));
+      const job = await (await fetch(`/jobs/${data.job_id}`)).json();
+      if (job.state === "done") {
+        document.getElementById("uploadStatus").innerText = "uploaded";
+        break;
+      }
+      if (job.state === "failed") {
+        document.getElementById("uploadStatus").innerText = job.error || "Upload failed.";
+        break;
+      }
+      const pages = job.pages_total ? ` (${job.pages_done}/${job.pages_total} pages)` : "";
+      document.getElementById("uploadStatus").innerText = `Processing${pages}...`;
+    }
     await loadDocuments();
   } catch (err) {
     document.getElementById("uploadStatus").innerText = "Upload failed.";
@@ -100,13 +116,46 @@ async function ask(inputText = null) {
   formData.append("session_id", sessionId);
 
   try {
-    const res = await fetch("/ask", { method: "POST", body: formData });
-    const data = await res.json();
+    const res = await fetch("/ask/stream", { method: "POST", body: formData });
+    if (!res.ok || !res.body) throw new Error("stream failed");
+
+    // Render tokens as they arrive instead of waiting for the full answer
+    let botDiv = null, text = "", buffer = "";
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    const render = t => {
+      if (!botDiv) {
+        document.getElementById("typing-indicator")?.remove();
+        appendMessage("bot", "");
+        botDiv = chatBox.lastElementChild;
+      }
+      botDiv.innerText = `Bot: ${t}`;
+    };
 
-    document.getElementById("typing-indicator").remove();
-    appendMessage("bot", data.response || "No response.");
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const events = buffer.split("\n\n");
+      buffer = events.pop();
+      for (const evt of events) {
+        const type = (evt.match(/^event: (.*)$/m) || [])[1] || "message";
+        const dataLine = (evt.match(/^data: (.*)$/m) || [])[1];
+        if (!dataLine) continue;
+        const data = JSON.parse(dataLine);
+        if (type === "message") {
+          text += data.token;
+          render(text);
+        } else if (type === "done") {
+          render(data.response || "No response.");
+        } else if (type === "error") {
+          render(data.detail || "No response.");
+        }
+      }
+    }
+    if (!botDiv) render("No response.");
   } catch {
-    document.getElementById("typing-indicator").remove();
+    document.getElementById("typing-indicator")?.remove();
     appendMessage("bot", "Error connecting to backend.");
   } finally {
     sendBtn.disabled = false;
@@ -118,7 +167,11 @@ async function ask(inputText = null) {
 }
 
 // ===================== MIC & ASR =====================
-let socket, mediaRecorder, micOn = false, lastTranscript = "", debounceTimeout;
+let socket, mediaRecorder, micOn = false, committedTranscript = "";
+// Audio chunks are sent in order through this chain, so "end" can follow the last one
+let sendChain = Promise.resolve(), finishDictation = null;
+// How long to wait for the last utterance's transcript after "end"
+const FINAL_TRANSCRIPT_TIMEOUT_MS = 5000;
 
 function toggleMic() {
   const micBtn = document.getElementById("micToggle");
@@ -126,32 +179,63 @@ function toggleMic() {
 
   if (micOn) {
     micIcon.className = "fas fa-microphone-slash";
-    mediaRecorder.stop();
-    socket.close();
     micOn = false;
-    document.getElementById("micStatus").innerText = "Mic is OFF";
-    const finalText = document.getElementById("question").value.trim();
-    if (finalText && !isBotProcessing) ask(finalText);
+    micBtn.disabled = true;
+    document.getElementById("micStatus").innerText = "Finishing transcription...";
+    const ws = socket;
+    let timer;
+    finishDictation = () => {
+      finishDictation = null;
+      clearTimeout(timer);
+      ws.close();
+      micBtn.disabled = false;
+      document.getElementById("micStatus").innerText = "Mic is OFF";
+      const finalText = document.getElementById("question").value.trim();
+      if (finalText && !isBotProcessing) ask(finalText);
+    };
+    // The recorder's last dataavailable fires before stop: send it, then ask the
+    // server to commit the utterance in progress and wait for its transcript
+    mediaRecorder.onstop = () => {
+      mediaRecorder.stream.getTracks().forEach(track => track.stop());
+      sendChain.then(() => {
+        if (ws.readyState === WebSocket.OPEN) ws.send("end");
+        // Nothing may have been in progress, in which case no transcript comes
+        timer = setTimeout(() => finishDictation && finishDictation(), FINAL_TRANSCRIPT_TIMEOUT_MS);
+      });
+    };
+    mediaRecorder.stop();
     return;
   }
 
   micBtn.disabled = true;
   navigator.mediaDevices.getUserMedia({ audio: true }).then(stream => {
     socket = new WebSocket("ws://localhost:8000/ws/asr");
+    committedTranscript = "";
     socket.onmessage = e => {
-      const transcript = e.data.trim();
-      if (!transcript || transcript === lastTranscript) return;
-      lastTranscript = transcript;
-      clearTimeout(debounceTimeout);
-      debounceTimeout = setTimeout(() => {
-        document.getElementById("question").value = transcript;
-      }, 400);
+      // "final" text is committed; "partial" text may still change
+      const msg = JSON.parse(e.data);
+      if (msg.type === "busy") {
+        document.getElementById("micStatus").innerText = "Server busy: some speech was not transcribed";
+      } else {
+        const text = (msg.text || "").trim();
+        if (msg.type === "final" && text) {
+          committedTranscript = `${committedTranscript} ${text}`.trim();
+        }
+        const provisional = msg.type === "partial" ? text : "";
+        document.getElementById("question").value = `${committedTranscript} ${provisional}`.trim();
+      }
+      // After "end": the last utterance's outcome is in
+      if (finishDictation && msg.type !== "partial") finishDictation();
     };
 
     mediaRecorder = new MediaRecorder(stream, { mimeType: "audio/webm" });
+    sendChain = Promise.resolve();
+    const ws = socket;
     mediaRecorder.ondataavailable = e => {
-      if (e.data.size > 0 && socket.readyState === WebSocket.OPEN) {
-        e.data.arrayBuffer().then(buff => socket.send(buff));
+      if (e.data.size > 0) {
+        sendChain = sendChain
+          .then(() => e.data.arrayBuffer())
+          .then(buff => { if (ws.readyState === WebSocket.OPEN) ws.send(buff); });
       }
     };
     mediaRecorder.start(250);
@@ -195,13 +279,14 @@ function showDeleteChatModal(onConfirm) {
   };
 }
 
-async function loadChatHistory() {
+async function loadChatHistory(cursor = null) {
   try {
-    const res = await fetch("/chats");
-    const chats = await res.json();
+    const res = await fetch(cursor === null ? "/chats" : `/chats?cursor=${encodeURIComponent(cursor)}`);
+    const data = await res.json();
     const container = document.getElementById("chatHistory");
-    container.innerHTML = "";
-    chats.forEach(c => {
+    if (cursor === null) container.innerHTML = "";
+    container.querySelector(".load-more-chats")?.remove();
+    data.sessions.forEach(c => {
       const div = document.createElement("div");
       div.classList.add("chat-item");
       div.textContent = c.preview || c.session_id;
@@ -217,6 +302,13 @@ async function loadChatHistory() {
       div.appendChild(del);
       container.appendChild(div);
     });
+    if (data.next_cursor !== null) {
+      const more = document.createElement("div");
+      more.className = "chat-item load-more-chats";
+      more.textContent = "Load more";
+      more.onclick = () => loadChatHistory(data.next_cursor);
+      container.appendChild(more);
+    }
   } catch {
     console.error("Failed loading chats");
   }
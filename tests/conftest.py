@@ -0,0 +1,55 @@
+# tests/conftest.py
+import os
+import sys
+import hashlib
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DIM = 32
+
+def fake_vectors(texts):
+    """Deterministic unit vectors per text, standing in for the embedding model."""
+    rows = [np.random.default_rng(int(hashlib.md5(text.encode()).hexdigest()[:8], 16)).standard_normal(DIM) for text in texts]
+    vectors = np.asarray(rows, dtype="float32").reshape(-1, DIM)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+class FakeEmbeddingService:
+    cache = None
+    dim = DIM
+
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts):
+        texts = [texts] if isinstance(texts, str) else list(texts)
+        self.calls.append(len(texts))
+        return fake_vectors(texts)
+
+@pytest.fixture
+def fake_embeddings(monkeypatch):
+    from components import vector_store
+    service = FakeEmbeddingService()
+    monkeypatch.setattr(vector_store, "get_embedding_service", lambda: service)
+    return service
+
+@pytest.fixture
+def index_folder(monkeypatch, tmp_path):
+    """Indexes and chat logs in a temporary folder instead of vector_store/."""
+    from components import vector_store
+    from components.index_cache import IndexManager
+    folder = str(tmp_path / "vector_store")
+    os.makedirs(folder)
+    monkeypatch.setattr(vector_store, "INDEX_FOLDER", folder)
+    monkeypatch.setattr(vector_store, "index_manager", IndexManager(folder))
+    return folder
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    from components import memory_store
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(memory_store, "redis", fakeredis.FakeRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(memory_store, "aredis", fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+    return memory_store.redis
@@ -0,0 +1,38 @@
+# tests/test_ask_concurrency.py
+import socket
+import asyncio
+import time
+import pytest
+from components import llm_ollama, response_cache
+from agents.graph_builder import build_graph
+
+N = 8
+
+@pytest.fixture
+def fake_ollama(monkeypatch):
+    from benchmarks.fake_ollama import start_in_thread
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = start_in_thread(port, latency=0.3, tokens=5, tokens_per_sec=50)
+    monkeypatch.setattr(llm_ollama.ollama_client, "base_url", f"http://127.0.0.1:{port}")
+    yield server
+    server.should_exit = True
+
+async def timed_runs(graph):
+    start = time.perf_counter()
+    await graph.ainvoke({"input": "What does my HbA1c mean?", "session_id": "single"})
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[
+        graph.ainvoke({"input": "What does my HbA1c mean?", "session_id": f"session-{i}"}) for i in range(N)
+    ])
+    return single, time.perf_counter() - start, [r["response"] for r in results]
+
+def test_concurrent_asks_overlap(monkeypatch, fake_ollama, fake_redis, fake_embeddings, index_folder):
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_ENABLED", False)
+    single, concurrent, responses = asyncio.run(timed_runs(build_graph()))
+    assert all(r.startswith("token0") for r in responses), responses
+    # Serialized calls would take about N times as long as one
+    assert concurrent < 2 * single
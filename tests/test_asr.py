@@ -0,0 +1,105 @@
+# tests/test_asr.py
+import json
+import asyncio
+import threading
+import numpy as np
+import pytest
+from components import asr
+from components.asr_pool import ASRPool
+
+class FakeWebSocket:
+    """
+    Plays messages back as fast as they are read; a callable among them is
+    waited on instead. After the last one waits for `until` before disconnecting.
+    """
+    def __init__(self, messages, until):
+        self.messages = list(messages)
+        self.until = until
+        self.sent = []
+
+    async def receive(self):
+        if not self.messages:
+            for _ in range(500):
+                if self.until(self):
+                    break
+                await asyncio.sleep(0.01)
+            return {"type": "websocket.disconnect"}
+        message = self.messages.pop(0)
+        while callable(message):
+            for _ in range(500):
+                if message():
+                    break
+                await asyncio.sleep(0.01)
+            message = self.messages.pop(0)
+        return message
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+def speech(seconds):
+    t = np.arange(int(asr.SAMPLE_RATE * seconds)) / asr.SAMPLE_RATE
+    return {"type": "websocket.receive", "bytes": (0.3 * np.sin(2 * np.pi * 220 * t) * 32767).astype(np.int16).tobytes()}
+
+def silence(seconds):
+    return {"type": "websocket.receive", "bytes": np.zeros(int(asr.SAMPLE_RATE * seconds), dtype=np.int16).tobytes()}
+
+END = {"type": "websocket.receive", "text": "end"}
+
+@pytest.fixture
+def pool(monkeypatch, tmp_path):
+    """A one-worker pool whose decoder waits for `gate`, then names the job by its audio length."""
+    monkeypatch.setattr(asr, "AUDIO_DIR", str(tmp_path))
+    pool = ASRPool(workers=1, max_queued_per_session=2)
+    pool.model = object()
+    pool.gate = threading.Event()
+    pool.decoded = []
+
+    def decode(job):
+        pool.gate.wait(5)
+        pool.decoded.append("final" if not job.droppable else "partial")
+        return f"{len(job.audio) / asr.SAMPLE_RATE:.1f}s"
+
+    monkeypatch.setattr(pool, "_decode", decode)
+    threading.Thread(target=pool._run, daemon=True).start()
+    monkeypatch.setattr(asr, "asr_pool", pool)
+    yield pool
+    pool.gate.set()
+
+def test_partials_supersede_and_full_queue_sends_busy(pool):
+    def until(websocket):
+        # Everything has been read while the worker was held up: let it go
+        pool.gate.set()
+        return any(m["type"] == "busy" for m in websocket.sent) and pool.stats()["queue_depth"] == 0 and not pool.busy
+
+    websocket = FakeWebSocket([
+        speech(1.1),   # partial 1: taken by the worker, which is held up
+        lambda: pool.busy,
+        speech(1.0),   # partial 2: queued
+        speech(1.0),   # partial 3: replaces partial 2
+        silence(0.7),  # final 1: queued next to partial 3, filling the session's queue
+        speech(0.5),
+        END,           # final 2: rejected, reported as busy
+    ], until)
+    asyncio.run(asr.stream_asr(websocket))
+
+    assert pool.dropped == 1
+    assert pool.rejected == 1
+    # Partial 2 was never decoded; the final covers all of utterance 1
+    assert pool.decoded == ["partial", "partial", "final"]
+    assert websocket.sent == [
+        {"type": "partial", "text": "1.1s"},
+        {"type": "partial", "text": "3.1s"},
+        {"type": "final", "text": "3.7s"},
+        {"type": "busy"},
+    ]
+    # The socket kept reading while the worker was blocked: all messages were consumed
+    assert not websocket.messages
+
+def test_receive_loop_is_not_blocked_by_transcription(pool):
+    # Nothing is ever transcribed, yet every frame is read and the session then ends cleanly
+    websocket = FakeWebSocket([speech(1.1)] + [speech(0.2)] * 20 + [END], lambda websocket: True)
+    asyncio.run(asr.stream_asr(websocket))
+    assert not websocket.messages
+    assert websocket.sent == []
+    # The disconnected session's queued work was dropped
+    assert pool.stats()["queue_depth"] == 0
@@ -0,0 +1,45 @@
+# tests/test_batch_qa.py
+import asyncio
+from agents import batch_qa
+from components import document_loader
+from components.vector_store import add_document, embed_chunks
+
+class InFlight:
+    """Fake LLM call recording how many calls overlap."""
+    def __init__(self):
+        self.now = self.peak = self.calls = 0
+
+    async def __call__(self, *_):
+        self.now += 1
+        self.calls += 1
+        self.peak = max(self.peak, self.now)
+        await asyncio.sleep(0.01)
+        self.now -= 1
+
+async def collect(items, concurrency):
+    return [result async for result in batch_qa.arun_batch(items, concurrency)]
+
+def test_llm_calls_stay_within_concurrency(monkeypatch, fake_embeddings, index_folder, fake_redis):
+    chunks = [f"Lab result {i}: glucose and cholesterol values for the patient." for i in range(40)]
+    add_document("labs.pdf", embed_chunks(chunks), chunks, "patient-a.faiss")
+
+    llm = InFlight()
+
+    async def summarize(batch):
+        await llm()
+        return f"summary of {len(batch)} chunks"
+
+    async def query_llm(state):
+        await llm()
+        return {"response": "answer", "cached": False, "tokens": {}}
+
+    # 40 chunks make 5 first-level batches, more than the batch's 2 slots
+    monkeypatch.setattr(document_loader, "asummarize_chunks_with_llm", summarize)
+    monkeypatch.setattr(batch_qa, "query_llm", query_llm)
+    items = [{"id": i, "session_id": "patient-a", "question": question}
+             for i, question in enumerate(["summarize my labs", "is my glucose normal?", "what about cholesterol?"])]
+    results = asyncio.run(collect(items, concurrency=2))
+
+    assert [r["error"] for r in results] == [None] * 3
+    assert llm.calls > 5
+    assert llm.peak == 2
@@ -0,0 +1,15 @@
+# tests/test_context_packer.py
+import logging
+from components.context_packer import TokenCounter
+
+def test_missing_tokenizer_warns_and_estimates(tmp_path, caplog):
+    counter = TokenCounter(str(tmp_path / "tokenizer.json"))
+    with caplog.at_level(logging.WARNING, logger="components.context_packer"):
+        assert counter.count("abcdefgh") == 2
+    assert not counter.exact
+    assert "estimating token counts" in caplog.text
+
+def test_unset_tokenizer_path_warns(caplog):
+    with caplog.at_level(logging.WARNING, logger="components.context_packer"):
+        assert TokenCounter("").count_many(["abcd", "abcde"]) == [1, 2]
+    assert "TOKENIZER_PATH is not set" in caplog.text
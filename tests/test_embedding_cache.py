@@ -0,0 +1,29 @@
+# tests/test_embedding_cache.py
+import numpy as np
+from components.embedding_cache import EmbeddingCache, cache_key
+from components.embedding_service import EmbeddingService
+from conftest import DIM
+
+def test_backends_do_not_share_cache_entries():
+    keys = {cache_key("all-MiniLM-L6-v2", "glucose  result", backend) for backend in ("torch", "onnx", "onnx-int8")}
+    assert len(keys) == 3
+
+def test_cache_key_ignores_whitespace_runs():
+    assert cache_key("m", "glucose  result\n") == cache_key("m", "glucose result")
+
+def test_service_variant():
+    assert EmbeddingService(backend="torch").variant == "torch"
+    assert EmbeddingService(backend="onnx", int8=False).variant == "onnx"
+    assert EmbeddingService(backend="onnx", int8=True).variant == "onnx-int8"
+
+def test_size_bound_is_shared_by_workers(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    vector = np.zeros(DIM, dtype="float32")
+    # Two workers on one file; together they stay within the budget of one
+    workers = [EmbeddingCache(path, max_bytes=10 * vector.nbytes) for _ in range(2)]
+    for i in range(20):
+        workers[i % 2].put_many([(cache_key("m", f"chunk {i}"), vector)])
+    sizes = [w._connect().execute("SELECT SUM(LENGTH(vector)) FROM embeddings").fetchone()[0] for w in workers]
+    assert sizes[0] <= 10 * vector.nbytes
+    assert [w.stats()["bytes"] for w in workers][1] == sizes[0]
+    assert sum(w.evictions for w in workers) > 0
@@ -0,0 +1,72 @@
+# tests/test_index_cache.py
+import os
+import time
+import threading
+import numpy as np
+import pytest
+from filelock import Timeout
+from components import index_cache, vector_store
+from components.index_cache import IndexManager
+from conftest import DIM, fake_vectors
+
+def add(name, texts, index_name="patient-a.faiss"):
+    vector_store.add_document(name, fake_vectors(texts), texts, index_name)
+
+def other_process(folder):
+    """A second worker on the same folder: its own manager and file locks."""
+    return IndexManager(folder)
+
+@pytest.mark.parametrize("published", [True, False])
+def test_failed_write_releases_the_index(monkeypatch, index_folder, published):
+    monkeypatch.setattr(index_cache, "INDEX_LOCK_TIMEOUT", 0.5)
+    add("labs.pdf", ["glucose 5.4", "cholesterol 6.1"])
+    if published:
+        vector_store.index_manager.flush_all()
+
+    with pytest.raises(AssertionError):
+        # Wrong dimension: FAISS rejects the vectors
+        vector_store.add_document("bad.pdf", np.zeros((2, DIM + 1), dtype="float32"), ["a", "b"], "patient-a.faiss")
+    vector_store.index_manager.flush_all()
+
+    other = other_process(index_folder)
+    with other.writing("patient-a.faiss") as entry:
+        assert list(entry.docs) == ["labs.pdf"]
+        assert entry.chunks.size == entry.next_id == 2
+    other.flush_all()
+
+    add("notes.pdf", ["creatinine 80"])
+    assert sorted(vector_store.get_all_chunks("patient-a.faiss")) == ["cholesterol 6.1", "creatinine 80", "glucose 5.4"]
+
+def test_unpublished_deletions_are_invisible_to_readers(index_folder):
+    add("labs.pdf", ["glucose 5.4", "cholesterol 6.1"])
+    add("notes.pdf", ["creatinine 80"])
+    vector_store.index_manager.flush_all()
+
+    vector_store.remove_document("labs.pdf", "patient-a.faiss")
+    entry = other_process(index_folder).get("patient-a.faiss")
+    assert sorted(entry.chunks[i] for i in entry.chunks) == ["cholesterol 6.1", "creatinine 80", "glucose 5.4"]
+
+    vector_store.index_manager.flush_all()
+    entry = other_process(index_folder).get("patient-a.faiss")
+    assert [entry.chunks[i] for i in entry.chunks] == ["creatinine 80"]
+
+def test_delete_removes_the_lock_file(monkeypatch, index_folder):
+    monkeypatch.setattr(index_cache, "INDEX_LOCK_TIMEOUT", 2)
+    add("labs.pdf", ["glucose 5.4"])
+    vector_store.index_manager.flush_all()
+    vector_store.delete_faiss_index("patient-a.faiss")
+    assert os.listdir(index_folder) == []
+
+    # A process waiting for the index while it is deleted ends up owning it alone
+    add("labs.pdf", ["glucose 5.4"])
+    waiting = other_process(index_folder)
+    thread = threading.Thread(target=waiting._acquire, args=("patient-a.faiss",))
+    thread.start()
+    time.sleep(0.2)
+    vector_store.delete_faiss_index("patient-a.faiss")
+    thread.join()
+    assert "patient-a.faiss" in waiting._owned
+    monkeypatch.setattr(index_cache, "INDEX_LOCK_TIMEOUT", 0.2)
+    with pytest.raises(Timeout):
+        other_process(index_folder)._acquire("patient-a.faiss")
+    waiting._release("patient-a.faiss")
@@ -0,0 +1,86 @@
+# tests/test_ingest.py
+import io
+import os
+import asyncio
+import pytest
+from components import ingest
+
+docx = pytest.importorskip("docx")
+
+class FakeUpload:
+    def __init__(self, data: bytes):
+        self.file = io.BytesIO(data)
+
+    async def read(self, size=-1):
+        return self.file.read(size)
+
+def docx_bytes(text):
+    document = docx.Document()
+    for line in text.split("\n"):
+        document.add_paragraph(line)
+    out = io.BytesIO()
+    document.save(out)
+    return out.getvalue()
+
+async def upload(folder, data, session_id="patient-a", filename="labs.docx"):
+    path = os.path.join(folder, f"{session_id}_{filename}")
+    staged = await ingest.save_upload(FakeUpload(data), path)
+    job = await ingest.start_ingest(staged, path, session_id, filename)
+    await asyncio.gather(*ingest._tasks)
+    return path, await ingest.get_job(job["job_id"])
+
+@pytest.fixture
+def uploads(tmp_path):
+    folder = tmp_path / "uploads"
+    folder.mkdir()
+    return str(folder)
+
+def test_upload_replaces_file_once_indexed(fake_redis, fake_embeddings, index_folder, uploads):
+    text = "\n".join(f"Glucose result {i} is within the reference range for a fasting sample." for i in range(40))
+    # Built once: the archive records the time it was written
+    data = docx_bytes(text)
+    path, job = asyncio.run(upload(uploads, data))
+
+    assert job["state"] == "done", job["error"]
+    assert job["chunks_done"] > 0
+    assert open(path, "rb").read() == data
+    assert os.listdir(uploads) == [os.path.basename(path)]
+
+def test_failed_reupload_keeps_previous_file(fake_redis, fake_embeddings, index_folder, uploads):
+    path = os.path.join(uploads, "patient-a_labs.docx")
+    with open(path, "wb") as f:
+        f.write(b"previous upload")
+
+    path, job = asyncio.run(upload(uploads, docx_bytes("too short")))
+
+    assert job["state"] == "failed"
+    assert open(path, "rb").read() == b"previous upload"
+    assert os.listdir(uploads) == ["patient-a_labs.docx"]
+
+def test_delete_during_ingest_is_not_undone(monkeypatch, fake_redis, fake_embeddings, index_folder, uploads):
+    from components import vector_store
+    path = os.path.join(uploads, "patient-a_labs.docx")
+    embed = ingest.embed_chunks
+
+    def embed_then_delete(chunks):
+        # What /delete_doc does, arriving while the document is being embedded
+        ingest.discard_uploads(path)
+        if os.path.exists(path):
+            os.remove(path)
+        vector_store.remove_document("labs.docx", "patient-a.faiss")
+        return embed(chunks)
+
+    monkeypatch.setattr(ingest, "embed_chunks", embed_then_delete)
+    text = "\n".join(f"Glucose result {i} is within the reference range for a fasting sample." for i in range(40))
+    _, job = asyncio.run(upload(uploads, docx_bytes(text)))
+
+    assert job["state"] == "failed"
+    assert "deleted" in job["error"]
+    assert vector_store.get_all_chunks("patient-a.faiss") == []
+    assert os.listdir(uploads) == []
+
+def test_job_state_is_readable_from_redis(fake_redis, fake_embeddings, index_folder, uploads):
+    _, job = asyncio.run(upload(uploads, docx_bytes("too short")))
+    # What another worker sees: nothing but the Redis record
+    assert asyncio.run(ingest.get_job(job["job_id"])) == job
+    assert asyncio.run(ingest.get_job("no-such-job")) is None
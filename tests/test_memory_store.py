@@ -0,0 +1,39 @@
+# tests/test_memory_store.py
+from components import memory_store
+
+def add_sessions(redis, scores):
+    redis.set(memory_store.SESSIONS_MIGRATED_KEY, 1)
+    for session_id, score in scores.items():
+        redis.zadd(memory_store.SESSION_INDEX_KEY, {session_id: score})
+        redis.hset(memory_store.get_session_meta_key(session_id), mapping={"created": "", "preview": session_id})
+
+def all_pages(limit, between_pages=lambda page: None):
+    seen, cursor = [], None
+    while True:
+        page = memory_store.list_sessions(cursor=cursor, limit=limit)
+        seen.extend(s["session_id"] for s in page["sessions"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return seen
+        between_pages(page)
+
+def test_pagination_returns_sessions_with_tied_scores(fake_redis):
+    # Legacy sessions without a parseable date are all migrated with score 0
+    scores = {f"legacy-{i}": 0 for i in range(7)}
+    scores.update({"new-a": 300.5, "new-b": 200.25, "new-c": 200.25})
+    add_sessions(fake_redis, scores)
+
+    seen = all_pages(limit=2)
+    assert sorted(seen) == sorted(scores)
+    assert seen[:3] == ["new-a", "new-c", "new-b"]
+
+def test_pagination_survives_the_cursor_session_moving(fake_redis):
+    scores = {f"legacy-{i}": 0 for i in range(7)}
+    add_sessions(fake_redis, scores)
+
+    def touch_last(page):
+        # New activity in the session the cursor points at
+        fake_redis.zadd(memory_store.SESSION_INDEX_KEY, {page["sessions"][-1]["session_id"]: 1000})
+
+    seen = all_pages(limit=3, between_pages=touch_last)
+    assert sorted(seen) == sorted(scores)
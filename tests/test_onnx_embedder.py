@@ -0,0 +1,35 @@
+# tests/test_onnx_embedder.py
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("onnxruntime")
+pytest.importorskip("tokenizers")
+
+from components.embedding_service import EMBED_MODEL_NAME
+from components.onnx_embedder import OnnxEmbedder
+
+TEXTS = [
+    "What does my HbA1c mean?",
+    "Fasting glucose 5.4 mmol/L, within the reference range of 3.9-5.6 mmol/L.",
+    "Total cholesterol 6.1 mmol/L (elevated); triglycerides 1.2 mmol/L; HDL 1.4 mmol/L.",
+    " ".join(["creatinine"] * 400),  # past the model's max sequence length
+]
+
+@pytest.fixture(scope="module")
+def torch_vectors():
+    from sentence_transformers import SentenceTransformer
+    try:
+        model = SentenceTransformer(EMBED_MODEL_NAME, device="cpu")
+    except Exception as e:
+        pytest.skip(f"{EMBED_MODEL_NAME} unavailable: {e}")
+    return model.encode(TEXTS, convert_to_numpy=True)
+
+@pytest.mark.parametrize("quantize, tolerance", [(False, 0.9999), (True, 0.98)])
+def test_onnx_matches_torch(torch_vectors, tmp_path_factory, quantize, tolerance):
+    folder = tmp_path_factory.getbasetemp() / "onnx"
+    vectors = OnnxEmbedder(EMBED_MODEL_NAME, quantize=quantize, folder=str(folder)).encode(TEXTS, batch_size=2)
+    cos = np.sum(vectors * torch_vectors, axis=1) / (
+        np.linalg.norm(vectors, axis=1) * np.linalg.norm(torch_vectors, axis=1))
+    assert cos.min() >= tolerance
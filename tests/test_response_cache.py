@@ -0,0 +1,29 @@
+# tests/test_response_cache.py
+import asyncio
+from components import response_cache
+from components.response_cache import ResponseCache
+from conftest import fake_vectors
+
+def _lookup(question, session_id):
+    return asyncio.run(response_cache.alookup(question, session_id, fake_vectors([question])[0]))
+
+def test_sessions_with_the_same_documents_do_not_share_answers(monkeypatch):
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_ENABLED", True)
+    monkeypatch.setattr(response_cache, "response_cache", ResponseCache())
+    monkeypatch.setattr(response_cache, "document_set_hash", lambda index_name: "same-documents")
+
+    key, cached = _lookup("what does my hba1c mean?", "patient-a")
+    assert cached is None
+    response_cache.store(key, "answer drawing on patient a's chat")
+
+    assert _lookup("what does my hba1c mean?", "patient-b")[1] is None
+    assert _lookup("what does my hba1c mean?", "patient-a")[1] == "answer drawing on patient a's chat"
+
+def test_sessions_without_documents_do_not_share_answers(monkeypatch):
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_ENABLED", True)
+    monkeypatch.setattr(response_cache, "response_cache", ResponseCache())
+    monkeypatch.setattr(response_cache, "document_set_hash", lambda index_name: "")
+
+    key, _ = _lookup("i have a headache", "patient-a")
+    response_cache.store(key, "answer")
+    assert _lookup("i have a headache", "patient-b")[1] is None
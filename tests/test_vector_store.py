@@ -0,0 +1,53 @@
+# tests/test_vector_store.py
+import numpy as np
+import pytest
+from components import vector_store
+from conftest import DIM, fake_vectors
+
+def add(name, texts, index_name="patient-a.faiss"):
+    vector_store.add_document(name, fake_vectors(texts), texts, index_name)
+
+def test_failed_add_keeps_the_index_writable(index_folder):
+    add("labs.pdf", ["glucose 5.4", "cholesterol 6.1"])
+    with vector_store.index_manager.writing("patient-a.faiss") as entry:
+        with pytest.raises(AssertionError):
+            vector_store._add_with_ids(entry, np.zeros((1, DIM + 1), dtype="float32"), ["bad"])
+        assert entry.chunks.size == entry.next_id == 2
+        assert vector_store._add_with_ids(entry, fake_vectors(["creatinine 80"]), ["creatinine 80"]) == [2, 3]
+
+def test_failed_reupload_keeps_the_old_document(index_folder):
+    add("labs.pdf", ["glucose 5.4", "cholesterol 6.1"])
+    with pytest.raises(AssertionError):
+        vector_store.add_document("labs.pdf", np.zeros((1, DIM + 1), dtype="float32"), ["new labs"], "patient-a.faiss")
+    assert sorted(vector_store.get_all_chunks("patient-a.faiss")) == ["cholesterol 6.1", "glucose 5.4"]
+
+    add("labs.pdf", ["glucose 4.9"])
+    assert vector_store.get_all_chunks("patient-a.faiss") == ["glucose 4.9"]
+
+def test_staged_document_is_hidden_until_renamed(index_folder):
+    add("labs.pdf", ["glucose 5.4", "cholesterol 6.1"])
+    before = vector_store.document_set_hash("patient-a.faiss")
+    staged = vector_store.staging_name("labs.pdf", "job-1")
+    new = ["glucose 4.9", "cholesterol 5.2"]
+    vector_store.append_document_chunks(staged, fake_vectors(new), new, "patient-a.faiss")
+
+    # Old version only: searches, summaries and the document set hash
+    assert sorted(vector_store.get_all_chunks("patient-a.faiss")) == ["cholesterol 6.1", "glucose 5.4"]
+    assert sorted(vector_store.get_leading_chunks("patient-a.faiss")) == ["cholesterol 6.1", "glucose 5.4"]
+    found = vector_store.search_faiss_many(fake_vectors(new), "patient-a.faiss", top_k=4)
+    assert all(sorted(chunks) == ["cholesterol 6.1", "glucose 5.4"] for chunks in found)
+    assert vector_store.document_set_hash("patient-a.faiss") == before
+
+    assert vector_store.rename_document(staged, "labs.pdf", "patient-a.faiss")
+    assert sorted(vector_store.get_all_chunks("patient-a.faiss")) == sorted(new)
+    assert vector_store.document_set_hash("patient-a.faiss") != before
+
+def test_removing_a_document_drops_its_staged_upload(index_folder):
+    add("labs.pdf", ["glucose 5.4"])
+    staged = vector_store.staging_name("labs.pdf", "job-1")
+    vector_store.append_document_chunks(staged, fake_vectors(["glucose 4.9"]), ["glucose 4.9"], "patient-a.faiss")
+    add("notes.pdf", ["creatinine 80"])
+
+    assert vector_store.remove_document("labs.pdf", "patient-a.faiss") == 2
+    assert not vector_store.rename_document(staged, "labs.pdf", "patient-a.faiss")
+    assert vector_store.get_all_chunks("patient-a.faiss") == ["creatinine 80"]